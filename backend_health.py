@@ -0,0 +1,155 @@
+"""
+LLMバックエンドのヘルス管理（サーキットブレーカー）
+プロセス全体で共有し、停止中のバックエンドへの呼び出しを即座にスキップする
+"""
+
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+CLOSED = "closed"        # 正常（呼び出し可）
+OPEN = "open"            # 遮断中（呼び出しをスキップ）
+HALF_OPEN = "half_open"  # 試行中（1件だけ呼び出しを通す）
+
+# 回路を開くまでの連続失敗回数（1回の一時的なエラーで全ジョブを止めないため複数回）
+DEFAULT_FAILURE_THRESHOLD = 3
+
+
+def is_outage(error: BaseException) -> bool:
+    """バックエンドの障害とみなすエラーか（接続失敗・タイムアウト・5xx・429）
+
+    4xx（モデルが見つからない・リクエスト不正など）はバックエンド自体は動いているので数えない。
+    HTTPステータスは TransportError.status / OpenAIの例外の status_code から読む。
+    """
+    status = getattr(error, "status", None) or getattr(error, "status_code", None)
+    return not isinstance(status, int) or status >= 500 or status == 429
+
+
+@dataclass
+class BackendState:
+    """バックエンド1つ分の状態"""
+    state: str = CLOSED
+    consecutive_failures: int = 0
+    opened_at: float = 0.0
+    last_error: str = ""
+    probing: bool = False
+
+
+class BackendHealthRegistry:
+    """バックエンドごとの障害を記録し、回路の開閉を管理するレジストリ
+
+    - 連続失敗が failure_threshold 回に達すると回路を開き、以後の呼び出しをスキップする
+    - プローブ関数が登録されていれば、バックグラウンドで probe_interval 秒ごとに
+      死活確認し、応答が戻った時点で回路を閉じる
+    - プローブがないバックエンドは cooldown_sec 経過後に1件だけ試行を通す（half-open）
+    """
+
+    def __init__(self, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD, cooldown_sec: float = 30.0,
+                 probe_interval: float = 5.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown_sec = cooldown_sec
+        self.probe_interval = probe_interval
+        self._states: Dict[str, BackendState] = {}
+        self._probes: Dict[str, Callable[[], bool]] = {}
+        self._lock = threading.Lock()
+
+    def _state(self, name: str) -> BackendState:
+        if name not in self._states:
+            self._states[name] = BackendState()
+        return self._states[name]
+
+    def register_probe(self, name: str, probe: Callable[[], bool]) -> None:
+        """死活確認関数を登録（Trueを返せば復旧とみなす）"""
+        with self._lock:
+            self._probes[name] = probe
+
+    def allow(self, name: str) -> bool:
+        """呼び出してよいかを返す（遮断中なら即座にFalse）"""
+        with self._lock:
+            st = self._state(name)
+            if st.state == CLOSED:
+                return True
+            if st.state == OPEN and name not in self._probes \
+                    and time.time() - st.opened_at >= self.cooldown_sec:
+                st.state = HALF_OPEN
+                return True
+            return False
+
+    def record_success(self, name: str) -> None:
+        """呼び出し成功を記録（回路を閉じる）"""
+        with self._lock:
+            st = self._state(name)
+            st.state = CLOSED
+            st.consecutive_failures = 0
+            st.last_error = ""
+
+    def record_failure(self, name: str, error: str = "") -> None:
+        """呼び出し失敗を記録（閾値到達で回路を開く）"""
+        with self._lock:
+            st = self._state(name)
+            st.consecutive_failures += 1
+            st.last_error = error
+            if st.state == HALF_OPEN or st.consecutive_failures >= self.failure_threshold:
+                if st.state != OPEN:
+                    st.state = OPEN
+                    st.opened_at = time.time()
+                start_probe = name in self._probes and not st.probing
+                if start_probe:
+                    st.probing = True
+            else:
+                start_probe = False
+        if start_probe:
+            threading.Thread(target=self._probe_loop, args=(name,), daemon=True,
+                             name=f"health-probe-{name}").start()
+
+    def _probe_loop(self, name: str) -> None:
+        """回路が閉じるまでバックグラウンドで死活確認を繰り返す"""
+        while True:
+            time.sleep(self.probe_interval)
+            with self._lock:
+                st = self._state(name)
+                probe = self._probes.get(name)
+                if st.state != OPEN or probe is None:
+                    st.probing = False
+                    return
+            try:
+                alive = probe()
+            except Exception:
+                alive = False
+            if alive:
+                with self._lock:
+                    st = self._state(name)
+                    st.state = CLOSED
+                    st.consecutive_failures = 0
+                    st.last_error = ""
+                    st.probing = False
+                return
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """全バックエンドの状態を辞書で返す"""
+        with self._lock:
+            return {
+                name: {
+                    "state": st.state,
+                    "consecutive_failures": st.consecutive_failures,
+                    "last_error": st.last_error,
+                }
+                for name, st in self._states.items()
+            }
+
+    def reset(self, name: Optional[str] = None) -> None:
+        """状態を初期化（name省略時は全バックエンド）"""
+        with self._lock:
+            if name is None:
+                self._states.clear()
+            else:
+                self._states.pop(name, None)
+
+
+_registry = BackendHealthRegistry()
+
+
+def get_health_registry() -> BackendHealthRegistry:
+    """プロセス全体で共有するレジストリを返す"""
+    return _registry
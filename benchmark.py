@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+CPU側の処理のマイクロベンチマーク
+バリデート（validate_all / get_validation_report）・出力の分割（_split_output）・プロンプト構築
+（build_prompt）・参考資料の検索を、デモ出力をもとにした1〜500ページの合成台本で計測し、
+結果をJSONに保存する。保存済みのベースラインより閾値以上遅くなったケースがあれば終了コード1を返す
+
+  python benchmark.py                          # 計測して output/benchmark.json に保存、ベースラインと比較
+  python benchmark.py --save-baseline          # 計測結果をベースライン（benchmark_baseline.json）として保存
+  python benchmark.py --sizes 1 100 --only validate_all get_validation_report
+  python benchmark.py --normalize              # 別のマシンで取ったベースラインとマシンの速さを補正して比較
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from llm_generator import GenerationConfig, LLMSlideGenerator
+from main import build_user_input
+from validator import SlideValidator
+
+# 合成台本のページ数
+DEFAULT_SIZES = (1, 10, 100, 500)
+# 1回の計測（number回の呼び出し）の最短時間（秒）。短い処理は回数を増やしてタイマーの誤差を抑える
+MIN_MEASURE_SEC = 0.1
+DEFAULT_REPEAT = 7
+# ベースラインからの許容倍率（最小時間で比較。共有マシンの揺らぎを見込んだ値）
+DEFAULT_THRESHOLD = 1.5
+# キャリブレーション1回あたりの繰り返し回数（ケースの前後で測るため計測より少なくする）
+CALIBRATION_REPEAT = 3
+# この差（ミリ秒）未満の遅れは誤差として扱う
+NOISE_FLOOR_MS = 0.02
+# 閾値を超えたケースを再計測する回数（一時的な揺らぎでは再現しないので、最小時間を取り直す）
+CONFIRM_RUNS = 2
+DEFAULT_RESULT_FILE = os.path.join("output", "benchmark.json")
+DEFAULT_BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+# 合成台本のテーマ（検索クエリ・プロンプトのユーザー入力に使う）
+BENCH_THEME = "フォークリフト安全"
+CHECK_LINE_MARKER = "5重チェック"
+
+
+def _demo_pages() -> Tuple[str, List[List[str]]]:
+    """デモ出力を (5重チェック行, ページごとの行) に分ける"""
+    demo = LLMSlideGenerator._demo_response(None)
+    human = demo.split("Excel:", 1)[0].strip()
+    blocks = [block.strip().split("\n") for block in human.split("\n\n") if block.strip()]
+    check_line = blocks.pop(0)[0] if CHECK_LINE_MARKER in blocks[0][0] else ""
+    return check_line, blocks
+
+
+def make_deck(pages: int) -> Tuple[str, str, str]:
+    """デモ出力をもとに pages ページの合成台本 (生成テキスト全体, 人間用, Excel用) を作る
+
+    表紙・ユニット表紙のあとは導入〜理由のページを繰り返し、ページ番号とExcel用を振り直す。
+    """
+    check_line, blocks = _demo_pages()
+    head, body = blocks[:2], blocks[2:]
+    human_pages, excel_lines = [], []
+    for number in range(1, pages + 1):
+        block = head[number - 1] if number <= len(head) else body[(number - len(head) - 1) % len(body)]
+        title = block[0].split(".", 1)[1].strip()
+        lines = block[1:]
+        human_pages.append("\n".join([f"{number}. {title}"] + lines))
+        excel_lines.extend(f"{number} : {i} : {line} : " for i, line in enumerate(lines, 1))
+    human_text = "\n\n".join(human_pages)
+    excel_text = "\n".join(excel_lines)
+    generated = f"{check_line}\n\n{human_text}\n\nExcel:\n{excel_text}"
+    return generated, human_text, excel_text
+
+
+def _calibrate() -> float:
+    """マシンの速さの目安（ミリ秒）。ベースラインを別のマシンで取った場合の補正に使う"""
+    def work() -> None:
+        counts: Dict[str, int] = {}
+        for i in range(20000):
+            key = str(i % 97)
+            counts[key] = counts.get(key, 0) + i
+    return measure(work, CALIBRATION_REPEAT)["min_ms"]
+
+
+def measure(func: Callable[[], object], repeat: int = DEFAULT_REPEAT) -> Dict:
+    """func 1回あたりの時間（ミリ秒）を repeat 回計測し、最小・中央値を返す"""
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= MIN_MEASURE_SEC or number >= 1_000_000:
+            break
+        number *= 10 if elapsed < MIN_MEASURE_SEC / 10 else 2
+    timings = [elapsed / number]
+    for _ in range(repeat - 1):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - started) / number)
+    return {
+        "number": number,
+        "repeat": repeat,
+        "min_ms": round(min(timings) * 1000, 6),
+        "median_ms": round(statistics.median(timings) * 1000, 6),
+    }
+
+
+def build_cases(pages: int, generator: LLMSlideGenerator) -> Dict[str, Callable[[], object]]:
+    """pages ページの合成台本に対する計測対象（名前 → 引数なしの関数）"""
+    generated, human_text, excel_text = make_deck(pages)
+    validator = SlideValidator()
+    config = generator.config
+    # 参考資料として台本の本文を渡し、生成時と同じ経路（_build_context_chunks）で検索する
+    user_input = build_user_input(BENCH_THEME, 1)
+    reference = human_text
+    chunks = generator._build_context_chunks(user_input, reference, config)
+    return {
+        "validate_all": lambda: validator.validate_all(human_text, excel_text),
+        "get_validation_report": lambda: validator.get_validation_report(human_text, excel_text),
+        "split_output": lambda: generator._split_output(generated),
+        "build_prompt": lambda: generator.build_prompt(user_input, chunks),
+        "retrieval": lambda: generator._build_context_chunks(user_input, reference, config),
+    }
+
+
+def run_benchmarks(sizes: List[int] = DEFAULT_SIZES, only: Optional[List[str]] = None,
+                   repeat: int = DEFAULT_REPEAT) -> Dict:
+    """全ケースを計測して結果（JSONに保存する形）を返す"""
+    generator = LLMSlideGenerator(GenerationConfig(use_cache=False))
+    results = []
+    # マシンの速さは計測中にも変わるので、各ケースの直前・直後に測った値をそのケースの補正に使う
+    calibrations = [_calibrate()]
+    for pages in sizes:
+        for name, func in build_cases(pages, generator).items():
+            if only and name not in only:
+                continue
+            result = dict(name=name, pages=pages, **measure(func, repeat))
+            calibrations.append(_calibrate())
+            result["calibration_ms"] = round(statistics.median(calibrations[-2:]), 6)
+            results.append(result)
+            print(f"{name:<24}{pages:>5}ページ  最小 {result['min_ms']:>10.4f}ms  "
+                  f"中央値 {result['median_ms']:>10.4f}ms  (×{result['number']})")
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "calibration_ms": round(statistics.median(calibrations), 6),
+        "results": results,
+    }
+
+
+def remeasure(current: Dict, cases: List[Dict], repeat: int = DEFAULT_REPEAT) -> None:
+    """指定したケースを計測し直し、current の最小時間を小さい方に更新する"""
+    generator = LLMSlideGenerator(GenerationConfig(use_cache=False))
+    results = {(result["name"], result["pages"]): result for result in current["results"]}
+    for pages in sorted({case["pages"] for case in cases}):
+        funcs = build_cases(pages, generator)
+        for case in cases:
+            if case["pages"] != pages:
+                continue
+            result = results[(case["name"], pages)]
+            retry = measure(funcs[case["name"]], repeat)
+            result["min_ms"] = min(result["min_ms"], retry["min_ms"])
+            result["confirm_runs"] = result.get("confirm_runs", 0) + 1
+            print(f"{case['name']:<24}{pages:>5}ページ  再計測 最小 {retry['min_ms']:>10.4f}ms")
+
+
+def same_platform(current: Dict, baseline: Dict) -> bool:
+    """同じ環境（プラットフォーム・Pythonのバージョン）で取った結果か"""
+    return (current.get("platform"), current.get("python")) == (baseline.get("platform"), baseline.get("python"))
+
+
+def _scale(current: Dict, baseline: Dict, result: Dict, base: Dict) -> float:
+    """ベースラインの補正倍率（ケースごとのキャリブレーションがあればそれを、なければ全体の値を使う）"""
+    current_ms = result.get("calibration_ms") or current.get("calibration_ms")
+    baseline_ms = base.get("calibration_ms") or baseline.get("calibration_ms")
+    return current_ms / baseline_ms if current_ms and baseline_ms else 1.0
+
+
+def compare(current: Dict, baseline: Dict, threshold: float = DEFAULT_THRESHOLD,
+            normalize: Optional[bool] = None) -> List[Dict]:
+    """ベースラインより threshold 倍以上遅くなったケースを返す
+
+    normalize=True ではキャリブレーションの比でベースラインを補正する（別のマシンで取った場合）。
+    None（既定）では環境が違う場合だけ補正する。キャリブレーションは処理の種類によって速さの変わり方が
+    違い、同じマシンでは補正しない方が安定するため。
+    """
+    if normalize is None:
+        normalize = not same_platform(current, baseline)
+    baseline_results = {(result["name"], result["pages"]): result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        base = baseline_results.get((result["name"], result["pages"]))
+        if base is None:
+            continue
+        base_ms = base["min_ms"] * (_scale(current, baseline, result, base) if normalize else 1.0)
+        ratio = result["min_ms"] / base_ms if base_ms else float("inf")
+        if ratio > threshold and result["min_ms"] - base_ms > NOISE_FLOOR_MS:
+            regressions.append(dict(result, baseline_ms=round(base_ms, 6), ratio=round(ratio, 3)))
+    return regressions
+
+
+def save_json(path: str, data: Dict) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="CPU側の処理のマイクロベンチマーク")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES),
+                        help=f"合成台本のページ数（デフォルト: {' '.join(map(str, DEFAULT_SIZES))}）")
+    parser.add_argument("--only", type=str, nargs="+", metavar="NAME",
+                        help="計測するケース（validate_all / get_validation_report / split_output / "
+                             "build_prompt / retrieval）")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                        help=f"計測の繰り返し回数（デフォルト: {DEFAULT_REPEAT}）")
+    parser.add_argument("--output", type=str, default=DEFAULT_RESULT_FILE,
+                        help=f"結果JSONの出力先（デフォルト: {DEFAULT_RESULT_FILE}）")
+    parser.add_argument("--baseline", type=str, default=DEFAULT_BASELINE_FILE,
+                        help="比較するベースラインJSON（デフォルト: benchmark_baseline.json）")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="比較せずに結果をベースラインとして保存")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"遅くなったとみなす倍率（デフォルト: {DEFAULT_THRESHOLD}）")
+    normalize = parser.add_mutually_exclusive_group()
+    normalize.add_argument("--normalize", dest="normalize", action="store_true", default=None,
+                           help="マシンの速さでベースラインを補正する（デフォルト: 環境が違う場合のみ）")
+    normalize.add_argument("--no-normalize", dest="normalize", action="store_false",
+                           help="マシンの速さによるベースラインの補正をしない")
+    args = parser.parse_args()
+
+    repeat = max(1, args.repeat)
+    current = run_benchmarks(args.sizes, args.only, repeat)
+
+    if args.save_baseline:
+        save_json(args.output, current)
+        save_json(args.baseline, current)
+        print(f"\n結果: {args.output}")
+        print(f"ベースラインを保存: {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        save_json(args.output, current)
+        print(f"\n結果: {args.output}")
+        print(f"ベースラインがありません（--save-baseline で作成）: {args.baseline}")
+        return 0
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    normalize = args.normalize if args.normalize is not None else not same_platform(current, baseline)
+    regressions = compare(current, baseline, args.threshold, normalize=normalize)
+    for run in range(1, CONFIRM_RUNS + 1):
+        if not regressions:
+            break
+        print(f"\n閾値を超えたケースを再計測（{run}/{CONFIRM_RUNS}）")
+        remeasure(current, regressions, repeat)
+        regressions = compare(current, baseline, args.threshold, normalize=normalize)
+    save_json(args.output, current)
+    print(f"\n結果: {args.output}")
+    print(f"マシンの速さによる補正: {'あり' if normalize else 'なし'}")
+    if regressions:
+        print(f"\n❌ ベースラインより{args.threshold}倍以上遅いケース:")
+        for result in regressions:
+            print(f"  - {result['name']} {result['pages']}ページ: {result['min_ms']:.4f}ms "
+                  f"（ベースライン {result['baseline_ms']:.4f}ms、×{result['ratio']}）")
+        return 1
+    print(f"\n✅ ベースラインとの比較: 合格（閾値 ×{args.threshold}）")
+    return 0
+
+
+# 使用例
+if __name__ == "__main__":
+    sys.exit(main())
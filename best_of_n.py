@@ -0,0 +1,127 @@
+"""
+Best-of-N 候補生成
+温度・シードを変えたN件の候補を並列に生成し、バリデートレポートと品質スコアで最良のものを選ぶ
+完全に合格した候補が出た時点で残りの生成を取り消す
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from hedging import HedgeCancelled, HedgeRoute
+from validator import MAX_LINE_LENGTH, REQUIRED_SLIDES, SlideValidator
+
+logger = logging.getLogger(__name__)
+
+# 候補ごとに温度をずらす幅と上限
+CANDIDATE_TEMPERATURE_STEP = 0.15
+MAX_CANDIDATE_TEMPERATURE = 1.0
+# 候補ごとのシードの起点（候補i は BASE_SEED + i）
+BASE_SEED = 1
+
+# 品質スコアの重み（エラー1件の減点 > 必須スライド1つ分の網羅 > 行長の余裕）
+ERROR_WEIGHT = 10.0
+COVERAGE_WEIGHT = 5.0
+SLACK_WEIGHT = 1.0
+
+
+@dataclass
+class CandidateScore:
+    """候補1件の評価"""
+    is_valid: bool
+    errors: List[str] = field(default_factory=list)
+    coverage: float = 0.0  # 必須スライド＋問いかけの充足率（0〜1）
+    slack: float = 0.0  # 行長の余裕（50字に対する平均の空き、0〜1）
+
+    @property
+    def score(self) -> float:
+        return -ERROR_WEIGHT * len(self.errors) + COVERAGE_WEIGHT * self.coverage + SLACK_WEIGHT * self.slack
+
+    @property
+    def rank_key(self) -> Tuple[bool, float]:
+        """大きいほど良い（合格を最優先し、次に品質スコア）"""
+        return self.is_valid, self.score
+
+
+def score_candidate(human_text: str, excel_text: str) -> CandidateScore:
+    """get_validation_report の結果と、必須スライドの網羅・行長の余裕から候補を評価"""
+    report = SlideValidator().get_validation_report(human_text, excel_text)
+    errors = report['errors']
+    missing = sum(1 for error in errors if error.startswith("必須スライド") or error.startswith("問いかけ"))
+    coverage = 1.0 - missing / (len(REQUIRED_SLIDES) + 1)
+    lengths = [len(line.strip()) for line in human_text.split('\n') if line.strip()]
+    slack = (sum(max(0, MAX_LINE_LENGTH - length) for length in lengths) / (MAX_LINE_LENGTH * len(lengths))
+             if lengths else 0.0)
+    return CandidateScore(report['is_valid'], errors, coverage, slack)
+
+
+def candidate_settings(temperature: float, count: int,
+                       temperatures: Sequence[float] = ()) -> List[Tuple[float, int]]:
+    """候補ごとの (温度, シード)
+
+    temperatures 指定時はその値を順に使い、足りない分は最後の値を繰り返す。
+    未指定時は基準温度から CANDIDATE_TEMPERATURE_STEP ずつ上げる（上限 MAX_CANDIDATE_TEMPERATURE）。
+    """
+    settings = []
+    for i in range(count):
+        if temperatures:
+            value = temperatures[min(i, len(temperatures) - 1)]
+        else:
+            value = min(MAX_CANDIDATE_TEMPERATURE, temperature + CANDIDATE_TEMPERATURE_STEP * i)
+        settings.append((round(value, 3), BASE_SEED + i))
+    return settings
+
+
+def run_candidates(routes: List[HedgeRoute], accept: Callable[[int, str], bool]) -> Dict[int, str]:
+    """全候補を同時に生成し、完了した候補の {添字: 出力} を返す
+
+    accept(添字, 出力) がTrueを返した時点で残りの候補を取り消す（accept は呼び出し元のスレッドで実行）。
+    """
+    cancel = threading.Event()
+    results: "queue.Queue[Tuple[int, Optional[str], Optional[BaseException]]]" = queue.Queue()
+
+    def worker(index: int) -> None:
+        try:
+            results.put((index, routes[index].call(cancel, lambda: None), None))
+        except BaseException as e:
+            results.put((index, None, e))
+
+    for index, route in enumerate(routes):
+        threading.Thread(target=worker, args=(index,), daemon=True, name=f"candidate-{index + 1}").start()
+
+    texts: Dict[int, str] = {}
+    for _ in routes:
+        index, text, error = results.get()
+        if error is not None:
+            if not isinstance(error, HedgeCancelled):
+                logger.debug(f"候補{index + 1} 失敗: {error}")
+            continue
+        texts[index] = text
+        if accept(index, text):
+            cancel.set()
+            break
+    return texts
+
+
+async def arun_candidates(routes: List[HedgeRoute], accept: Callable[[int, str], bool]) -> Dict[int, str]:
+    """run_candidates の非同期版（不要になった候補はタスクを取り消す）"""
+    tasks = {asyncio.ensure_future(route.acall(lambda: None)): index for index, route in enumerate(routes)}
+    texts: Dict[int, str] = {}
+    try:
+        while tasks:
+            done, _ = await asyncio.wait(list(tasks), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                index = tasks.pop(task)
+                if task.exception() is not None:
+                    logger.debug(f"候補{index + 1} 失敗: {task.exception()}")
+                    continue
+                texts[index] = task.result()
+                if accept(index, texts[index]):
+                    return texts
+        return texts
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,193 @@
+"""
+出力アーカイブの一括バリデート
+ファイル・ディレクトリ・globで指定した台本をプロセスプールで並列にバリデートし、
+1ファイル1行のNDJSONレポートと集計サマリーを出力する
+"""
+
+import glob
+import json
+import os
+import re
+import sys
+import time
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from validator import SlideValidator
+
+# save_output が書き出すファイル名（同じディレクトリの組は1件としてバリデートする）
+HUMAN_FILE_NAME = "slide_human.txt"
+EXCEL_FILE_NAME = "slide_excel.txt"
+# ディレクトリ指定時に対象とする拡張子
+VALIDATE_EXTENSIONS = (".txt",)
+# この件数未満はプロセスプールを使わずに処理する（起動コストの方が大きいため）
+POOL_MIN_FILES = 64
+
+# エラー種別の集計用（行番号などの位置と、":" / "(" 以降の詳細を除く）
+_ERROR_LOCATION_RE = re.compile(r'^(Excel)?行\d+:\s*')
+_ERROR_DETAIL_RE = re.compile(r'\s*[:(].*$')
+
+Target = Tuple[str, Optional[str]]  # (台本ファイル, 組になるExcel用ファイル)
+
+
+def error_type(error: str) -> str:
+    """エラー文をヒストグラム用の種別に正規化"""
+    match = _ERROR_LOCATION_RE.match(error)
+    kind = _ERROR_DETAIL_RE.sub('', error[match.end():] if match else error)
+    return f"Excel: {kind}" if match and match.group(1) else kind
+
+
+def _iter_dir_files(root: str) -> Iterator[str]:
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        for name in sorted(filenames):
+            if name.lower().endswith(VALIDATE_EXTENSIONS):
+                yield os.path.join(dirpath, name)
+
+
+def expand_targets(patterns: Iterable[str]) -> Tuple[List[Target], List[str]]:
+    """ファイル・ディレクトリ・globを展開し、(対象一覧, 見つからなかった指定) を返す
+
+    slide_human.txt と slide_excel.txt が同じディレクトリにある場合は1件にまとめる。
+    """
+    paths, missing = [], []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths.extend(_iter_dir_files(pattern))
+        elif os.path.isfile(pattern):
+            paths.append(pattern)
+        elif glob.has_magic(pattern):
+            matched = sorted(glob.glob(pattern, recursive=True))
+            for path in matched:
+                if os.path.isdir(path):
+                    paths.extend(_iter_dir_files(path))
+                else:
+                    paths.append(path)
+            if not matched:
+                missing.append(pattern)
+        else:
+            missing.append(pattern)
+
+    targets, seen = [], set()
+    for path in paths:
+        dirname, name = os.path.split(path)
+        excel_path = None
+        if name == EXCEL_FILE_NAME and os.path.isfile(os.path.join(dirname, HUMAN_FILE_NAME)):
+            path, excel_path = os.path.join(dirname, HUMAN_FILE_NAME), path
+        elif name == HUMAN_FILE_NAME and os.path.isfile(os.path.join(dirname, EXCEL_FILE_NAME)):
+            excel_path = os.path.join(dirname, EXCEL_FILE_NAME)
+        key = os.path.normpath(path)
+        if key in seen:
+            continue
+        seen.add(key)
+        targets.append((path, excel_path))
+    return targets, missing
+
+
+def load_slide_texts(path: str, excel_path: Optional[str] = None) -> Tuple[str, str]:
+    """台本ファイルを (人間用, Excel用) に分割して読み込む
+
+    excel_path 指定時はそのファイルをExcel用とする。それ以外は "Excel:" で分割し、
+    見つからなければ全体を人間用として扱う。
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+    if excel_path:
+        with open(excel_path, "r", encoding="utf-8") as f:
+            return content.strip(), f.read().strip()
+    if "Excel:" in content:
+        human_part, excel_part = content.split("Excel:", 1)
+        return human_part.strip(), excel_part.strip()
+    return content, ""
+
+
+def validate_target(target: Target) -> Dict:
+    """1件をバリデートし、get_validation_report の結果にファイル名を付けて返す"""
+    path, excel_path = target
+    try:
+        human_text, excel_text = load_slide_texts(path, excel_path)
+    except (OSError, UnicodeDecodeError) as e:
+        report = {
+            'is_valid': False,
+            'errors': [f"ファイル読み込みエラー: {e}"],
+            'stats': {},
+            'suggestions': [],
+        }
+    else:
+        report = SlideValidator().get_validation_report(human_text, excel_text)
+    record = {'file': path}
+    if excel_path:
+        record['excel_file'] = excel_path
+    record.update(report)
+    return record
+
+
+def _validate_chunk(targets: List[Target]) -> List[Dict]:
+    """プロセスプール用：複数件をまとめてバリデート（プロセス間通信の回数を減らす）"""
+    return [validate_target(target) for target in targets]
+
+
+def iter_reports(targets: List[Target], workers: Optional[int] = None) -> Iterator[Dict]:
+    """対象を並列にバリデートし、指定順にレポートを返す"""
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(targets) < POOL_MIN_FILES:
+        for target in targets:
+            yield validate_target(target)
+        return
+
+    # 1タスクあたりの件数は全体をワーカー数の数倍に分ける程度にする
+    chunk_size = max(1, min(512, len(targets) // (workers * 8)))
+    chunks = [targets[i:i + chunk_size] for i in range(0, len(targets), chunk_size)]
+    # プロセスプール（multiprocessing）は並列にするときだけ読み込む
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for reports in executor.map(_validate_chunk, chunks):
+            yield from reports
+
+
+def summarize(reports: Iterable[Dict]) -> Dict:
+    """レポート群の集計（合格率・エラー種別ヒストグラム）"""
+    files = passed = 0
+    histogram = Counter()
+    for report in reports:
+        files += 1
+        if report['is_valid']:
+            passed += 1
+        histogram.update(error_type(error) for error in report['errors'])
+    return {
+        'files': files,
+        'passed': passed,
+        'failed': files - passed,
+        'pass_rate': round(passed / files, 4) if files else 0.0,
+        'error_types': dict(histogram.most_common()),
+    }
+
+
+def run_bulk_validation(patterns: Iterable[str], workers: Optional[int] = None,
+                        out: TextIO = sys.stdout) -> bool:
+    """一括バリデートを実行し、NDJSONを書き出す（全件合格ならTrue）
+
+    1行目以降に1ファイル1行のレポート、最終行に {"summary": {...}} を出力する。
+    """
+    start = time.time()
+    targets, missing = expand_targets(patterns)
+    for pattern in missing:
+        print(f"警告: 対象が見つかりません: {pattern}", file=sys.stderr)
+
+    def written(reports: Iterable[Dict]) -> Iterator[Dict]:
+        for report in reports:
+            out.write(json.dumps(report, ensure_ascii=False) + "\n")
+            yield report
+
+    summary = summarize(written(iter_reports(targets, workers)))
+    summary['missing'] = missing
+    summary['elapsed_sec'] = round(time.time() - start, 3)
+    out.write(json.dumps({'summary': summary}, ensure_ascii=False) + "\n")
+    out.flush()
+    return summary['files'] > 0 and summary['failed'] == 0 and not missing
+
+
+# 使用例
+if __name__ == "__main__":
+    ok = run_bulk_validation(sys.argv[1:] or ["output"])
+    sys.exit(0 if ok else 1)
@@ -6,11 +6,16 @@ ollama（ローカルAI）接続用のサンプルコード
 import requests
 import json
 
+from llm_transport import resolve_ollama_url
+
+# 接続先（環境変数 OLLAMA_HOST、なければ http://localhost:11434）
+OLLAMA_URL = resolve_ollama_url()
+
 def test_ollama_connection():
     """ollamaの接続テスト"""
     try:
         # ollamaが起動しているかチェック
-        response = requests.get("http://localhost:11434/api/tags", timeout=5)
+        response = requests.get(f"{OLLAMA_URL}/api/tags", timeout=5)
         if response.status_code == 200:
             models = response.json()
             print("✅ ollama接続成功!")
@@ -29,7 +34,7 @@ def test_ollama_connection():
 def call_ollama(prompt, model="qwen2.5:7b"):
     """ollamaでテキスト生成"""
     try:
-        response = requests.post("http://localhost:11434/api/generate", json={
+        response = requests.post(f"{OLLAMA_URL}/api/generate", json={
             "model": model,
             "prompt": prompt,
             "temperature": 0.3,
@@ -0,0 +1,167 @@
+"""
+プロンプトのコンテキスト予算管理
+セクションごとにトークン数を見積もり、優先度順に予算内へ収める（削った内容はログに残す）
+辞書はテーマ・参考資料抜粋に関連する用語だけを選ぶ
+"""
+
+import math
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+from knowledge_index import tokenize
+
+DEFAULT_PROMPT_TOKEN_BUDGET = 4000
+# 用語と文脈で共有する語（bigram）のIDF合計がこの値以上なら関連ありとみなす
+MIN_TERM_RELEVANCE = 4.0
+# 用語名そのものが文脈に現れた場合の加点
+TERM_NAME_BONUS = 100.0
+
+
+def estimate_tokens(text: str) -> int:
+    """トークン数の概算（日本語などの非ASCII文字は1文字1トークン、ASCIIは4文字1トークン）"""
+    ascii_chars = sum(1 for ch in text if ch.isascii())
+    return len(text) - ascii_chars + (ascii_chars + 3) // 4
+
+
+@dataclass
+class DictEntry:
+    """辞書の1項目（用語とその説明行、または用語以外の表記ルール）"""
+    section: str
+    term: str  # 表記ルールの場合は空
+    lines: List[str] = field(default_factory=list)
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.lines)
+
+
+def parse_dictionary(text: str) -> List[DictEntry]:
+    """safety_dict.txt 形式の辞書を項目に分割
+
+    「用語: 説明」の行と続く「- 」行を1項目とする。用語を持たない行（表記・禁止表現など）は
+    見出し【...】ごとに1つの表記ルール項目にまとめる。
+    """
+    entries: List[DictEntry] = []
+    section = ""
+    for line in text.split('\n'):
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if stripped.startswith('【') and stripped.endswith('】'):
+            section = stripped
+            continue
+        current = entries[-1] if entries and entries[-1].section == section else None
+        if ':' in stripped and not stripped.startswith(('-', '×', '○')):
+            entries.append(DictEntry(section, stripped.split(':', 1)[0].strip(), [stripped]))
+        elif current is not None and (not current.term or stripped.startswith('-')):
+            current.lines.append(stripped)
+        else:
+            entries.append(DictEntry(section, "", [stripped]))
+    return entries
+
+
+def format_dictionary(entries: List[DictEntry]) -> str:
+    """項目を見出し付きの辞書テキストに戻す（元の順序のまま）"""
+    blocks, section = [], None
+    for entry in entries:
+        if entry.section != section:
+            section = entry.section
+            if section:
+                blocks.append(f"\n{section}" if blocks else section)
+        blocks.append(entry.text)
+    return "\n".join(blocks).strip()
+
+
+def rank_dictionary_terms(entries: List[DictEntry], context: str) -> Tuple[List[DictEntry], List[DictEntry]]:
+    """文脈（テーマ・参考資料抜粋）に関連する用語を関連度順に返す（(関連, 無関係)）
+
+    用語名が文脈に現れるものを最優先し、それ以外は説明文と共有する語のIDF合計で判定する
+    （「安全」など多くの用語に現れる語はほとんど効かない）。
+    """
+    terms = [entry for entry in entries if entry.term]
+    term_tokens = [set(tokenize(entry.text)) for entry in terms]
+    df = Counter(token for tokens in term_tokens for token in tokens)
+    normalized = unicodedata.normalize("NFKC", context).lower()
+    context_tokens = set(tokenize(context))
+
+    scored, unrelated = [], []
+    for index, (entry, tokens) in enumerate(zip(terms, term_tokens)):
+        score = sum(math.log(len(terms) / df[token]) for token in tokens & context_tokens)
+        if unicodedata.normalize("NFKC", entry.term).lower() in normalized:
+            score += TERM_NAME_BONUS
+        if score >= MIN_TERM_RELEVANCE:
+            scored.append((-score, index, entry))
+        else:
+            unrelated.append(entry)
+    return [entry for _, _, entry in sorted(scored)], unrelated
+
+
+class ContextBudget:
+    """トークン予算の割り当て
+
+    reserve() したセクションは必ず残し、add() したセクションは優先度（小さいほど優先）順・
+    項目順に予算に収まる項目だけを残す。収まらない項目は飛ばして次の項目を試す。
+    """
+
+    def __init__(self, max_tokens: int = DEFAULT_PROMPT_TOKEN_BUDGET):
+        self.max_tokens = max_tokens
+        self.used = 0
+        self._optional: List[Tuple[int, int, str, List[str]]] = []
+        self.cuts: Dict[str, Tuple[int, int]] = {}  # セクション → (削った項目数, 削ったトークン数)
+
+    def reserve(self, name: str, text: str) -> None:
+        """必須セクション（削らない）"""
+        self.used += estimate_tokens(text)
+
+    def add(self, name: str, items: List[str], priority: int) -> None:
+        """項目単位で削れるセクション"""
+        self._optional.append((priority, len(self._optional), name, items))
+
+    def record_cut(self, name: str, items: List[str]) -> None:
+        """予算以外の理由（関連なしなど）で除いた項目を記録"""
+        if items:
+            count, tokens = self.cuts.get(name, (0, 0))
+            self.cuts[name] = (count + len(items), tokens + sum(estimate_tokens(item) for item in items))
+
+    def allocate(self) -> Dict[str, List[int]]:
+        """残す項目の添字をセクションごとに返す"""
+        kept: Dict[str, List[int]] = {}
+        for _, _, name, items in sorted(self._optional, key=lambda section: section[:2]):
+            kept[name] = []
+            dropped = []
+            for index, item in enumerate(items):
+                cost = estimate_tokens(item) + 1  # 改行分
+                if self.used + cost <= self.max_tokens:
+                    self.used += cost
+                    kept[name].append(index)
+                else:
+                    dropped.append(item)
+            self.record_cut(name, dropped)
+        return kept
+
+    def summary(self) -> str:
+        """ログ用の要約（使用量と削った内容）"""
+        line = f"コンテキスト予算: 約{self.used}/{self.max_tokens}トークン"
+        if self.cuts:
+            cut_text = ", ".join(f"{name} {count}件(約{tokens})" for name, (count, tokens) in self.cuts.items())
+            line += f" / 削除: {cut_text}"
+        if self.used > self.max_tokens:
+            line += " / 警告: 必須セクションだけで予算を超えています"
+        return line
+
+
+# 使用例
+if __name__ == "__main__":
+    import sys
+
+    from resources import get_prompt_resources
+
+    entries = list(get_prompt_resources().dictionary_entries)
+    theme = sys.argv[1] if len(sys.argv) > 1 else "フォークリフト安全"
+    related, unrelated = rank_dictionary_terms(entries, theme)
+    print(f"テーマ: {theme}")
+    print(f"関連用語: {[entry.term for entry in related]}")
+    print(f"無関係: {[entry.term for entry in unrelated]}")
+    print(format_dictionary(related))
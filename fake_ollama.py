@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+負荷試験用の疑似ollamaサーバー（標準ライブラリのHTTPサーバー）
+/api/generate（ストリーミング・非ストリーミング）と /api/tags に応答し、最初のトークンまでの遅延の分布・
+生成速度・エラー率・わざと不正な出力の割合・同時処理数（GPUのスロット）を設定できる。
+応答はデモ出力をもとにした合成台本（benchmark.make_deck）
+
+  python fake_ollama.py --port 11435 --latency lognormal:0,0.5 --tokens-per-sec 60 --error-rate 0.05
+  OLLAMA_HOST=http://127.0.0.1:11435 python main.py --theme "5S基本"
+"""
+
+import argparse
+import json
+import logging
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from benchmark import make_deck
+from context_budget import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 11435
+DEFAULT_MODELS = ("qwen2.5:32b", "qwen2.5:7b")
+# 最初のトークンまでの遅延（秒）の既定の分布
+DEFAULT_LATENCY = "normal:0.5,0.1"
+DEFAULT_TOKENS_PER_SEC = 200.0
+# 同時に生成できる件数（超えたリクエストは待たされる。ollamaの OLLAMA_NUM_PARALLEL に相当）
+DEFAULT_PARALLEL = 4
+# 合成台本のページ数（7はデモ出力と同じ）
+DEFAULT_PAGES = 7
+
+# 不正な出力の種類（バリデータが検出するもの）
+INVALID_EXCEL_EN = "excel_en"
+INVALID_LONG_LINE = "long_line"
+INVALID_PAGE_GAP = "page_gap"
+INVALID_KINDS = (INVALID_EXCEL_EN, INVALID_LONG_LINE, INVALID_PAGE_GAP)
+
+# ストリーミングの1トークン（ASCIIは4文字まで、それ以外は1文字。context_budget.estimate_tokens と同じ数え方）
+_TOKEN_RE = re.compile(r'[\x00-\x7f]{1,4}|[^\x00-\x7f]')
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """遅延の分布の指定（秒）から乱数の関数を作る
+
+    fixed:2.0 / uniform:1,3 / normal:平均,標準偏差 / lognormal:mu,sigma / exp:平均（負の値は0にする）
+    """
+    kind, _, params = spec.partition(":")
+    try:
+        values = [float(value) for value in params.split(",") if value.strip()]
+    except ValueError:
+        raise ValueError(f"遅延の指定が不正です: {spec}")
+    samplers = {
+        "fixed": (1, lambda rng: values[0]),
+        "uniform": (2, lambda rng: rng.uniform(values[0], values[1])),
+        "normal": (2, lambda rng: rng.gauss(values[0], values[1])),
+        "lognormal": (2, lambda rng: rng.lognormvariate(values[0], values[1])),
+        "exp": (1, lambda rng: rng.expovariate(1.0 / values[0]) if values[0] > 0 else 0.0),
+    }
+    if kind not in samplers or len(values) != samplers[kind][0]:
+        raise ValueError(f"遅延の指定が不正です: {spec}（例: fixed:2 / uniform:1,3 / normal:2,0.5 / "
+                         f"lognormal:0,0.5 / exp:2）")
+    sample = samplers[kind][1]
+    return lambda rng: max(0.0, sample(rng))
+
+
+def make_invalid(text: str, kind: str) -> str:
+    """合成台本をバリデートで不合格になる形に壊す"""
+    if kind == INVALID_EXCEL_EN:
+        # Excel用の text_en は空欄でなければならない
+        human, excel = text.split("Excel:", 1)
+        return f"{human}Excel:{re.sub(r' : $', ' : Safety first', excel, count=1, flags=re.M)}"
+    if kind == INVALID_LONG_LINE:
+        return text.replace("\n\n2. ", "\n" + "とても長い説明の行" * 8 + "\n\n2. ", 1)
+    if kind == INVALID_PAGE_GAP:
+        return text.replace("\n\n3. ", "\n\n4. ", 1)
+    raise ValueError(f"不明な種類です: {kind}")
+
+
+@dataclass
+class FakeOllamaConfig:
+    """疑似サーバーの設定"""
+    latency: str = DEFAULT_LATENCY  # 最初のトークンまでの遅延（秒）の分布
+    tokens_per_sec: float = DEFAULT_TOKENS_PER_SEC  # 生成速度（0以下は待たずに返す）
+    error_rate: float = 0.0  # HTTP 500 を返す割合
+    invalid_rate: float = 0.0  # バリデートで不合格になる出力を返す割合
+    parallel: int = DEFAULT_PARALLEL
+    pages: int = DEFAULT_PAGES
+    models: Tuple[str, ...] = DEFAULT_MODELS  # 空なら任意のモデル名を受け付ける
+    seed: Optional[int] = None
+
+
+@dataclass
+class FakeOllamaStats:
+    """疑似サーバーが返した応答の件数"""
+    requests: int = 0
+    streamed: int = 0
+    errors: int = 0
+    invalid: int = 0
+    unknown_model: int = 0
+    completion_tokens: int = 0
+    max_waiting: int = 0  # スロット待ちの最大件数
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, **counts) -> None:
+        with self._lock:
+            for key, value in counts.items():
+                setattr(self, key, getattr(self, key) + value)
+
+    def observe_waiting(self, waiting: int) -> None:
+        with self._lock:
+            self.max_waiting = max(self.max_waiting, waiting)
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {key: value for key, value in vars(self).items() if not key.startswith("_")}
+
+
+class FakeOllama:
+    """応答の内容と遅延を決める（HTTPハンドラから server.fake として使う）"""
+
+    def __init__(self, config: Optional[FakeOllamaConfig] = None):
+        self.config = config or FakeOllamaConfig()
+        self.sample_latency = parse_latency(self.config.latency)
+        self.deck = make_deck(self.config.pages)[0]
+        self.stats = FakeOllamaStats()
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(1, self.config.parallel))
+        self._waiting = 0
+
+    def knows(self, model: str) -> bool:
+        return not self.config.models or model in self.config.models
+
+    def plan(self) -> Tuple[bool, Optional[str], float]:
+        """1件分の (エラーにするか, 不正な出力の種類, 最初のトークンまでの遅延) を決める"""
+        with self._lock:
+            error = self._rng.random() < self.config.error_rate
+            invalid = self._rng.choice(INVALID_KINDS) if self._rng.random() < self.config.invalid_rate else None
+            latency = self.sample_latency(self._rng)
+        return error, invalid, latency
+
+    def response_text(self, invalid: Optional[str]) -> str:
+        return make_invalid(self.deck, invalid) if invalid else self.deck
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """生成スロットを確保（空きがなければ待ち、待ち件数の最大を記録する）"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._waiting += 1
+                self.stats.observe_waiting(self._waiting)
+            self._slots.acquire()
+            with self._lock:
+                self._waiting -= 1
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    def token_interval(self) -> float:
+        return 1.0 / self.config.tokens_per_sec if self.config.tokens_per_sec > 0 else 0.0
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    """ollama互換の /api/generate・/api/tags のハンドラ（server.fake に FakeOllama を持つ）"""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeOllama/1.0"
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def _send_json(self, status: int, body: Dict) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, event: Dict) -> None:
+        data = (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_GET(self) -> None:
+        fake: FakeOllama = self.server.fake
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path == "/api/tags":
+            self._send_json(200, {"models": [{"name": model, "model": model} for model in fake.config.models]})
+        elif path == "/api/fake/stats":
+            self._send_json(200, fake.stats.to_dict())
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        fake: FakeOllama = self.server.fake
+        if self.path.split("?", 1)[0].rstrip("/") != "/api/generate":
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        except ValueError as e:
+            self._send_json(400, {"error": f"invalid request: {e}"})
+            return
+        model = str(body.get("model", ""))
+        fake.stats.add(requests=1)
+        if not fake.knows(model):
+            fake.stats.add(unknown_model=1)
+            self._send_json(404, {"error": f"model '{model}' not found"})
+            return
+        error, invalid, latency = fake.plan()
+        if error:
+            fake.stats.add(errors=1)
+            self._send_json(500, {"error": "fake ollama: injected error"})
+            return
+        text = fake.response_text(invalid)
+        prompt_tokens = estimate_tokens(f"{body.get('system', '')}{body.get('prompt', '')}")
+        with fake.slot():
+            # プロンプトの処理（最初のトークンまで）
+            time.sleep(latency)
+            if body.get("stream", True):
+                self._stream(model, text, prompt_tokens, latency, fake.token_interval())
+            else:
+                started = time.monotonic()
+                time.sleep(fake.token_interval() * estimate_tokens(text))
+                self._send_json(200, self._final_event(
+                    model, text, prompt_tokens, estimate_tokens(text), latency, time.monotonic() - started))
+        fake.stats.add(invalid=1 if invalid else 0, completion_tokens=estimate_tokens(text))
+
+    def _stream(self, model: str, text: str, prompt_tokens: int, latency: float, interval: float) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.server.fake.stats.add(streamed=1)
+        started = time.monotonic()
+        try:
+            for i, token in enumerate(_TOKEN_RE.findall(text)):
+                # トークンごとの予定時刻まで待つ（sleep の誤差を累積させない）
+                delay = started + i * interval - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                self._write_chunk({"model": model, "response": token, "done": False})
+            self._write_chunk(self._final_event(
+                model, "", prompt_tokens, estimate_tokens(text), latency, time.monotonic() - started))
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # クライアントが打ち切った（ストリーミング中のバリデートやヘッジの取り消し）
+            logger.debug("ストリーミングをクライアントが切断")
+            self.close_connection = True
+
+    @staticmethod
+    def _final_event(model: str, response: str, prompt_tokens: int, completion_tokens: int,
+                     latency: float, generation_sec: float) -> Dict:
+        """最後の応答（ollamaと同じくトークン数と所要時間をナノ秒で返す）"""
+        return {
+            "model": model,
+            "response": response,
+            "done": True,
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(latency * 1e9),
+            "eval_count": completion_tokens,
+            "eval_duration": int(generation_sec * 1e9),
+        }
+
+
+def create_fake_server(config: Optional[FakeOllamaConfig] = None, host: str = DEFAULT_HOST,
+                       port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+    """疑似サーバーを作成（port=0 で空いているポート）"""
+    server = ThreadingHTTPServer((host, port), FakeOllamaHandler)
+    server.daemon_threads = True
+    server.fake = FakeOllama(config)
+    return server
+
+
+def start_fake_server(config: Optional[FakeOllamaConfig] = None, host: str = DEFAULT_HOST,
+                      port: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+    """疑似サーバーを別スレッドで起動し、(サーバー, ベースURL) を返す"""
+    server = create_fake_server(config, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True, name="fake-ollama").start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def add_fake_arguments(parser: argparse.ArgumentParser) -> None:
+    """疑似サーバーの設定の引数（load_test.py と共通）"""
+    parser.add_argument("--latency", type=str, default=DEFAULT_LATENCY,
+                        help=f"最初のトークンまでの遅延（秒）の分布（デフォルト: {DEFAULT_LATENCY}）")
+    parser.add_argument("--tokens-per-sec", type=float, default=DEFAULT_TOKENS_PER_SEC,
+                        help=f"生成速度（デフォルト: {DEFAULT_TOKENS_PER_SEC}）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="HTTP 500 を返す割合（0〜1）")
+    parser.add_argument("--invalid-rate", type=float, default=0.0, help="不正な出力を返す割合（0〜1）")
+    parser.add_argument("--parallel", type=int, default=DEFAULT_PARALLEL,
+                        help=f"同時に生成できる件数（デフォルト: {DEFAULT_PARALLEL}）")
+    parser.add_argument("--pages", type=int, default=DEFAULT_PAGES,
+                        help=f"応答する台本のページ数（デフォルト: {DEFAULT_PAGES}）")
+    parser.add_argument("--seed", type=int, help="乱数シード（遅延・エラー・不正な出力の再現用）")
+
+
+def fake_config_from_args(args: argparse.Namespace) -> FakeOllamaConfig:
+    parse_latency(args.latency)
+    return FakeOllamaConfig(latency=args.latency, tokens_per_sec=args.tokens_per_sec,
+                            error_rate=args.error_rate, invalid_rate=args.invalid_rate,
+                            parallel=args.parallel, pages=args.pages, seed=args.seed)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="負荷試験用の疑似ollamaサーバー")
+    parser.add_argument("--host", type=str, default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                        help=f"ポート（デフォルト: {DEFAULT_PORT}）")
+    add_fake_arguments(parser)
+    args = parser.parse_args()
+    try:
+        config = fake_config_from_args(args)
+    except ValueError as e:
+        parser.error(str(e))
+    server = create_fake_server(config, args.host, args.port)
+    print(f"疑似ollamaサーバー: http://{args.host}:{server.server_address[1]}")
+    print(f"遅延: {config.latency} / 生成速度: {config.tokens_per_sec}トークン/秒 / "
+          f"エラー率: {config.error_rate} / 不正な出力: {config.invalid_rate} / 同時処理: {config.parallel}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n停止しました: {server.fake.stats.to_dict()}")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
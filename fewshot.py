@@ -0,0 +1,109 @@
+"""
+Few-shotサンプルの選択
+fewshot_samples.txt を例ごとに分割して索引化し、テーマに近い良い例・悪い例をトークン予算内で選ぶ
+"""
+
+import re
+from dataclasses import dataclass
+from typing import List
+
+from context_budget import estimate_tokens
+from knowledge_index import BM25Index
+
+# 良い例を何件まで載せるか（悪い例は FEWSHOT_BAD_EXAMPLES 件まで）
+DEFAULT_FEWSHOT_K = 2
+FEWSHOT_BAD_EXAMPLES = 1
+# Few-shot例に使うトークン数の上限（プロンプト全体の予算とは別）
+DEFAULT_FEWSHOT_TOKEN_BUDGET = 1600
+
+_SEPARATOR_RE = re.compile(r'^-{3,}\s*$', re.MULTILINE)
+_HEADER_RE = re.compile(r'^【(.+?)】\s*$')
+_THEME_RE = re.compile(r'^【テーマ】\s*(.+)$', re.MULTILINE)
+
+
+@dataclass
+class FewshotExample:
+    """Few-shotサンプルの1例"""
+    title: str  # 見出し（例: "Good Example 2 - 化学物質取扱"）
+    is_good: bool
+    theme: str
+    text: str  # 見出し行を含む例全体
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.text)
+
+
+def parse_fewshot_samples(text: str) -> List[FewshotExample]:
+    """"---" 区切りのサンプルファイルを例ごとに分割（見出し【...】のないブロックは無視）"""
+    examples = []
+    for block in _SEPARATOR_RE.split(text):
+        block = block.strip()
+        header = _HEADER_RE.match(block.split('\n', 1)[0])
+        if not header:
+            continue
+        title = header.group(1)
+        theme = _THEME_RE.search(block)
+        is_good = not ("Bad" in title or "悪い" in title)
+        examples.append(FewshotExample(title, is_good, theme.group(1).strip() if theme else "", block))
+    return examples
+
+
+class FewshotIndex:
+    """Few-shot例のBM25索引（起動時に一度だけ作る）"""
+
+    def __init__(self, examples: List[FewshotExample]):
+        self.examples = examples
+        self.index = BM25Index()
+        for i, example in enumerate(examples):
+            # テーマは本文より重く効かせる
+            self.index.add(f"{example.theme}\n{example.theme}\n{example.text}", {'title': str(i)})
+
+    def select(self, query: str, k: int = DEFAULT_FEWSHOT_K,
+               max_tokens: int = DEFAULT_FEWSHOT_TOKEN_BUDGET,
+               bad_k: int = FEWSHOT_BAD_EXAMPLES) -> List[FewshotExample]:
+        """クエリに近い順に良い例 k 件・悪い例 bad_k 件を max_tokens 以内で選ぶ（良い例が先）
+
+        類似する例が足りない場合は残りをファイル順で補う。予算に収まらない例は飛ばす。
+        k=0 の場合は例を載せない。
+        """
+        if not self.examples or k <= 0 or max_tokens <= 0:
+            return []
+        ranked = [int(hit['title']) for hit in self.index.search(query, top_k=len(self.examples))]
+        ranked_set = set(ranked)
+        order = ranked + [i for i in range(len(self.examples)) if i not in ranked_set]
+
+        good: List[FewshotExample] = []
+        bad: List[FewshotExample] = []
+        used = 0
+        for i in order:
+            example = self.examples[i]
+            selected, limit = (good, k) if example.is_good else (bad, bad_k)
+            if len(selected) >= limit or used + example.tokens > max_tokens:
+                continue
+            selected.append(example)
+            used += example.tokens
+            if len(good) >= k and len(bad) >= bad_k:
+                break
+        return good + bad
+
+
+def format_example(example: FewshotExample, human_only: bool = False) -> str:
+    """プロンプト用の例（human_only=True では良い例のExcel用を省く）"""
+    if human_only and example.is_good:
+        return example.text.split("\nExcel:", 1)[0].rstrip()
+    return example.text
+
+
+# 使用例
+if __name__ == "__main__":
+    import sys
+
+    from resources import get_prompt_resources
+
+    index = get_prompt_resources().fewshot_index
+    theme = sys.argv[1] if len(sys.argv) > 1 else "化学物質の保護具"
+    print(f"テーマ: {theme}")
+    print(f"全{len(index.examples)}例: {[example.title for example in index.examples]}")
+    for example in index.select(theme):
+        print(f"  {'良い例' if example.is_good else '悪い例'} {example.title} (約{example.tokens}トークン)")
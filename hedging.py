@@ -0,0 +1,247 @@
+"""
+バックエンド・モデルをまたぐヘッジ呼び出し
+主経路が最近のレイテンシの指定パーセンタイルまでに応答（または最初のトークン）を返さなければ
+次の経路にも同じプロンプトを投げ、最初にバリデートを通った出力を採用して残りを取り消す
+"""
+
+import asyncio
+import logging
+import math
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 経路ごとに保持する直近のレイテンシ件数
+LATENCY_WINDOW = 100
+# この件数未満の経路はパーセンタイルではなく既定の待ち時間を使う
+LATENCY_MIN_SAMPLES = 5
+# ヘッジまでの最短待ち時間（秒）
+HEDGE_MIN_DELAY_SEC = 1.0
+
+FIRST_TOKEN = "first_token"
+TOTAL = "total"
+
+
+def _percentile(samples: List[float], q: float) -> float:
+    """昇順のサンプルの q（0〜1）パーセンタイル（最近傍法）"""
+    return samples[min(len(samples) - 1, max(0, math.ceil(q * len(samples)) - 1))]
+
+
+class HedgeCancelled(Exception):
+    """他の経路の出力が採用されたため生成を打ち切った"""
+
+
+class LatencyTracker:
+    """経路ごとの直近レイテンシ（最初のトークンまで / 応答完了まで）"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.window = window
+        self._samples: Dict[Tuple[str, str], Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float, kind: str = TOTAL) -> None:
+        with self._lock:
+            self._samples.setdefault((name, kind), deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, name: str, q: float, kind: str = TOTAL) -> Optional[float]:
+        """q（0〜1）パーセンタイル（件数が足りなければNone）"""
+        with self._lock:
+            samples = sorted(self._samples.get((name, kind), ()))
+        if len(samples) < LATENCY_MIN_SAMPLES:
+            return None
+        return _percentile(samples, q)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """経路・種別ごとの件数と中央値・p90・p99"""
+        with self._lock:
+            items = [(key, sorted(samples)) for key, samples in self._samples.items()]
+        result: Dict[str, Dict[str, float]] = {}
+        for (name, kind), samples in items:
+            result.setdefault(name, {}).update({
+                f"{kind}_count": len(samples),
+                f"{kind}_p50": round(_percentile(samples, 0.5), 3),
+                f"{kind}_p90": round(_percentile(samples, 0.9), 3),
+                f"{kind}_p99": round(_percentile(samples, 0.99), 3),
+            })
+        return result
+
+
+_tracker = LatencyTracker()
+
+
+def get_latency_tracker() -> LatencyTracker:
+    """プロセス全体で共有するレイテンシ記録を返す"""
+    return _tracker
+
+
+@dataclass
+class HedgePolicy:
+    """ヘッジの発動条件"""
+    percentile: float = 0.9  # 主経路のレイテンシのこのパーセンタイルを超えたら次の経路を起動
+    default_delay_sec: float = 60.0  # レイテンシの記録が足りない経路の待ち時間
+
+    def delays(self, tracker: LatencyTracker, name: str) -> Tuple[float, Optional[float]]:
+        """(応答完了までの待ち時間, 最初のトークンまでの待ち時間（記録がなければNone）)"""
+        total = tracker.percentile(name, self.percentile, TOTAL)
+        first_token = tracker.percentile(name, self.percentile, FIRST_TOKEN)
+        total = max(HEDGE_MIN_DELAY_SEC, total if total is not None else self.default_delay_sec)
+        if first_token is not None:
+            first_token = max(HEDGE_MIN_DELAY_SEC, first_token)
+        return total, first_token
+
+
+@dataclass
+class HedgeRoute:
+    """ヘッジ対象の経路（バックエンド + モデル）
+
+    call(cancel, on_first_token) は cancel がセットされたら HedgeCancelled で打ち切る。
+    acall(on_first_token) は非同期版（タスクの取り消しで打ち切られる）。
+    """
+    name: str  # レイテンシ記録のキー（バックエンド/モデル）
+    kind: str  # "ollama" / "openai"
+    call: Optional[Callable[[threading.Event, Callable[[], None]], str]] = None
+    acall: Optional[Callable[[Callable[[], None]], Awaitable[str]]] = None
+
+
+class _Launch:
+    """起動済みの経路1つ分の状態"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.started = time.monotonic()
+        self.first_token: Optional[float] = None
+
+    def mark_first_token(self) -> None:
+        if self.first_token is None:
+            self.first_token = time.monotonic()
+
+    def hedge_at(self, policy: HedgePolicy, tracker: LatencyTracker, name: str) -> float:
+        """次の経路を起動する時刻（time.monotonic 基準）"""
+        total, first_token = policy.delays(tracker, name)
+        deadline = self.started + total
+        if first_token is not None and self.first_token is None:
+            deadline = min(deadline, self.started + first_token)
+        return deadline
+
+
+def _record(tracker: LatencyTracker, route: HedgeRoute, launch: _Launch) -> None:
+    now = time.monotonic()
+    tracker.record(route.name, now - launch.started, TOTAL)
+    if launch.first_token is not None:
+        tracker.record(route.name, launch.first_token - launch.started, FIRST_TOKEN)
+
+
+def run_hedged(routes: List[HedgeRoute], accept: Callable[[str], bool],
+               policy: Optional[HedgePolicy] = None,
+               tracker: Optional[LatencyTracker] = None) -> Tuple[Optional[str], Optional[HedgeRoute]]:
+    """経路を順に（遅れたら並列に）呼び出し、(採用した出力, 経路) を返す
+
+    - 起動済みの最後の経路が待ち時間を超えたら次の経路を起動する
+    - 経路が失敗したら待たずに次の経路を起動する
+    - accept を通った出力が出た時点で他の経路を取り消す
+    - どれも accept を通らなければ最初に返った出力、全経路が失敗すれば (None, None)
+    accept は呼び出し元のスレッドで実行する。
+    """
+    policy = policy or HedgePolicy()
+    tracker = tracker or get_latency_tracker()
+    cancel = threading.Event()
+    results: "queue.Queue[Tuple[int, Optional[str], Optional[BaseException]]]" = queue.Queue()
+    launches: List[_Launch] = []
+
+    def worker(launch: _Launch) -> None:
+        try:
+            text = routes[launch.index].call(cancel, launch.mark_first_token)
+            results.put((launch.index, text, None))
+        except BaseException as e:
+            results.put((launch.index, None, e))
+
+    def launch_next() -> None:
+        launch = _Launch(len(launches))
+        launches.append(launch)
+        if launch.index > 0:
+            logger.debug(f"ヘッジ: {routes[launch.index].name} を起動")
+        threading.Thread(target=worker, args=(launch,), daemon=True,
+                         name=f"hedge-{routes[launch.index].name}").start()
+
+    fallback: Tuple[Optional[str], Optional[HedgeRoute]] = (None, None)
+    launch_next()
+    pending = 1
+    while pending:
+        timeout = None
+        if len(launches) < len(routes):
+            last = launches[-1]
+            timeout = max(0.0, last.hedge_at(policy, tracker, routes[last.index].name) - time.monotonic())
+        try:
+            index, text, error = results.get(timeout=timeout)
+        except queue.Empty:
+            launch_next()
+            pending += 1
+            continue
+        pending -= 1
+        if error is not None:
+            if not isinstance(error, HedgeCancelled):
+                logger.debug(f"ヘッジ: {routes[index].name} 失敗: {error}")
+            if not pending and len(launches) < len(routes):
+                launch_next()
+                pending += 1
+            continue
+        _record(tracker, routes[index], launches[index])
+        if accept(text):
+            cancel.set()
+            return text, routes[index]
+        if fallback[0] is None:
+            fallback = (text, routes[index])
+    return fallback
+
+
+async def arun_hedged(routes: List[HedgeRoute], accept: Callable[[str], bool],
+                      policy: Optional[HedgePolicy] = None,
+                      tracker: Optional[LatencyTracker] = None) -> Tuple[Optional[str], Optional[HedgeRoute]]:
+    """run_hedged の非同期版（不要になった経路はタスクを取り消す）"""
+    policy = policy or HedgePolicy()
+    tracker = tracker or get_latency_tracker()
+    tasks: Dict[asyncio.Task, _Launch] = {}
+    launches: List[_Launch] = []
+
+    def launch_next() -> None:
+        launch = _Launch(len(launches))
+        launches.append(launch)
+        if launch.index > 0:
+            logger.debug(f"ヘッジ: {routes[launch.index].name} を起動")
+        tasks[asyncio.ensure_future(routes[launch.index].acall(launch.mark_first_token))] = launch
+
+    fallback: Tuple[Optional[str], Optional[HedgeRoute]] = (None, None)
+    launch_next()
+    try:
+        while tasks:
+            timeout = None
+            if len(launches) < len(routes):
+                last = launches[-1]
+                timeout = max(0.0, last.hedge_at(policy, tracker, routes[last.index].name) - time.monotonic())
+            done, _ = await asyncio.wait(list(tasks), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                launch_next()
+                continue
+            for task in done:
+                launch = tasks.pop(task)
+                route = routes[launch.index]
+                if task.exception() is not None:
+                    logger.debug(f"ヘッジ: {route.name} 失敗: {task.exception()}")
+                    continue
+                _record(tracker, route, launch)
+                text = task.result()
+                if accept(text):
+                    return text, route
+                if fallback[0] is None:
+                    fallback = (text, route)
+            if not tasks and len(launches) < len(routes) and fallback[0] is None:
+                launch_next()
+        return fallback
+    finally:
+        for task in tasks:
+            task.cancel()
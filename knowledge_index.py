@@ -0,0 +1,388 @@
+"""
+知識ファイルの全文検索インデックス（BM25）
+knowledge/ 以下の文書を文字n-gramで索引化し、テーマに関連するチャンクを返す
+"""
+
+import heapq
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from knowledge_ingest import (
+    CHUNK_MAX_CHARS, ExtractionError, chunk_pages, file_signature, index_dir,
+    iter_source_files, load_pages,
+)
+
+DEFAULT_KNOWLEDGE_DIR = "knowledge"
+INDEX_FORMAT_VERSION = 3
+SNIPPET_MAX_CHARS = 200
+
+# ASCII英数字は単語単位、それ以外（日本語など）の文字列は文字bigramに分解する
+_TOKEN_RE = re.compile(r'[a-z0-9]+|[^\W_a-z0-9]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """日本語向けトークナイズ（英数字は単語、それ以外は文字bigram）"""
+    tokens = []
+    for run in _TOKEN_RE.findall(unicodedata.normalize("NFKC", text).lower()):
+        if run.isascii() or len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def split_chunks(text: str, max_chars: int = CHUNK_MAX_CHARS) -> List[str]:
+    """空行区切りの段落を max_chars 以内にまとめてチャンク化（前チャンク末尾と一部重複）"""
+    return [chunk["text"] for chunk in chunk_pages([(1, text)], max_chars)]
+
+
+def make_snippet(text: str, max_chars: int = SNIPPET_MAX_CHARS) -> str:
+    """プロンプト用の抜粋（長い場合は省略記号を付ける）"""
+    text = text.strip()
+    return text[:max_chars] + ('...' if len(text) > max_chars else '')
+
+
+def iter_knowledge_files(root: str) -> Iterable[str]:
+    """知識ディレクトリ内の索引対象ファイル（.txt / .md / .pdf）を列挙"""
+    return iter_source_files(root)
+
+
+def load_document_chunks(path: str, root: str) -> List[Dict]:
+    """ファイルをチャンクに分割（title は知識ディレクトリからの相対パス、page は実ページ番号）
+
+    テキスト抽出は取り込みキャッシュ（内容ハッシュ単位）を経由する。
+    """
+    _, pages, _ = load_pages(path, root)
+    title = os.path.splitext(os.path.relpath(path, root))[0].replace(os.sep, "/")
+    return [
+        {'text': chunk['text'], 'title': title, 'page': str(chunk['page']), 'chunk': i}
+        for i, chunk in enumerate(chunk_pages(pages), 1)
+    ]
+
+
+def bm25_idf(n_chunks: int, df: int) -> float:
+    """語のIDF（df はその語を含むチャンク数）"""
+    return math.log(1.0 + (n_chunks - df + 0.5) / (df + 0.5))
+
+
+def bm25_tf(tf: int, length: int, avg_length: float, k1: float, b: float) -> float:
+    """文書長で正規化した語の出現数の項"""
+    return tf * (k1 + 1.0) / (tf + k1 * (1.0 - b + b * length / avg_length))
+
+
+def search_result(chunk: Dict, score: float) -> Dict:
+    """検索結果を context_chunks 形式にする"""
+    return {
+        'title': chunk.get('title', '不明'),
+        'page': chunk.get('page', '不明'),
+        'snippet': make_snippet(chunk["text"]),
+        'source': chunk.get('source', ''),
+        'score': round(score, 4),
+    }
+
+
+class BM25Index:
+    """メモリ上の転置インデックス（BM25スコアリング）"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.chunks: Dict[int, Dict] = {}
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.total_length = 0
+        self._next_id = 0
+
+    def add(self, text: str, meta: Dict) -> int:
+        """チャンクを追加し、チャンクIDを返す"""
+        chunk_id = self._next_id
+        self._next_id += 1
+        counts = Counter(tokenize(text))
+        length = sum(counts.values())
+        self.chunks[chunk_id] = dict(meta, text=text, length=length)
+        self.total_length += length
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[chunk_id] = tf
+        return chunk_id
+
+    def remove(self, chunk_id: int) -> None:
+        """チャンクを削除（保存済みの本文から語を再計算して転置リストを更新）"""
+        chunk = self.chunks.pop(chunk_id, None)
+        if chunk is None:
+            return
+        self.total_length -= chunk["length"]
+        for term in set(tokenize(chunk["text"])):
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(chunk_id, None)
+                if not posting:
+                    del self.postings[term]
+
+    def search(self, query: str, top_k: int = 5) -> List[Dict]:
+        """クエリに対するBM25上位チャンクを context_chunks 形式で返す"""
+        n_chunks = len(self.chunks)
+        if not n_chunks or top_k <= 0:
+            return []
+        avg_length = self.total_length / n_chunks or 1.0
+
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = bm25_idf(n_chunks, len(posting))
+            for chunk_id, tf in posting.items():
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * bm25_tf(
+                    tf, self.chunks[chunk_id]["length"], avg_length, self.k1, self.b)
+
+        return [
+            search_result(self.chunks[chunk_id], score)
+            for chunk_id, score in heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        ]
+
+
+def search_text(text: str, query: str, top_k: int = 5, title_prefix: str = "参考資料") -> List[Dict]:
+    """単発の参考資料テキストから関連チャンクを検索（一時インデックス）
+
+    クエリに一致するチャンクがない場合は先頭から top_k 件を返す。
+    """
+    index = BM25Index()
+    for i, chunk in enumerate(split_chunks(text), 1):
+        index.add(chunk, {'title': f'{title_prefix}{i}', 'page': str(i)})
+    results = index.search(query, top_k)
+    if results:
+        return results
+    return [
+        {'title': chunk['title'], 'page': chunk['page'], 'snippet': make_snippet(chunk['text'])}
+        for chunk in list(index.chunks.values())[:top_k]
+    ]
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    signature TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    title TEXT NOT NULL,
+    page TEXT NOT NULL,
+    chunk INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    length INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chunks_path ON chunks (path);
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    chunk_id INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    PRIMARY KEY (term, chunk_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_chunk ON postings (chunk_id);
+"""
+# 旧形式（1つのJSONに全チャンク・転置リスト）のインデックス。読み込まずに削除する
+LEGACY_INDEX_FILE = "bm25.json"
+# SQLiteのロック待ち（秒）。取り込み中の別プロセスの書き込みを待つ
+BUSY_TIMEOUT_SEC = 30.0
+
+
+class KnowledgeIndex:
+    """knowledge/ ディレクトリ全体の永続BM25インデックス（SQLite）
+
+    ファイルのmtime・サイズが変わったものだけを再索引化する（増分更新）。
+    インデックスは <root>/.index/bm25.sqlite3 に保存し、チャンク・転置リストはファイル単位で
+    追加・削除するため、更新は変更された文書の分しか書き込まない。起動時に全体を読み込まず、
+    検索はクエリの語の転置リストだけを読む。スレッドごとに接続を持ち、複数プロセスで共有できる。
+    """
+
+    def __init__(self, root: str = DEFAULT_KNOWLEDGE_DIR, index_path: Optional[str] = None,
+                 refresh_interval: float = 30.0, k1: float = 1.5, b: float = 0.75):
+        self.root = root
+        self.index_path = index_path or os.path.join(index_dir(root), "bm25.sqlite3")
+        self.refresh_interval = refresh_interval
+        self.k1 = k1
+        self.b = b
+        self._last_scan = 0.0
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+        self._init_schema()
+        if index_path is None:
+            try:
+                os.remove(os.path.join(index_dir(root), LEGACY_INDEX_FILE))
+            except OSError:
+                pass
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.index_path, timeout=BUSY_TIMEOUT_SEC, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _init_schema(self) -> None:
+        """テーブルを作成（形式のバージョンが違えば作り直す）"""
+        with self._transaction() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if row is None or row[0] != INDEX_FORMAT_VERSION:
+                for table in ("meta", "files", "chunks", "postings"):
+                    conn.execute(f"DROP TABLE IF EXISTS {table}")
+            for statement in _SCHEMA.split(";"):
+                if statement.strip():
+                    conn.execute(statement)
+            conn.executemany("INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)",
+                             [("version", INDEX_FORMAT_VERSION), ("chunks", 0), ("total_length", 0)])
+
+    @property
+    def files(self) -> Dict[str, List[int]]:
+        """索引済みファイル（相対パス → 署名）"""
+        rows = self._conn().execute("SELECT path, signature FROM files").fetchall()
+        return {path: json.loads(signature) for path, signature in rows}
+
+    def chunk_count(self) -> int:
+        """索引済みのチャンク数"""
+        return self._stats()[0]
+
+    def _stats(self) -> Tuple[int, int]:
+        """(チャンク数, 総トークン数)"""
+        stats = dict(self._conn().execute(
+            "SELECT key, value FROM meta WHERE key IN ('chunks', 'total_length')").fetchall())
+        return stats.get("chunks", 0), stats.get("total_length", 0)
+
+    @staticmethod
+    def _remove_file(conn: sqlite3.Connection, rel_path: str) -> None:
+        """ファイルのチャンク・転置リストを削除（トランザクション内で呼ぶ）"""
+        count, length = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunks WHERE path = ?", (rel_path,)).fetchone()
+        conn.execute("DELETE FROM postings WHERE chunk_id IN (SELECT id FROM chunks WHERE path = ?)", (rel_path,))
+        conn.execute("DELETE FROM chunks WHERE path = ?", (rel_path,))
+        conn.execute("DELETE FROM files WHERE path = ?", (rel_path,))
+        conn.execute("UPDATE meta SET value = value - ? WHERE key = 'chunks'", (count,))
+        conn.execute("UPDATE meta SET value = value - ? WHERE key = 'total_length'", (length,))
+
+    def _replace_file(self, rel_path: str, signature: List[int], doc_chunks: List[Dict]) -> None:
+        """ファイルのチャンクを入れ替える（1ファイル1トランザクション）"""
+        with self._transaction() as conn:
+            self._remove_file(conn, rel_path)
+            total = 0
+            for chunk in doc_chunks:
+                counts = Counter(tokenize(chunk["text"]))
+                length = sum(counts.values())
+                total += length
+                chunk_id = conn.execute(
+                    "INSERT INTO chunks (path, title, page, chunk, text, length) VALUES (?, ?, ?, ?, ?, ?)",
+                    (rel_path, chunk["title"], chunk["page"], chunk["chunk"], chunk["text"], length)).lastrowid
+                conn.executemany("INSERT INTO postings (term, chunk_id, tf, length) VALUES (?, ?, ?, ?)",
+                                 [(term, chunk_id, tf, length) for term, tf in counts.items()])
+            conn.execute("INSERT INTO files (path, signature) VALUES (?, ?)", (rel_path, json.dumps(signature)))
+            conn.execute("UPDATE meta SET value = value + ? WHERE key = 'chunks'", (len(doc_chunks),))
+            conn.execute("UPDATE meta SET value = value + ? WHERE key = 'total_length'", (total,))
+
+    def update(self, force: bool = False) -> Dict[str, int]:
+        """変更されたファイルのみ再索引化し、件数を返す"""
+        with self._lock:
+            counts = {"added": 0, "updated": 0, "removed": 0}
+            if not os.path.isdir(self.root):
+                return counts
+
+            indexed = self.files
+            seen = set()
+            for path in iter_knowledge_files(self.root):
+                rel_path = os.path.relpath(path, self.root)
+                seen.add(rel_path)
+                try:
+                    signature = file_signature(path)
+                except OSError:
+                    continue
+                old_signature = indexed.get(rel_path)
+                if old_signature == signature and not force:
+                    continue
+
+                try:
+                    doc_chunks = load_document_chunks(path, self.root)
+                except ExtractionError as e:
+                    # 抽出できないファイルは署名だけ記録し、変更されるまで再試行しない
+                    print(f"警告: {e}")
+                    doc_chunks = []
+                self._replace_file(rel_path, signature, doc_chunks)
+                counts["updated" if old_signature is not None else "added"] += 1
+
+            for rel_path in [p for p in indexed if p not in seen]:
+                with self._transaction() as conn:
+                    self._remove_file(conn, rel_path)
+                counts["removed"] += 1
+
+            self._last_scan = time.time()
+            return counts
+
+    def search(self, query: str, top_k: int = 5) -> List[Dict]:
+        """必要に応じて増分更新してから、クエリに対するBM25上位チャンクを返す"""
+        with self._lock:
+            if time.time() - self._last_scan >= self.refresh_interval:
+                self.update()
+        n_chunks, total_length = self._stats()
+        if not n_chunks or top_k <= 0:
+            return []
+        avg_length = total_length / n_chunks or 1.0
+
+        conn = self._conn()
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            posting = conn.execute("SELECT chunk_id, tf, length FROM postings WHERE term = ?", (term,)).fetchall()
+            if not posting:
+                continue
+            idf = bm25_idf(n_chunks, len(posting))
+            for chunk_id, tf, length in posting:
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * bm25_tf(
+                    tf, length, avg_length, self.k1, self.b)
+
+        top = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        if not top:
+            return []
+        rows = conn.execute(
+            f"SELECT id, title, page, text, path FROM chunks WHERE id IN ({','.join('?' * len(top))})",
+            [chunk_id for chunk_id, _ in top]).fetchall()
+        chunks = {row[0]: {"title": row[1], "page": row[2], "text": row[3], "source": row[4]} for row in rows}
+        return [search_result(chunks[chunk_id], score) for chunk_id, score in top if chunk_id in chunks]
+
+
+# 使用例
+if __name__ == "__main__":
+    import sys
+
+    index = KnowledgeIndex()
+    print(f"索引更新: {index.update()}")
+    print(f"文書数: {len(index.files)} / チャンク数: {index.chunk_count()}")
+
+    query = sys.argv[1] if len(sys.argv) > 1 else "フォークリフト 作業前点検"
+    print(f"\n検索: {query}")
+    for hit in index.search(query, top_k=5):
+        print(f"  [{hit['score']}] {hit['title']} p.{hit['page']}: {hit['snippet'][:60]}")
@@ -0,0 +1,233 @@
+"""
+知識ファイルの取り込みパイプライン
+.txt / .md / .pdf からページ単位でテキストを抽出し、内容ハッシュでキャッシュする
+抽出はプロセスプールで並列化し、新規・変更ファイルのみ処理する
+"""
+
+import hashlib
+import json
+import os
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+INGEST_EXTENSIONS = (".txt", ".md", ".pdf")
+EXTRACTOR_VERSION = 1
+CHUNK_MAX_CHARS = 200  # プロンプト抜粋（200字）で切り捨てられない長さ
+CHUNK_OVERLAP = 60  # 前チャンク末尾から引き継ぐ最大文字数（行単位）
+
+Page = Tuple[int, str]
+
+
+class ExtractionError(Exception):
+    """テキスト抽出に失敗した場合の例外"""
+
+
+def index_dir(root: str) -> str:
+    """取り込み結果・インデックスの保存先（<root>/.index）"""
+    return os.path.join(root, ".index")
+
+
+def file_signature(path: str) -> List[int]:
+    """変更検知用の署名（mtime, size）"""
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def _extract_pdf_pages(path: str) -> List[Page]:
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        try:
+            from PyPDF2 import PdfReader
+        except ImportError:
+            raise ExtractionError("PDFの抽出には pypdf（または PyPDF2）が必要です")
+    try:
+        reader = PdfReader(path)
+        return [(i, page.extract_text() or "") for i, page in enumerate(reader.pages, 1)]
+    except Exception as e:
+        raise ExtractionError(f"PDF抽出失敗: {path}: {e}")
+
+
+def extract_pages(path: str, data: Optional[bytes] = None) -> List[Page]:
+    """ファイルから (ページ番号, テキスト) のリストを抽出
+
+    テキスト系ファイルは改ページ（\\f）でページを区切る（なければ全体が1ページ）。
+    """
+    if path.lower().endswith(".pdf"):
+        return _extract_pdf_pages(path)
+    if data is None:
+        with open(path, "rb") as f:
+            data = f.read()
+    text = data.decode("utf-8", errors="replace")
+    return [(i, page) for i, page in enumerate(text.split("\f"), 1)]
+
+
+def _cache_path(root: str, content_hash: str) -> str:
+    return os.path.join(index_dir(root), "extracted", content_hash[:2], f"{content_hash}.json")
+
+
+def _read_cached_pages(root: str, content_hash: str) -> Optional[List[Page]]:
+    try:
+        with open(_cache_path(root, content_hash), "r", encoding="utf-8") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if entry.get("version") != EXTRACTOR_VERSION:
+        return None
+    return [(page, text) for page, text in entry["pages"]]
+
+
+def _write_cached_pages(root: str, content_hash: str, pages: List[Page]) -> None:
+    path = _cache_path(root, content_hash)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": EXTRACTOR_VERSION, "pages": pages}, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def load_pages(path: str, root: str) -> Tuple[str, List[Page], bool]:
+    """抽出キャッシュを使ってページを読み込み、(内容ハッシュ, ページ, キャッシュ命中) を返す"""
+    with open(path, "rb") as f:
+        data = f.read()
+    content_hash = hashlib.sha256(data).hexdigest()
+    pages = _read_cached_pages(root, content_hash)
+    if pages is not None:
+        return content_hash, pages, True
+    pages = extract_pages(path, data)
+    _write_cached_pages(root, content_hash, pages)
+    return content_hash, pages, False
+
+
+def _split_long(paragraph: str, max_chars: int) -> Iterator[str]:
+    """max_chars を超える段落を行単位（行自体が長い場合は文字数）で分割"""
+    if len(paragraph) <= max_chars:
+        yield paragraph
+        return
+    current = ""
+    for line in paragraph.split("\n"):
+        while len(line) > max_chars:
+            if current:
+                yield current
+                current = ""
+            yield line[:max_chars]
+            line = line[max_chars:]
+        if current and len(current) + len(line) + 1 > max_chars:
+            yield current
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    if current:
+        yield current
+
+
+def _overlap_tail(text: str, overlap: int) -> str:
+    """チャンク末尾から overlap 文字以内の行を取り出す"""
+    tail_lines, total = [], 0
+    for line in reversed(text.split("\n")):
+        if total + len(line) + 1 > overlap:
+            break
+        tail_lines.insert(0, line)
+        total += len(line) + 1
+    return "\n".join(tail_lines)
+
+
+def chunk_pages(pages: Iterable[Page], max_chars: int = CHUNK_MAX_CHARS,
+                overlap: int = CHUNK_OVERLAP) -> Iterator[Dict]:
+    """ページ列を重複付きチャンクに分割して順に返す
+
+    空行区切りの段落を max_chars 以内にまとめ、次のチャンクの先頭には前チャンク末尾の行を
+    overlap 文字まで引き継ぐ。page はチャンクの新しい内容が始まるページ番号。
+    """
+    current, current_page, fresh = "", None, False
+    for page_no, text in pages:
+        for para in re.split(r'\n\s*\n', text):
+            para = para.strip()
+            if not para:
+                continue
+            for piece in _split_long(para, max_chars):
+                if current and len(current) + len(piece) + 1 > max_chars:
+                    if fresh:
+                        yield {"text": current, "page": current_page}
+                    current = _overlap_tail(current, overlap) if overlap else ""
+                    if len(current) + len(piece) + 1 > max_chars:
+                        current = ""
+                    fresh = False
+                if not fresh:
+                    current_page = page_no
+                current = f"{current}\n{piece}" if current else piece
+                fresh = True
+    if current and fresh:
+        yield {"text": current, "page": current_page}
+
+
+def iter_source_files(root: str, extensions: Tuple[str, ...] = INGEST_EXTENSIONS) -> Iterator[str]:
+    """知識ディレクトリ内の取り込み対象ファイルを列挙（隠しディレクトリとREADMEは除外）"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        for name in sorted(filenames):
+            if name.lower().endswith(extensions) and name != "README.md":
+                yield os.path.join(dirpath, name)
+
+
+def _extract_worker(path: str, root: str) -> Tuple[str, int, bool]:
+    """プロセスプール用：抽出してキャッシュに保存し、(内容ハッシュ, ページ数, キャッシュ命中) を返す"""
+    content_hash, pages, cached = load_pages(path, root)
+    return content_hash, len(pages), cached
+
+
+def extract_all(root: str, workers: Optional[int] = None) -> Dict[str, int]:
+    """新規・変更ファイルのテキストを並列抽出してキャッシュする
+
+    処理済みファイルの署名と内容ハッシュは <root>/.index/ingest_manifest.json に記録し、
+    署名が変わっていないファイルは読み込みもしない。
+    """
+    manifest_path = os.path.join(index_dir(root), "ingest_manifest.json")
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    counts = {"extracted": 0, "cached": 0, "unchanged": 0, "removed": 0, "failed": 0}
+    targets = {}
+    seen = set()
+    for path in iter_source_files(root):
+        rel_path = os.path.relpath(path, root)
+        seen.add(rel_path)
+        signature = file_signature(path)
+        entry = manifest.get(rel_path)
+        if entry and entry["signature"] == signature \
+                and os.path.exists(_cache_path(root, entry["hash"])):
+            counts["unchanged"] += 1
+            continue
+        targets[rel_path] = (path, signature)
+
+    for rel_path in [p for p in manifest if p not in seen]:
+        del manifest[rel_path]
+        counts["removed"] += 1
+
+    if targets:
+        # プロセスプール（multiprocessing）は抽出対象があるときだけ読み込む
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(_extract_worker, path, root): (rel_path, signature)
+                for rel_path, (path, signature) in targets.items()
+            }
+            for future in as_completed(futures):
+                rel_path, signature = futures[future]
+                try:
+                    content_hash, n_pages, cached = future.result()
+                except Exception as e:
+                    print(f"警告: 抽出に失敗: {rel_path}: {e}")
+                    counts["failed"] += 1
+                    continue
+                manifest[rel_path] = {"signature": signature, "hash": content_hash, "pages": n_pages}
+                counts["cached" if cached else "extracted"] += 1
+
+    os.makedirs(index_dir(root), exist_ok=True)
+    tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
+    return counts
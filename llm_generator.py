@@ -1,10 +1,42 @@
+import logging
 import os
 import json
 import re
-import requests
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Tuple, Optional
-from dataclasses import dataclass
-from validator import SlideValidator
+from dataclasses import dataclass, replace
+from validator import SlideValidator, IncrementalSlideValidator
+from llm_transport import AsyncOllamaTransport, OllamaTransport, OpenAITransport, TransportError, resolve_ollama_url
+from response_cache import ResponseCache, make_cache_key
+from backend_health import get_health_registry, is_outage
+from knowledge_index import KnowledgeIndex, search_text
+from context_budget import (
+    DEFAULT_PROMPT_TOKEN_BUDGET, ContextBudget, DictEntry, estimate_tokens, format_dictionary,
+    rank_dictionary_terms,
+)
+from fewshot import DEFAULT_FEWSHOT_K, DEFAULT_FEWSHOT_TOKEN_BUDGET, FewshotIndex, format_example
+from resources import PromptResources, get_prompt_resources
+from best_of_n import arun_candidates, candidate_settings, run_candidates, score_candidate
+from hedging import (
+    FIRST_TOKEN, HedgeCancelled, HedgePolicy, HedgeRoute, arun_hedged, get_latency_tracker, run_hedged,
+)
+from metrics import (
+    STAGE_GENERATE, STAGE_PROMPT_BUILD, STAGE_RETRIEVAL, STAGE_SAVE, STAGE_VALIDATION, current_trace,
+    record_generation, record_llm_call, stage,
+)
+from multi_unit import (
+    DEFAULT_UNIT_CONCURRENCY, UNIT_PLAN_MAX_TOKENS, build_plan_prompt, build_unit_input, default_unit_titles,
+    parse_theme, parse_unit_count, parse_unit_titles, stitch_units,
+)
+from slide_repair import (
+    REPAIR_PARSE_ERROR, RepairPlan, apply_repair, build_repair_prompt, derive_excel, fix_mechanical,
+    is_mechanical_error, join_output, plan_repair,
+)
+
+logger = logging.getLogger(__name__)
 
 @dataclass
 class GenerationConfig:
@@ -13,59 +45,150 @@ class GenerationConfig:
     temperature: float = 0.3
     max_tokens: int = 4000
     max_retries: int = 3
+    stream: bool = False  # ollamaのストリーミング出力を逐次バリデートし、致命的エラーで即中断
+    use_cache: bool = True  # バリデート合格済み出力のディスクキャッシュを使う
+    refresh_cache: bool = False  # キャッシュを読まずに再生成し、結果で上書きする
+    context_top_k: int = 5  # 参考資料・知識インデックスからそれぞれ取得するチャンク数
+    repair: bool = True  # ページ単位で直せるエラーは該当ページだけを書き直させる（全体を再生成しない）
+    auto_fix: bool = True  # ページ番号の振り直しなど機械的に直せるエラーは再生成せずに修正する（ストリーミングでも中断しない）
+    human_only: bool = False  # LLMには人間用のみを生成させ、Excel用は人間用から導出する
+    prompt_token_budget: int = DEFAULT_PROMPT_TOKEN_BUDGET  # プロンプト（出力を除く）のトークン予算
+    fewshot_k: int = DEFAULT_FEWSHOT_K  # 載せる良い例の最大数（悪い例は1件まで、0で例を載せない）
+    fewshot_token_budget: int = DEFAULT_FEWSHOT_TOKEN_BUDGET  # Few-shot例に使うトークン数の上限
+    split_units: bool = True  # 複数ユニットの講座はユニットごとに並列生成して連結する
+    unit_concurrency: int = DEFAULT_UNIT_CONCURRENCY  # 同時に生成するユニット数の上限
+    candidates: int = 1  # 2以上で試行ごとに候補をN件並列生成し、最良のものを採用する（Best-of-N）
+    candidate_temperatures: Tuple[float, ...] = ()  # 候補ごとの温度（未指定は temperature から段階的に上げる）
+    seed: Optional[int] = None  # ollamaの乱数シード（Best-of-N では候補ごとに自動で変える）
+    hedge: bool = False  # 主経路が遅い場合に他のバックエンド・モデルへ同時に投げる
+    hedge_backends: Tuple[str, ...] = ()  # ヘッジ先（"モデル名" / "モデル名@ollamaのURL" / "gpt-..."）
+    hedge_percentile: float = 0.9  # 主経路の直近レイテンシのこのパーセンタイルでヘッジする
+    hedge_default_delay_sec: float = 60.0  # レイテンシの記録が足りない経路のヘッジまでの待ち時間
+    keep_alive: str = "30m"  # ollamaがモデル（と固定プレフィックスのKVキャッシュ）を保持する時間
+    num_ctx: int = 0  # ollamaのコンテキスト長（0はトークン予算+最大出力から決める。変えるとモデルが再ロードされる）
+    demo_fallback: bool = True  # LLMが使えないときデモ用レスポンスを返す（Falseでは BackendUnavailable）
+
+class BackendUnavailable(Exception):
+    """使えるLLMバックエンドがない場合の例外（demo_fallback=False のとき）"""
+
+class StreamAborted(Exception):
+    """ストリーミング生成を致命的エラー検出により途中で打ち切った場合の例外"""
+    
+    def __init__(self, errors: List[str], partial_text: str):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+        self.partial_text = partial_text
 
 class LLMSlideGenerator:
     """スライド台本生成システムのメインクラス"""
     
-    def __init__(self, config: GenerationConfig = None):
+    def __init__(self, config: GenerationConfig = None, knowledge_index: Optional[KnowledgeIndex] = None,
+                 vector_store=None):
         self.config = config or GenerationConfig()
+        self.knowledge_index = knowledge_index
+        # search(query, top_k) で context_chunks 形式を返す意味検索ストア（vector_store.VectorStore）
+        self.vector_store = vector_store
         self.validator = SlideValidator()
-        self.system_prompt = self._load_system_prompt()
-        self.fewshot_examples = self._load_fewshot_examples()
-        self.safety_dict = self._load_safety_dict()
+        # プロンプト資源（システムプロンプト・Few-shot例・辞書）はプロセス全体で共有し、
+        # ファイルが更新されたときだけ読み直す（resources.ResourceRegistry）。ここでは読み込みだけ済ませておく
+        get_prompt_resources()
+        # バックエンド接続はジェネレータ単位でプールして使い回す
+        self.ollama_transport = OllamaTransport()
+        self.async_ollama_transport = AsyncOllamaTransport()
+        self.openai_transport = OpenAITransport()
+        self.cache = ResponseCache()
+        # バックエンドの障害状態はプロセス全体で共有（停止中のバックエンドは即スキップ）
+        self.health = get_health_registry()
+        self.ollama_backend = f"ollama:{self.ollama_transport.base_url}"
+        self.health.register_probe(self.ollama_backend, self.ollama_transport.is_alive)
+        # 経路ごとのレイテンシもプロセス全体で共有（ヘッジの待ち時間に使う）
+        self.latency = get_latency_tracker()
+        # ヘッジ先の別ホストのollama（URL → (同期, 非同期)トランスポート）
+        self._hedge_transports: Dict[str, Tuple[OllamaTransport, AsyncOllamaTransport]] = {}
     
-    def _load_system_prompt(self) -> str:
-        """システムプロンプトを読み込み"""
-        try:
-            with open("system_rules_ja.txt", "r", encoding="utf-8") as f:
-                return f.read().strip()
-        except FileNotFoundError:
-            return "システムプロンプトファイルが見つかりません"
+    @property
+    def resources(self) -> PromptResources:
+        """現在のプロンプト資源（不変なスナップショット）"""
+        return get_prompt_resources()
     
-    def _load_fewshot_examples(self) -> str:
-        """Few-shotサンプルを読み込み"""
-        try:
-            with open("fewshot_samples.txt", "r", encoding="utf-8") as f:
-                return f.read().strip()
-        except FileNotFoundError:
-            return ""
+    @property
+    def system_prompt(self) -> str:
+        return self.resources.system_prompt
     
-    def _load_safety_dict(self) -> str:
-        """安全用語辞書を読み込み"""
-        try:
-            with open("safety_dict.txt", "r", encoding="utf-8") as f:
-                return f.read().strip()
-        except FileNotFoundError:
-            return ""
+    @property
+    def fewshot_examples(self) -> str:
+        return self.resources.fewshot_examples
+    
+    @property
+    def fewshot_index(self) -> FewshotIndex:
+        return self.resources.fewshot_index
+    
+    @property
+    def safety_dict(self) -> str:
+        return self.resources.safety_dict
     
-    def build_prompt(self, user_input: str, context_chunks: List[Dict] = None) -> str:
-        """プロンプトを構築"""
+    @property
+    def dictionary_entries(self) -> Tuple[DictEntry, ...]:
+        return self.resources.dictionary_entries
+    
+    @property
+    def prompt_prefix(self) -> str:
+        """全ジョブ共通の固定プレフィックス（ollamaのsystem欄・OpenAIのsystemメッセージで送る）"""
+        return self.resources.prompt_prefix
+    
+    def build_prompt(self, user_input: str, context_chunks: List[Dict] = None, human_only: bool = False,
+                     token_budget: Optional[int] = None, fewshot_k: Optional[int] = None,
+                     fewshot_token_budget: Optional[int] = None) -> str:
+        """ジョブごとのプロンプトを構築（固定プレフィックス self.prompt_prefix は含まない）
+
+        辞書はテーマ・参考資料抜粋に関連する用語のみ、Few-shot例はテーマに近い良い例・悪い例を
+        fewshot_token_budget 以内で選ぶ。トークン予算を超える場合は優先度の低いもの
+        （Few-shot例 → 参考資料抜粋の下位 → 関連度の低い用語）から削る。
+        human_only=True では人間用のみを出力させる。
+        """
         # RAG情報の構築
-        rag_content = ""
-        if context_chunks:
-            rag_items = []
-            for chunk in context_chunks:
-                title = chunk.get('title', '不明')
-                page = chunk.get('page', '不明')
-                snippet = chunk.get('snippet', '')
-                rag_items.append(f"- {title} p.{page}: {snippet}")
-            rag_content = "\n".join(rag_items)
-        
-        # 完全なプロンプトを構築
-        prompt = f"""{self.system_prompt}
+        rag_items = []
+        for chunk in context_chunks or []:
+            title = chunk.get('title', '不明')
+            page = chunk.get('page', '不明')
+            snippet = chunk.get('snippet', '')
+            rag_items.append(f"- {title} p.{page}: {snippet}")
+        # 資源は1回だけ取得し、プロンプト全体で同じ版を使う
+        resources = self.resources
+        output_request = self._output_request(human_only)
+        examples = [
+            format_example(example, human_only) for example in resources.fewshot_index.select(
+                user_input,
+                self.config.fewshot_k if fewshot_k is None else fewshot_k,
+                self.config.fewshot_token_budget if fewshot_token_budget is None else fewshot_token_budget
+            )
+        ]
+        
+        # 予算配分（固定プレフィックス・ユーザー入力・出力要求は削らない）
+        budget = ContextBudget(self.config.prompt_token_budget if token_budget is None else token_budget)
+        budget.reserve("固定プレフィックス", resources.prompt_prefix)
+        budget.reserve("ユーザー入力", user_input)
+        budget.reserve("出力要求", output_request)
+        terms, unrelated = rank_dictionary_terms(resources.dictionary_entries, "\n".join([user_input] + rag_items))
+        budget.record_cut("辞書(無関係な用語)", [entry.text for entry in unrelated])
+        budget.add("辞書(用語)", [entry.text for entry in terms], priority=1)
+        budget.add("参考資料抜粋", rag_items, priority=2)
+        budget.add("Few-shot例", examples, priority=3)
+        kept = budget.allocate()
+        logger.debug(f"{budget.summary()}")
+        
+        # 辞書は元の並び順で載せる（同じ用語の組み合わせなら同じ文字列になる）
+        selected = {id(terms[i]) for i in kept["辞書(用語)"]}
+        dictionary = format_dictionary([entry for entry in resources.dictionary_entries if id(entry) in selected])
+        rag_content = "\n".join(rag_items[i] for i in kept["参考資料抜粋"])
+        example_content = "\n\n---\n\n".join(examples[i] for i in kept["Few-shot例"])
+        
+        # ジョブごとのプロンプトを構築（変わりにくいものから順に並べる）
+        prompt = f"""[辞書]
+{dictionary}
 
-[辞書]
-{self.safety_dict}
+[出力例]
+{example_content}
 
 [参考資料 抜粋]
 {rag_content}
@@ -74,109 +197,838 @@ class LLMSlideGenerator:
 {user_input}
 
 [出力要求]
-1) 人間用スライド → 2) Excel用。Excelのtext_enは空欄。"""
+{output_request}"""
         
         return prompt
     
-    def generate_slides(self, user_input: str, reference_materials: str = "") -> Tuple[str, str, Dict]:
-        """スライド台本を生成（メインメソッド）"""
-        # コンテキストチャンクの準備（参考資料がある場合）
+    @staticmethod
+    def _strip_inline_reference(user_input: str, reference_materials: str) -> str:
+        """ユーザー入力に参考資料の全文が埋め込まれていれば除く（抜粋と二重に送らないため）"""
+        reference = reference_materials.strip()
+        if reference and reference in user_input:
+            logger.debug(f"ユーザー入力内の参考資料全文を除去（{len(reference)}文字）")
+            return user_input.replace(reference, "[参考資料 抜粋]を参照")
+        return user_input
+    
+    @staticmethod
+    def _output_request(human_only: bool) -> str:
+        """[出力要求] の本文（人間用のみの場合はExcel用を出力させない）"""
+        if human_only:
+            return "人間用スライドのみ（Excel用は出力しない。人間用から自動生成する）。"
+        return "1) 人間用スライド → 2) Excel用。Excelのtext_enは空欄。"
+    
+    @staticmethod
+    def _retrieval_query(user_input: str) -> str:
+        """検索クエリを抽出（【テーマ】行があればそれを使う）"""
+        match = re.search(r'【テーマ】(.+)', user_input)
+        return match.group(1).strip() if match else user_input
+    
+    def _build_context_chunks(self, user_input: str, reference_materials: str,
+                              config: GenerationConfig) -> List[Dict]:
+        """参考資料と知識インデックスからテーマに関連するチャンクを準備"""
+        query = self._retrieval_query(user_input)
         context_chunks = []
         if reference_materials:
-            # 簡単な分割処理（実際のRAGではより高度な処理が必要）
-            paragraphs = reference_materials.split('\n\n')[:5]  # 最初の5段落を使用
-            for i, para in enumerate(paragraphs):
-                if para.strip():
-                    context_chunks.append({
-                        'title': f'参考資料{i+1}',
-                        'page': str(i+1),
-                        'snippet': para.strip()[:200] + ('...' if len(para.strip()) > 200 else '')
-                    })
+            context_chunks.extend(search_text(reference_materials, query, config.context_top_k))
+        if self.knowledge_index is not None:
+            context_chunks.extend(self.knowledge_index.search(query, config.context_top_k))
+        if self.vector_store is not None:
+            # 語彙検索で既に選ばれたチャンクは重複させない
+            seen = {(chunk.get('title'), chunk.get('snippet')) for chunk in context_chunks}
+            for chunk in self.vector_store.search(query, config.context_top_k):
+                if (chunk.get('title'), chunk.get('snippet')) not in seen:
+                    context_chunks.append(chunk)
+        return context_chunks
+    
+    def _initial_prompt(self, user_input: str, reference_materials: str, config: GenerationConfig) -> str:
+        """初回のプロンプト（検索とプロンプト構築をそれぞれ計測する）"""
+        with stage(STAGE_RETRIEVAL) as span:
+            context_chunks = self._build_context_chunks(user_input, reference_materials, config)
+            span["chunks"] = len(context_chunks)
+        with stage(STAGE_PROMPT_BUILD) as span:
+            prompt = self.build_prompt(
+                self._strip_inline_reference(user_input, reference_materials), context_chunks,
+                config.human_only, config.prompt_token_budget,
+                config.fewshot_k, config.fewshot_token_budget
+            )
+            span["prompt_tokens"] = estimate_tokens(prompt)
+        return prompt
+    
+    def _check_output(self, validator: SlideValidator, generated_text: str) -> Tuple[str, str, bool, List[str]]:
+        """生成テキストを分割してバリデート"""
+        with stage(STAGE_VALIDATION) as span:
+            human_text, excel_text = self._split_output(generated_text)
+            is_valid, errors = validator.validate_all(human_text, excel_text)
+            span["passed"] = is_valid
+        return human_text, excel_text, is_valid, list(errors)
+    
+    def _check_attempt(self, validator: SlideValidator, response: str, repair_plan: Optional[RepairPlan],
+                       config: GenerationConfig) -> Tuple[str, str, str, bool, List[str]]:
+        """応答をバリデートし、(生成テキスト, 人間用, Excel用, 合否, エラー) を返す（所要時間を計測）"""
+        with stage(STAGE_VALIDATION) as span:
+            result = self._validate_attempt(validator, response, repair_plan, config, span)
+            span["passed"], span["errors"] = result[3], len(result[4])
+        return result
+    
+    def _validate_attempt(self, validator: SlideValidator, response: str, repair_plan: Optional[RepairPlan],
+                          config: GenerationConfig,
+                          span: Optional[Dict] = None) -> Tuple[str, str, str, bool, List[str]]:
+        """応答をバリデートし、(生成テキスト, 人間用, Excel用, 合否, エラー) を返す
+
+        部分修正の応答は修正前の台本に差し戻してから台本全体をバリデートする。
+        人間用のみの生成ではExcel用を導出し、機械的に直せるエラーは再生成の前に修正する
+        （適用した修正は span の "auto_fixed" に記録する）。
+        """
+        human_text, excel_text = self._split_output(response)
+        changed = False
+        if repair_plan is not None:
+            spliced = apply_repair(repair_plan, human_text, excel_text, require_excel=not config.human_only)
+            if spliced is None:
+                # 対象ページを取り出せない場合は修正前の台本のまま（次は全体の修正プロンプトになる）
+                return (repair_plan.output_text, repair_plan.human_text, repair_plan.excel_text, False,
+                        repair_plan.errors + [REPAIR_PARSE_ERROR])
+            human_text, excel_text = spliced
+            changed = True
+        if config.human_only:
+            excel_text = derive_excel(human_text)
+            changed = True
+        
+        is_valid, errors = validator.validate_all(human_text, excel_text)
+        if not is_valid and config.auto_fix:
+            fixed = fix_mechanical(human_text, excel_text, errors)
+            if fixed:
+                human_text, excel_text, fixes = fixed
+                changed = True
+                logger.debug(f"自動修正: {', '.join(fixes)}")
+                if span is not None:
+                    span["auto_fixed"] = fixes
+                is_valid, errors = validator.validate_all(human_text, excel_text)
+        generated_text = join_output(human_text, excel_text) if changed else response
+        return generated_text, human_text, excel_text, is_valid, list(errors)
+    
+    def _retry_prompt(self, errors: List[str], generated_text: str,
+                      config: GenerationConfig) -> Tuple[str, Optional[RepairPlan]]:
+        """再試行のプロンプトを決める（全エラーがページに対応付けられる場合は部分修正）"""
+        if config.repair:
+            repair_plan = plan_repair(*self._split_output(generated_text), errors)
+            if repair_plan:
+                logger.debug(f"部分修正: {list(repair_plan.page_errors)}ページのみ書き直し")
+                return build_repair_prompt(repair_plan, config.human_only), repair_plan
+        return self._build_correction_prompt(errors, generated_text, config.human_only), None
+    
+    @staticmethod
+    def _success_stats(attempt: int, human_text: str, excel_text: str, backend: Optional[str] = None) -> Dict:
+        """成功時の統計情報（backend は採用した出力のバックエンド、retries は再試行の回数）"""
+        return {
+            'attempt': attempt,
+            'human_lines': len(human_text.split('\n')),
+            'excel_lines': len(excel_text.split('\n')),
+            'validation_passed': True,
+            'backend': backend,
+            'retries': max(0, attempt - 1)
+        }
+    
+    @staticmethod
+    def _failure_stats(config: GenerationConfig, errors: Optional[List[str]], backend: Optional[str] = None) -> Dict:
+        """最大試行回数に達した場合の統計情報"""
+        return {
+            'attempt': config.max_retries,
+            'validation_passed': False,
+            'final_errors': errors if errors is not None else ['生成に失敗しました'],
+            'backend': backend,
+            'retries': max(0, config.max_retries - 1)
+        }
+    
+    @staticmethod
+    def _record_result(stats: Dict) -> Dict:
+        """台本1件の結果（採用したバックエンド・試行回数）を計測に記録して stats を返す"""
+        record_generation(stats.get('backend') or "none", stats.get('attempt', 0),
+                          bool(stats.get('validation_passed')), bool(stats.get('cache_hit')))
+        return stats
+    
+    def _cache_key(self, prompt: str, config: GenerationConfig) -> str:
+        """最終プロンプトと生成パラメータからキャッシュキーを生成"""
+        return make_cache_key(prompt, self.prompt_prefix, config.model_name,
+                              config.temperature, config.max_tokens)
+    
+    def _cache_lookup(self, cache_key: str, config: GenerationConfig,
+                      validator: SlideValidator) -> Optional[Tuple[str, str, Dict]]:
+        """キャッシュ済みの出力を返す（現在のルールで再バリデートして合格したもののみ）"""
+        if not config.use_cache or config.refresh_cache:
+            return None
+        cached_text = self.cache.get(cache_key)
+        if cached_text is None:
+            return None
+        human_text, excel_text, is_valid, _ = self._check_output(validator, cached_text)
+        if not is_valid:
+            return None
+        logger.debug("キャッシュ使用")
+        stats = self._success_stats(0, human_text, excel_text, "cache")
+        stats['cache_hit'] = True
+        return human_text, excel_text, self._record_result(stats)
+    
+    def _cache_store(self, cache_key: str, config: GenerationConfig,
+                     generated_text: str, backend: str) -> None:
+        """バリデート合格済みの出力を保存（デモ用レスポンスは保存しない）"""
+        if not config.use_cache or backend == "demo":
+            return
+        try:
+            self.cache.put(cache_key, generated_text, {"model": config.model_name, "backend": backend})
+        except OSError as e:
+            logger.debug(f"キャッシュ保存失敗: {e}")
+    
+    def generate_slides(self, user_input: str, reference_materials: str = "",
+                        config: Optional[GenerationConfig] = None) -> Tuple[str, str, Dict]:
+        """スライド台本を生成（メインメソッド）
+
+        config を指定するとこの呼び出しのみ設定を上書きする（バッチ実行で
+        1つのジェネレータを複数ジョブ・複数モデルで共有するため）。
+        【ユニット数】が2以上の場合はユニットごとに並列生成して連結する（config.split_units）。
+        """
+        config = config or self.config
+        units = parse_unit_count(user_input)
+        with stage(STAGE_GENERATE, units=units) as span:
+            if config.split_units and units > 1:
+                result = self._generate_units(user_input, reference_materials, config, units)
+            else:
+                result = self._generate_single(user_input, reference_materials, config)
+            span["passed"], span["backend"] = result[2].get('validation_passed'), result[2].get('backend')
+        return result
+    
+    def _generate_units(self, user_input: str, reference_materials: str,
+                        config: GenerationConfig, units: int) -> Tuple[str, str, Dict]:
+        """ユニット構成を決め、各ユニットを並列に生成（ユニットごとにバリデート・再試行）して連結"""
+        titles = self._plan_units(user_input, units, config)
+        unit_inputs = [build_unit_input(user_input, number, titles) for number in range(1, units + 1)]
+        with ThreadPoolExecutor(max_workers=max(1, min(units, config.unit_concurrency))) as executor:
+            # 実行中のトレースを各ユニットのスレッドに引き継ぐ
+            futures = [
+                executor.submit(contextvars.copy_context().run, self._generate_single,
+                                unit_input, reference_materials, config)
+                for unit_input in unit_inputs
+            ]
+            results = [future.result() for future in futures]
+        return self._stitch_results(user_input, titles, results, config)
+    
+    def _plan_units(self, user_input: str, units: int, config: GenerationConfig) -> List[str]:
+        """各ユニットのタイトルを決める（決められない場合は連番のタイトル）"""
+        prompt = build_plan_prompt(user_input, units)
+        plan_config = replace(config, stream=False, max_tokens=UNIT_PLAN_MAX_TOKENS)
+        cache_key = self._cache_key(prompt, plan_config)
+        cached = self.cache.get(cache_key) if config.use_cache and not config.refresh_cache else None
+        titles = parse_unit_titles(cached, units) if cached else None
+        if titles is None:
+            try:
+                response, backend = self._invoke_llm(prompt, plan_config)
+                titles = parse_unit_titles(response, units)
+                if titles:
+                    self._cache_store(cache_key, plan_config, response, backend)
+            except Exception as e:
+                logger.debug(f"ユニット構成の生成失敗: {e}")
+        return self._unit_titles(titles, user_input, units)
+    
+    @staticmethod
+    def _unit_titles(titles: Optional[List[str]], user_input: str, units: int) -> List[str]:
+        if titles is None:
+            logger.debug("ユニット構成を読み取れないため連番のタイトルを使用")
+            return default_unit_titles(parse_theme(user_input), units)
+        logger.debug(f"ユニット構成: {titles}")
+        return titles
+    
+    def _stitch_results(self, user_input: str, titles: List[str], results: List[Tuple[str, str, Dict]],
+                        config: GenerationConfig) -> Tuple[str, str, Dict]:
+        """ユニットごとの生成結果を連結して台本全体をバリデート"""
+        # 失敗したユニットの結果は生成テキストそのままのため人間用だけを取り出す
+        human_text = stitch_units(parse_theme(user_input), titles,
+                                  [self._split_output(human)[0] for human, _, _ in results])
+        unit_stats = [stats for _, _, stats in results]
+        errors = [
+            f"第{number}ユニット: {error}"
+            for number, stats in enumerate(unit_stats, 1) if not stats.get('validation_passed')
+            for error in stats.get('final_errors', [])
+        ]
+        # 連結後のExcel用はページ番号が変わるため人間用から導出する
+        excel_text = derive_excel(human_text)
+        if not errors:
+            is_valid, errors = SlideValidator().validate_all(human_text, excel_text)
+            errors = list(errors)
+        attempt = max(stats.get('attempt', 0) for stats in unit_stats)
+        backend = "+".join(sorted({str(stats.get('backend')) for stats in unit_stats}))
+        if errors:
+            stats = self._failure_stats(config, errors, backend)
+            stats['attempt'] = attempt
+            stats['retries'] = sum(unit.get('retries', 0) for unit in unit_stats)
+            stats['units'] = unit_stats
+            return human_text, "", stats
+        stats = self._success_stats(attempt, human_text, excel_text, backend)
+        stats['retries'] = sum(unit.get('retries', 0) for unit in unit_stats)
+        stats['units'] = unit_stats
+        stats['cache_hit'] = all(unit.get('cache_hit') for unit in unit_stats)
+        return human_text, excel_text, stats
+    
+    def _generate_single(self, user_input: str, reference_materials: str,
+                         config: GenerationConfig) -> Tuple[str, str, Dict]:
+        """1つの台本（1回のLLM出力）を生成し、バリデート・再試行する"""
+        # バリデータはエラー状態を持つため呼び出しごとに生成（スレッド安全）
+        validator = SlideValidator()
         
         # プロンプト構築
-        full_prompt = self.build_prompt(user_input, context_chunks)
+        full_prompt = self._initial_prompt(user_input, reference_materials, config)
+        
+        # キャッシュ確認（キーは修正プロンプトではなく初回プロンプトで決まる）
+        cache_key = self._cache_key(full_prompt, config)
+        cached = self._cache_lookup(cache_key, config, validator)
+        if cached:
+            return cached
         
         # LLM生成（リトライ機能付き）
-        for attempt in range(self.config.max_retries):
+        generated_text, errors, repair_plan, backend = "", None, None, None
+        for attempt in range(config.max_retries):
             try:
-                generated_text = self._call_llm(full_prompt)
-                human_text, excel_text = self._split_output(generated_text)
-                
-                # バリデート
-                is_valid, errors = self.validator.validate_all(human_text, excel_text)
+                # 部分修正の出力は台本の一部のため、ストリーミング中の逐次バリデートは行わない
+                call_config = replace(config, stream=False) if repair_plan else config
+                response, backend = self._invoke_attempt(full_prompt, call_config, validator, repair_plan)
+                generated_text, human_text, excel_text, is_valid, errors = \
+                    self._check_attempt(validator, response, repair_plan, config)
                 
                 if is_valid:
-                    # 成功時の統計情報
-                    stats = {
-                        'attempt': attempt + 1,
-                        'human_lines': len(human_text.split('\n')),
-                        'excel_lines': len(excel_text.split('\n')),
-                        'validation_passed': True
-                    }
-                    return human_text, excel_text, stats
-                else:
-                    # バリデート失敗時は修正プロンプトで再試行
-                    if attempt < self.config.max_retries - 1:
-                        correction_prompt = self._build_correction_prompt(errors, generated_text)
-                        full_prompt = correction_prompt
+                    self._cache_store(cache_key, config, generated_text, backend)
+                    return human_text, excel_text, self._record_result(
+                        self._success_stats(attempt + 1, human_text, excel_text, backend))
+                
+                # バリデート失敗時は修正プロンプト（または部分修正プロンプト）で再試行
+                if attempt < config.max_retries - 1:
+                    full_prompt, repair_plan = self._retry_prompt(errors, generated_text, config)
                     
+            except StreamAborted as e:
+                # 途中で確定したエラーをもとに、生成完了を待たず再試行
+                generated_text, errors = e.partial_text, e.errors
+                if attempt < config.max_retries - 1:
+                    full_prompt = self._build_correction_prompt(errors, generated_text, config.human_only)
+                    repair_plan = None
             except Exception as e:
-                if attempt == self.config.max_retries - 1:
+                if attempt == config.max_retries - 1:
                     raise e
         
         # 最大試行回数に達した場合
-        stats = {
-            'attempt': self.config.max_retries,
-            'validation_passed': False,
-            'final_errors': errors if 'errors' in locals() else ['生成に失敗しました']
+        return generated_text, "", self._record_result(self._failure_stats(config, errors, backend))
+    
+    async def agenerate(self, user_input: str, reference_materials: str = "",
+                        config: Optional[GenerationConfig] = None) -> Tuple[str, str, Dict]:
+        """generate_slides の非同期版（1つのイベントループで多数の生成を並行実行できる）"""
+        config = config or self.config
+        units = parse_unit_count(user_input)
+        with stage(STAGE_GENERATE, units=units) as span:
+            if config.split_units and units > 1:
+                result = await self._agenerate_units(user_input, reference_materials, config, units)
+            else:
+                result = await self._agenerate_single(user_input, reference_materials, config)
+            span["passed"], span["backend"] = result[2].get('validation_passed'), result[2].get('backend')
+        return result
+    
+    async def _agenerate_units(self, user_input: str, reference_materials: str,
+                               config: GenerationConfig, units: int) -> Tuple[str, str, Dict]:
+        """_generate_units の非同期版"""
+        titles = await self._aplan_units(user_input, units, config)
+        semaphore = asyncio.Semaphore(max(1, config.unit_concurrency))
+        
+        async def generate_unit(number: int) -> Tuple[str, str, Dict]:
+            async with semaphore:
+                return await self._agenerate_single(
+                    build_unit_input(user_input, number, titles), reference_materials, config
+                )
+        
+        results = await asyncio.gather(*(generate_unit(number) for number in range(1, units + 1)))
+        return self._stitch_results(user_input, titles, list(results), config)
+    
+    async def _aplan_units(self, user_input: str, units: int, config: GenerationConfig) -> List[str]:
+        """_plan_units の非同期版"""
+        prompt = build_plan_prompt(user_input, units)
+        plan_config = replace(config, stream=False, max_tokens=UNIT_PLAN_MAX_TOKENS)
+        cache_key = self._cache_key(prompt, plan_config)
+        cached = self.cache.get(cache_key) if config.use_cache and not config.refresh_cache else None
+        titles = parse_unit_titles(cached, units) if cached else None
+        if titles is None:
+            try:
+                response, backend = await self._ainvoke_llm(prompt, plan_config)
+                titles = parse_unit_titles(response, units)
+                if titles:
+                    self._cache_store(cache_key, plan_config, response, backend)
+            except Exception as e:
+                logger.debug(f"ユニット構成の生成失敗: {e}")
+        return self._unit_titles(titles, user_input, units)
+    
+    async def _agenerate_single(self, user_input: str, reference_materials: str,
+                                config: GenerationConfig) -> Tuple[str, str, Dict]:
+        """_generate_single の非同期版"""
+        validator = SlideValidator()
+        
+        full_prompt = self._initial_prompt(user_input, reference_materials, config)
+        
+        cache_key = self._cache_key(full_prompt, config)
+        cached = self._cache_lookup(cache_key, config, validator)
+        if cached:
+            return cached
+        
+        generated_text, errors, repair_plan, backend = "", None, None, None
+        for attempt in range(config.max_retries):
+            try:
+                response, backend = await self._ainvoke_attempt(full_prompt, config, validator, repair_plan)
+                generated_text, human_text, excel_text, is_valid, errors = \
+                    self._check_attempt(validator, response, repair_plan, config)
+                
+                if is_valid:
+                    self._cache_store(cache_key, config, generated_text, backend)
+                    return human_text, excel_text, self._record_result(
+                        self._success_stats(attempt + 1, human_text, excel_text, backend))
+                
+                if attempt < config.max_retries - 1:
+                    full_prompt, repair_plan = self._retry_prompt(errors, generated_text, config)
+                    
+            except Exception as e:
+                if attempt == config.max_retries - 1:
+                    raise e
+        
+        return generated_text, "", self._record_result(self._failure_stats(config, errors, backend))
+    
+    @staticmethod
+    def _ollama_model(config: GenerationConfig) -> str:
+        """ollama用のモデル名に変換"""
+        return config.model_name.replace("gpt-", "qwen2.5:")
+    
+    @staticmethod
+    def _ollama_options(config: GenerationConfig) -> Dict:
+        """ollamaの生成オプション
+
+        num_ctx はジョブ間で一定にする（変わるとモデルが再ロードされKVキャッシュも失われる）。
+        既定のコンテキスト長ではプロンプトの先頭が切り詰められ、プレフィックスが再利用されない。
+        """
+        num_ctx = config.num_ctx or -(-(config.prompt_token_budget + config.max_tokens) // 1024) * 1024
+        options = {
+            "temperature": config.temperature,
+            "num_predict": config.max_tokens,
+            "num_ctx": num_ctx
         }
-        return generated_text if 'generated_text' in locals() else "", "", stats
+        if config.seed is not None:
+            options["seed"] = config.seed
+        return options
+    
+    def _backend_allowed(self, name: str) -> bool:
+        """回路が開いているバックエンドは呼び出さずにスキップ"""
+        if self.health.allow(name):
+            return True
+        logger.debug(f"{name} は停止中と判定済みのためスキップ")
+        return False
+    
+    def _invoke_attempt(self, prompt: str, config: GenerationConfig, validator: SlideValidator,
+                        repair_plan: Optional[RepairPlan]) -> Tuple[str, str]:
+        """1回の試行のLLM呼び出し（Best-of-N・ヘッジ有効時はバリデートを通った最初の出力を採用）"""
+        if config.candidates > 1:
+            return self._invoke_candidates(prompt, config, repair_plan)
+        if not config.hedge:
+            return self._invoke_llm(prompt, config)
+        accept = lambda text: self._check_attempt(validator, text, repair_plan, config)[3]
+        routes = self._hedge_routes(prompt, config)
+        if len(routes) < 2:
+            return self._invoke_llm(prompt, config)
+        text, route = run_hedged(routes, accept, self._hedge_policy(config), self.latency)
+        return self._hedge_result(text, route, config)
+    
+    async def _ainvoke_attempt(self, prompt: str, config: GenerationConfig, validator: SlideValidator,
+                               repair_plan: Optional[RepairPlan]) -> Tuple[str, str]:
+        """_invoke_attempt の非同期版"""
+        if config.candidates > 1:
+            return await self._ainvoke_candidates(prompt, config, repair_plan)
+        if not config.hedge:
+            return await self._ainvoke_llm(prompt, config)
+        accept = lambda text: self._check_attempt(validator, text, repair_plan, config)[3]
+        routes = self._hedge_routes(prompt, config)
+        if len(routes) < 2:
+            return await self._ainvoke_llm(prompt, config)
+        text, route = await arun_hedged(routes, accept, self._hedge_policy(config), self.latency)
+        return self._hedge_result(text, route, config)
+    
+    def _candidate_routes(self, prompt: str, config: GenerationConfig) -> List[HedgeRoute]:
+        """候補ごとの経路（主経路を温度・シードを変えて使う）"""
+        routes = []
+        for temperature, seed in candidate_settings(config.temperature, config.candidates,
+                                                    config.candidate_temperatures):
+            candidate_routes = self._hedge_routes(prompt, replace(config, temperature=temperature, seed=seed))
+            if candidate_routes:
+                routes.append(candidate_routes[0])
+        return routes
+    
+    def _candidate_scorer(self, config: GenerationConfig, repair_plan: Optional[RepairPlan], scores: Dict):
+        """候補を評価して scores に記録し、完全に合格したかを返す関数"""
+        def accept(index: int, text: str) -> bool:
+            _, human_text, excel_text, _, _ = self._check_attempt(SlideValidator(), text, repair_plan, config)
+            scores[index] = score_candidate(human_text, excel_text)
+            return scores[index].is_valid
+        return accept
+    
+    def _best_candidate(self, routes: List[HedgeRoute], texts: Dict[int, str], scores: Dict,
+                        config: GenerationConfig) -> Tuple[str, str]:
+        if not texts:
+            return self._demo_fallback(config)
+        best = max(scores, key=lambda index: scores[index].rank_key)
+        logger.debug(f"Best-of-N: 候補{best + 1}を採用（完了{len(texts)}/{len(routes)}件、"
+              f"エラー{len(scores[best].errors)}件、スコア{scores[best].score:.2f}）")
+        return texts[best], routes[best].kind
+    
+    def _invoke_candidates(self, prompt: str, config: GenerationConfig,
+                           repair_plan: Optional[RepairPlan]) -> Tuple[str, str]:
+        """候補をN件並列に生成し、最良のものを返す（合格した候補が出たら残りを取り消す）"""
+        routes = self._candidate_routes(prompt, config)
+        if not routes:
+            return self._invoke_llm(prompt, config)
+        scores = {}
+        texts = run_candidates(routes, self._candidate_scorer(config, repair_plan, scores))
+        return self._best_candidate(routes, texts, scores, config)
+    
+    async def _ainvoke_candidates(self, prompt: str, config: GenerationConfig,
+                                  repair_plan: Optional[RepairPlan]) -> Tuple[str, str]:
+        """_invoke_candidates の非同期版"""
+        routes = self._candidate_routes(prompt, config)
+        if not routes:
+            return await self._ainvoke_llm(prompt, config)
+        scores = {}
+        texts = await arun_candidates(routes, self._candidate_scorer(config, repair_plan, scores))
+        return self._best_candidate(routes, texts, scores, config)
+    
+    @staticmethod
+    def _hedge_policy(config: GenerationConfig) -> HedgePolicy:
+        return HedgePolicy(config.hedge_percentile, config.hedge_default_delay_sec)
+    
+    def _hedge_result(self, text: Optional[str], route: Optional[HedgeRoute],
+                      config: GenerationConfig) -> Tuple[str, str]:
+        if route is None:
+            return self._demo_fallback(config)
+        logger.debug(f"ヘッジ: {route.name} の出力を採用")
+        return text, route.kind
+    
+    def _hedge_routes(self, prompt: str, config: GenerationConfig) -> List[HedgeRoute]:
+        """ヘッジの経路（通常の順序 OpenAI → ollama の後に hedge_backends、停止中のものは除く）"""
+        openai_key = os.getenv("OPENAI_API_KEY")
+        targets = []
+        if openai_key and config.model_name.startswith("gpt"):
+            targets.append(("openai", config.model_name, None))
+        targets.append(("ollama", self._ollama_model(config), None))
+        for spec in config.hedge_backends:
+            model, _, host = spec.partition("@")
+            if model.startswith("gpt") and not host:
+                if openai_key:
+                    targets.append(("openai", model, None))
+            else:
+                targets.append(("ollama", model, resolve_ollama_url(host) if host else None))
+        
+        routes, seen = [], set()
+        for kind, model, host in targets:
+            backend = "openai" if kind == "openai" else self._hedge_transport(host)[0]
+            if (backend, model) in seen or not self._backend_allowed(backend):
+                continue
+            seen.add((backend, model))
+            if kind == "openai":
+                routes.append(self._openai_route(prompt, config, model, openai_key))
+            else:
+                routes.append(self._ollama_route(prompt, config, model, host))
+        return routes
+    
+    def _hedge_transport(self, host: Optional[str]) -> Tuple[str, OllamaTransport, AsyncOllamaTransport]:
+        """ヘッジ先ホストの (ヘルス名, 同期, 非同期) トランスポート（既定ホストは共有のもの）"""
+        if host is None or host == self.ollama_transport.base_url:
+            return self.ollama_backend, self.ollama_transport, self.async_ollama_transport
+        if host not in self._hedge_transports:
+            transport = OllamaTransport(host)
+            self.health.register_probe(f"ollama:{host}", transport.is_alive)
+            self._hedge_transports[host] = (transport, AsyncOllamaTransport(host))
+        return (f"ollama:{host}",) + self._hedge_transports[host]
+    
+    def _ollama_route(self, prompt: str, config: GenerationConfig, model: str,
+                      host: Optional[str]) -> HedgeRoute:
+        """ollamaの経路（同期版はストリーミングで受信し、取り消されたら接続を切って生成を止める）"""
+        backend, transport, async_transport = self._hedge_transport(host)
+        options = self._ollama_options(config)
+        
+        def call(cancel, on_first_token, usage) -> str:
+            pieces = []
+            stream = transport.stream_generate(model, prompt, options, timeout=120,
+                                               system=self.prompt_prefix, keep_alive=config.keep_alive,
+                                               usage=usage)
+            try:
+                for token in stream:
+                    on_first_token()
+                    pieces.append(token)
+                    if cancel.is_set():
+                        raise HedgeCancelled()
+            finally:
+                stream.close()
+            return "".join(pieces)
+        
+        async def acall(on_first_token, usage) -> str:
+            return await async_transport.generate(model, prompt, options, timeout=120,
+                                                  system=self.prompt_prefix, keep_alive=config.keep_alive,
+                                                  usage=usage)
+        
+        return self._tracked_route(prompt, model, "ollama", backend, call, acall)
     
-    def _call_llm(self, prompt: str) -> str:
+    def _openai_route(self, prompt: str, config: GenerationConfig, model: str, openai_key: str) -> HedgeRoute:
+        """OpenAIの経路（同期版は呼び出し中に取り消せないため、結果を捨てるだけ）"""
+        def call(cancel, on_first_token, usage) -> str:
+            return self.openai_transport.chat(openai_key, model, self.prompt_prefix, prompt,
+                                              config.temperature, config.max_tokens, usage=usage)
+        
+        async def acall(on_first_token, usage) -> str:
+            return await self.openai_transport.achat(openai_key, model, self.prompt_prefix, prompt,
+                                                     config.temperature, config.max_tokens, usage=usage)
+        
+        return self._tracked_route(prompt, model, "openai", "openai", call, acall)
+    
+    def _tracked_route(self, prompt: str, model: str, kind: str, backend: str, call, acall) -> HedgeRoute:
+        """経路の成否をバックエンドのヘルスと計測に記録する（取り消しは失敗に数えない）
+
+        経路は別スレッドで実行されるため、トレースは経路を作った時点のものを使う。
+        """
+        trace = current_trace()
+        
+        def record(start: float, first_token: List[float], outcome: str, text: str = "",
+                   usage: Optional[Dict] = None) -> None:
+            record_llm_call(backend, model, time.monotonic() - start, outcome,
+                            first_token_sec=first_token[0] - start if first_token else None,
+                            prompt=prompt, text=text, usage=usage, trace=trace)
+        
+        def timed(on_first_token, first_token: List[float]):
+            def mark() -> None:
+                if not first_token:
+                    first_token.append(time.monotonic())
+                on_first_token()
+            return mark
+        
+        def tracked_call(cancel, on_first_token) -> str:
+            start, first_token, usage = time.monotonic(), [], {}
+            try:
+                text = call(cancel, timed(on_first_token, first_token), usage)
+            except HedgeCancelled:
+                record(start, first_token, "cancelled")
+                raise
+            except Exception as e:
+                record(start, first_token, "error")
+                self._record_failure(backend, e)
+                raise
+            record(start, first_token, "ok", text, usage)
+            self.health.record_success(backend)
+            return text
+        
+        async def tracked_acall(on_first_token) -> str:
+            start, first_token, usage = time.monotonic(), [], {}
+            try:
+                text = await acall(timed(on_first_token, first_token), usage)
+            except asyncio.CancelledError:
+                record(start, first_token, "cancelled")
+                raise
+            except Exception as e:
+                record(start, first_token, "error")
+                self._record_failure(backend, e)
+                raise
+            record(start, first_token, "ok", text, usage)
+            self.health.record_success(backend)
+            return text
+        
+        return HedgeRoute(f"{backend}/{model}", kind, tracked_call, tracked_acall)
+    
+    def _call_llm(self, prompt: str, config: Optional[GenerationConfig] = None) -> str:
         """LLMを呼び出し（実際のLLM API使用）"""
-        print(f"[DEBUG] LLMを呼び出し中... (モデル: {self.config.model_name})")
-        print(f"[DEBUG] プロンプト長: {len(prompt)} 文字")
+        return self._invoke_llm(prompt, config)[0]
+    
+    def _invoke_llm(self, prompt: str, config: Optional[GenerationConfig] = None) -> Tuple[str, str]:
+        """LLMを呼び出し、(生成テキスト, 使用したバックエンド名) を返す"""
+        config = config or self.config
+        logger.debug(f"LLMを呼び出し中... (モデル: {config.model_name})")
+        logger.debug(f"プロンプト長: {len(prompt)} 文字")
         
         # 1. まずOpenAI APIを試行
         openai_key = os.getenv("OPENAI_API_KEY")
-        if openai_key and self.config.model_name.startswith("gpt"):
+        if openai_key and config.model_name.startswith("gpt") and self._backend_allowed("openai"):
+            start, usage = time.monotonic(), {}
             try:
-                import openai
-                client = openai.OpenAI(api_key=openai_key)
-                response = client.chat.completions.create(
-                    model=self.config.model_name,
-                    messages=[
-                        {"role": "system", "content": self.system_prompt},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=self.config.temperature,
-                    max_tokens=self.config.max_tokens
+                text = self.openai_transport.chat(
+                    openai_key, config.model_name, self.prompt_prefix, prompt,
+                    config.temperature, config.max_tokens, usage=usage
                 )
-                print("[DEBUG] OpenAI API使用成功")
-                return response.choices[0].message.content
+                self.latency.record(f"openai/{config.model_name}", time.monotonic() - start)
+                record_llm_call("openai", config.model_name, time.monotonic() - start,
+                                prompt=prompt, text=text, usage=usage)
+                self.health.record_success("openai")
+                logger.debug("OpenAI API使用成功")
+                return text, "openai"
             except Exception as e:
-                print(f"[DEBUG] OpenAI API失敗: {e}")
+                record_llm_call("openai", config.model_name, time.monotonic() - start, "error")
+                self._record_failure("openai", e)
+                logger.debug(f"OpenAI API失敗: {e}")
         
         # 2. ollama APIを試行
-        try:
-            response = requests.post("http://localhost:11434/api/generate", json={
-                "model": self.config.model_name.replace("gpt-", "qwen2.5:"),
-                "prompt": f"{self.system_prompt}\n\n{prompt}",
-                "temperature": self.config.temperature,
-                "stream": False
-            }, timeout=120)
-            
-            if response.status_code == 200:
-                print("[DEBUG] ollama使用成功")
-                return response.json()["response"]
-            else:
-                print(f"[DEBUG] ollama失敗: {response.status_code}")
-        except Exception as e:
-            print(f"[DEBUG] ollama接続失敗: {e}")
+        if self._backend_allowed(self.ollama_backend):
+            model = self._ollama_model(config)
+            start, usage = time.monotonic(), {}
+            try:
+                if config.stream:
+                    text = self._stream_ollama(prompt, config, usage)
+                else:
+                    text = self.ollama_transport.generate(
+                        model,
+                        prompt,
+                        self._ollama_options(config),
+                        timeout=120,
+                        system=self.prompt_prefix,
+                        keep_alive=config.keep_alive,
+                        usage=usage
+                    )
+                self.latency.record(f"{self.ollama_backend}/{model}", time.monotonic() - start)
+                record_llm_call(self.ollama_backend, model, time.monotonic() - start,
+                                first_token_sec=usage.pop("first_token_sec", None),
+                                prompt=prompt, text=text, usage=usage)
+                self.health.record_success(self.ollama_backend)
+                logger.debug("ollama使用成功")
+                return text, "ollama"
+            except StreamAborted:
+                # 出力内容の問題であり、バックエンド自体は正常
+                record_llm_call(self.ollama_backend, model, time.monotonic() - start, "aborted",
+                                first_token_sec=usage.pop("first_token_sec", None))
+                self.health.record_success(self.ollama_backend)
+                raise
+            except TransportError as e:
+                record_llm_call(self.ollama_backend, model, time.monotonic() - start, "error")
+                self._record_failure(self.ollama_backend, e)
+                logger.debug(f"{e}")
+            except Exception as e:
+                record_llm_call(self.ollama_backend, model, time.monotonic() - start, "error")
+                self._record_failure(self.ollama_backend, e)
+                logger.debug(f"ollama接続失敗: {e}")
         
         # 3. フォールバック：デモ用レスポンス
-        print("[DEBUG] 実LLMが利用できません。デモ用レスポンスを使用")
-        return self._demo_response()
+        return self._demo_fallback(config)
+    
+    def _stream_ollama(self, prompt: str, config: GenerationConfig, usage: Optional[Dict] = None) -> str:
+        """ollamaのストリーミング出力を行単位でバリデートしながら受信
+
+        確定したエラーで中断する。auto_fix=True ではページ番号・Excel行のエラー（is_mechanical_error）では
+        中断せず、生成完了後の自動修正に任せる（中断するのは自動修正できないエラーのみ。"2.5トン" のような
+        見出しではない行によるページ番号飛びは振り直しで直らないので中断する）。
+        usage にはトークン数と最初のトークンまでの時間（first_token_sec）を書き込む。
+        """
+        usage = {} if usage is None else usage
+        checker = IncrementalSlideValidator()
+        pieces, buffer = [], ""
+        start = time.monotonic()
+        stream = self.ollama_transport.stream_generate(
+            self._ollama_model(config), prompt, self._ollama_options(config), timeout=120,
+            system=self.prompt_prefix, keep_alive=config.keep_alive, usage=usage
+        )
+        try:
+            for token in stream:
+                if not pieces:
+                    usage["first_token_sec"] = time.monotonic() - start
+                    self.latency.record(f"{self.ollama_backend}/{self._ollama_model(config)}",
+                                        usage["first_token_sec"], FIRST_TOKEN)
+                pieces.append(token)
+                buffer += token
+                while "\n" in buffer:
+                    line, buffer = buffer.split("\n", 1)
+                    errors = checker.feed(line)
+                    if config.auto_fix:
+                        # 機械的に直せるエラーでは中断せず、生成完了後に自動修正する
+                        errors = [error for error in errors if not is_mechanical_error(error, line)]
+                    if errors:
+                        logger.debug(f"ストリーミング中断: {errors[0]}")
+                        raise StreamAborted(errors, "".join(pieces))
+        finally:
+            # 中断時は接続を閉じてサーバ側の生成もキャンセルする
+            stream.close()
+        return "".join(pieces)
+    
+    async def _acall_llm(self, prompt: str, config: Optional[GenerationConfig] = None) -> str:
+        """LLMを呼び出し（非同期版。フォールバック順序は _call_llm と同じ）"""
+        return (await self._ainvoke_llm(prompt, config))[0]
+    
+    async def _ainvoke_llm(self, prompt: str, config: Optional[GenerationConfig] = None) -> Tuple[str, str]:
+        """LLMを呼び出し、(生成テキスト, 使用したバックエンド名) を返す（非同期版）"""
+        config = config or self.config
+        logger.debug(f"LLMを呼び出し中... (モデル: {config.model_name})")
+        logger.debug(f"プロンプト長: {len(prompt)} 文字")
+        
+        openai_key = os.getenv("OPENAI_API_KEY")
+        if openai_key and config.model_name.startswith("gpt") and self._backend_allowed("openai"):
+            start, usage = time.monotonic(), {}
+            try:
+                text = await self.openai_transport.achat(
+                    openai_key, config.model_name, self.prompt_prefix, prompt,
+                    config.temperature, config.max_tokens, usage=usage
+                )
+                self.latency.record(f"openai/{config.model_name}", time.monotonic() - start)
+                record_llm_call("openai", config.model_name, time.monotonic() - start,
+                                prompt=prompt, text=text, usage=usage)
+                self.health.record_success("openai")
+                logger.debug("OpenAI API使用成功")
+                return text, "openai"
+            except Exception as e:
+                record_llm_call("openai", config.model_name, time.monotonic() - start, "error")
+                self._record_failure("openai", e)
+                logger.debug(f"OpenAI API失敗: {e}")
+        
+        if self._backend_allowed(self.ollama_backend):
+            model = self._ollama_model(config)
+            start, usage = time.monotonic(), {}
+            try:
+                text = await self.async_ollama_transport.generate(
+                    model,
+                    prompt,
+                    self._ollama_options(config),
+                    timeout=120,
+                    system=self.prompt_prefix,
+                    keep_alive=config.keep_alive,
+                    usage=usage
+                )
+                self.latency.record(f"{self.ollama_backend}/{model}", time.monotonic() - start)
+                record_llm_call(self.ollama_backend, model, time.monotonic() - start,
+                                prompt=prompt, text=text, usage=usage)
+                self.health.record_success(self.ollama_backend)
+                logger.debug("ollama使用成功")
+                return text, "ollama"
+            except TransportError as e:
+                record_llm_call(self.ollama_backend, model, time.monotonic() - start, "error")
+                self._record_failure(self.ollama_backend, e)
+                logger.debug(f"{e}")
+            except Exception as e:
+                record_llm_call(self.ollama_backend, model, time.monotonic() - start, "error")
+                self._record_failure(self.ollama_backend, e)
+                logger.debug(f"ollama接続失敗: {e!r}")
+        
+        return self._demo_fallback(config)
+    
+    def close(self) -> None:
+        """トランスポートの接続プールを解放"""
+        self.ollama_transport.close()
+        for transport, _ in self._hedge_transports.values():
+            transport.close()
+    
+    async def aclose(self) -> None:
+        """非同期トランスポートの接続プールを解放"""
+        await self.async_ollama_transport.aclose()
+        for _, async_transport in self._hedge_transports.values():
+            await async_transport.aclose()
+    
+    def _record_failure(self, backend: str, error: Exception) -> None:
+        """呼び出しの失敗をヘルスに記録（接続失敗・5xxなどの障害のみ。4xxは回路を開かない）"""
+        if is_outage(error):
+            self.health.record_failure(backend, repr(error))
+        else:
+            logger.debug(f"{backend}: 障害には数えないエラー: {error}")
+    
+    def _demo_fallback(self, config: GenerationConfig) -> Tuple[str, str]:
+        """どのバックエンドも使えなかったときの応答（バッチ・サーバーでは例外にしてジョブを失敗させる）"""
+        if not config.demo_fallback:
+            raise BackendUnavailable(f"利用できるLLMバックエンドがありません: {self.health.snapshot()}")
+        logger.debug("実LLMが利用できません。デモ用レスポンスを使用")
+        return self._demo_response(), "demo"
     
     def _demo_response(self) -> str:
         """デモ用の固定レスポンス"""
@@ -257,13 +1109,17 @@ Excel:
         
         return human_part, excel_part
     
-    def _build_correction_prompt(self, errors: List[str], previous_output: str) -> str:
+    def _build_correction_prompt(self, errors: List[str], previous_output: str, human_only: bool = False) -> str:
         """修正用プロンプトを構築"""
         error_summary = "\n".join(f"- {error}" for error in errors)
+        output_request = ("修正された人間用スライドのみ（Excel用は出力しない）" if human_only
+                          else "修正された 1) 人間用スライド → 2) Excel用")
+        if human_only:
+            # Excel用は導出したものなので送らない
+            previous_output = self._split_output(previous_output)[0]
         
-        correction_prompt = f"""{self.system_prompt}
-
-[前回の出力に以下の問題がありました]
+        # システムプロンプトは固定プレフィックスとして別に送られる
+        correction_prompt = f"""[前回の出力に以下の問題がありました]
 {error_summary}
 
 [修正指示]
@@ -273,7 +1129,7 @@ Excel:
 {previous_output}
 
 [出力要求]
-修正された 1) 人間用スライド → 2) Excel用"""
+{output_request}"""
         
         return correction_prompt
     
@@ -286,11 +1142,12 @@ Excel:
         excel_file = os.path.join(output_dir, "slide_excel.txt")
         
         # 保存
-        with open(human_file, "w", encoding="utf-8") as f:
-            f.write(human_text)
-        
-        with open(excel_file, "w", encoding="utf-8") as f:
-            f.write(excel_text)
+        with stage(STAGE_SAVE):
+            with open(human_file, "w", encoding="utf-8") as f:
+                f.write(human_text)
+            
+            with open(excel_file, "w", encoding="utf-8") as f:
+                f.write(excel_text)
         
         return {
             "human_file": human_file,
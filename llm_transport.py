@@ -0,0 +1,376 @@
+"""
+LLMバックエンド通信層
+接続を使い回すプール付きトランスポート（同期 / asyncio）
+requests・openai は最初の通信時に読み込む（バリデートのみの起動を速くするため）
+"""
+
+import asyncio
+import json
+import os
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+DEFAULT_OLLAMA_URL = "http://localhost:11434"
+DEFAULT_OLLAMA_PORT = 11434
+# サーバーの待ち受け用のアドレス（クライアントの接続先としては127.0.0.1に読み替える）
+UNSPECIFIED_HOSTS = ("0.0.0.0", "::")
+DEFAULT_POOL_SIZE = 16
+
+
+class TransportError(Exception):
+    """バックエンドが異常なステータスを返した場合の例外（status はHTTPステータス）"""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+def resolve_ollama_url(base_url: Optional[str] = None) -> str:
+    """ollamaのベースURLを解決（引数 → 環境変数OLLAMA_HOST → 既定値）
+
+    OLLAMA_HOST はサーバー側の書き方（"0.0.0.0"・"gpu-box"・":11434" など）でもよい。ollama と同じく、
+    スキームのない指定でポートがなければ11434を補い、待ち受け用のアドレスは接続先の127.0.0.1に読み替える。
+    """
+    url = (base_url or os.getenv("OLLAMA_HOST") or DEFAULT_OLLAMA_URL).strip().rstrip("/")
+    if "://" not in url:
+        url = f"http://{url}"
+        if urlsplit(url).port is None:
+            url = f"{url}:{DEFAULT_OLLAMA_PORT}"
+    parts = urlsplit(url)
+    if parts.hostname in UNSPECIFIED_HOSTS or not parts.hostname:
+        port = f":{parts.port}" if parts.port else ""
+        url = parts._replace(netloc=f"127.0.0.1{port}").geturl()
+    return url.rstrip("/")
+
+
+def build_generate_payload(model: str, prompt: str, options: Dict, stream: bool = False,
+                           system: Optional[str] = None, keep_alive: Optional[str] = None) -> Dict:
+    """/api/generate 用のリクエストボディを構築
+
+    system はモデルのテンプレートの先頭に入るため、ジョブ間で同じ文字列を渡せば
+    ollama側で前回のKVキャッシュ（プレフィックス）が再利用される。
+    keep_alive はモデルをメモリに残す時間（例: "30m"）。
+    """
+    payload = {
+        "model": model,
+        "prompt": prompt,
+        "options": options,
+        "stream": stream,
+    }
+    if system is not None:
+        payload["system"] = system
+    if keep_alive is not None:
+        payload["keep_alive"] = keep_alive
+    return payload
+
+
+def _ollama_usage(event: Dict, usage: Optional[Dict]) -> None:
+    """ollamaの最終応答のトークン数・生成時間を usage に書き込む（prompt_eval_count はKVキャッシュ分を含まない）"""
+    if usage is None:
+        return
+    if "prompt_eval_count" in event:
+        usage["prompt_tokens"] = event["prompt_eval_count"]
+    if "eval_count" in event:
+        usage["completion_tokens"] = event["eval_count"]
+    if event.get("eval_duration"):
+        usage["generation_sec"] = event["eval_duration"] / 1e9
+
+
+def _openai_usage(response, usage: Optional[Dict]) -> None:
+    """OpenAIの応答のトークン数を usage に書き込む"""
+    if usage is None or getattr(response, "usage", None) is None:
+        return
+    usage["prompt_tokens"] = response.usage.prompt_tokens
+    usage["completion_tokens"] = response.usage.completion_tokens
+
+
+class OllamaTransport:
+    """keep-alive接続プールを持つ同期ollamaクライアント（スレッド間で共有可）"""
+
+    def __init__(self, base_url: Optional[str] = None, pool_size: int = DEFAULT_POOL_SIZE):
+        self.base_url = resolve_ollama_url(base_url)
+        self.pool_size = pool_size
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        """接続プール付きセッション（初回アクセス時に requests を読み込んで作成）"""
+        with self._lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+            return self._session
+
+    def generate(self, model: str, prompt: str, options: Dict, timeout: float = 120.0,
+                 system: Optional[str] = None, keep_alive: Optional[str] = None,
+                 usage: Optional[Dict] = None) -> str:
+        """テキスト生成（非ストリーミング）。usage を渡すとトークン数を書き込む"""
+        response = self.session.post(
+            f"{self.base_url}/api/generate",
+            json=build_generate_payload(model, prompt, options, system=system, keep_alive=keep_alive),
+            timeout=timeout,
+        )
+        if response.status_code != 200:
+            raise TransportError(f"ollama失敗: {response.status_code}", response.status_code)
+        result = response.json()
+        _ollama_usage(result, usage)
+        return result["response"]
+
+    def is_alive(self, timeout: float = 5.0) -> bool:
+        """/api/tags で死活確認（connect_ollama.test_ollama_connection と同じ判定）"""
+        from requests.exceptions import RequestException
+        try:
+            return self.session.get(f"{self.base_url}/api/tags", timeout=timeout).status_code == 200
+        except RequestException:
+            return False
+
+    def stream_generate(self, model: str, prompt: str, options: Dict, timeout: float = 120.0,
+                        system: Optional[str] = None, keep_alive: Optional[str] = None,
+                        usage: Optional[Dict] = None) -> Iterator[str]:
+        """テキスト生成（ストリーミング）。NDJSONの各トークン断片を順に返す
+
+        ジェネレータを途中で close() するとHTTP接続を切断し、ollama側の生成も中止される。
+        """
+        with self.session.post(
+            f"{self.base_url}/api/generate",
+            json=build_generate_payload(model, prompt, options, stream=True,
+                                        system=system, keep_alive=keep_alive),
+            timeout=timeout,
+            stream=True,
+        ) as response:
+            if response.status_code != 200:
+                raise TransportError(f"ollama失敗: {response.status_code}", response.status_code)
+            for raw in response.iter_lines():
+                if not raw:
+                    continue
+                event = json.loads(raw)
+                if event.get("error"):
+                    # 生成中のエラー（応答自体は200）はバックエンドの障害ではない
+                    raise TransportError(f"ollama失敗: {event['error']}", response.status_code)
+                if event.get("response"):
+                    yield event["response"]
+                if event.get("done"):
+                    _ollama_usage(event, usage)
+                    return
+
+    def close(self) -> None:
+        """プール中の接続を閉じる（未接続なら何もしない）"""
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+class OpenAITransport:
+    """APIキーごとにクライアントを1度だけ生成して使い回すOpenAIクライアント"""
+
+    def __init__(self):
+        self._clients: Dict[str, object] = {}
+        self._async_clients: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _client(self, api_key: str):
+        with self._lock:
+            if api_key not in self._clients:
+                import openai
+                self._clients[api_key] = openai.OpenAI(api_key=api_key)
+            return self._clients[api_key]
+
+    def _async_client(self, api_key: str):
+        with self._lock:
+            if api_key not in self._async_clients:
+                import openai
+                self._async_clients[api_key] = openai.AsyncOpenAI(api_key=api_key)
+            return self._async_clients[api_key]
+
+    @staticmethod
+    def _messages(system_prompt: str, prompt: str) -> List[Dict]:
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ]
+
+    def chat(self, api_key: str, model: str, system_prompt: str, prompt: str,
+             temperature: float, max_tokens: int, usage: Optional[Dict] = None) -> str:
+        """チャット補完（同期）"""
+        response = self._client(api_key).chat.completions.create(
+            model=model,
+            messages=self._messages(system_prompt, prompt),
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        _openai_usage(response, usage)
+        return response.choices[0].message.content
+
+    async def achat(self, api_key: str, model: str, system_prompt: str, prompt: str,
+                    temperature: float, max_tokens: int, usage: Optional[Dict] = None) -> str:
+        """チャット補完（非同期）"""
+        response = await self._async_client(api_key).chat.completions.create(
+            model=model,
+            messages=self._messages(system_prompt, prompt),
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        _openai_usage(response, usage)
+        return response.choices[0].message.content
+
+
+class _Connection:
+    """プールされるHTTP/1.1接続"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.reused = False
+
+    def usable(self) -> bool:
+        return not self.reader.at_eof() and not self.writer.is_closing()
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class AsyncOllamaTransport:
+    """asyncioストリーム上の最小HTTP/1.1クライアント（keep-alive接続プール付き）
+
+    追加依存なしで1つのイベントループから多数の生成を同時に発行できる。
+    接続プールはイベントループに紐付くため、ループが変わると作り直す。
+    """
+
+    def __init__(self, base_url: Optional[str] = None, pool_size: int = DEFAULT_POOL_SIZE):
+        self.base_url = resolve_ollama_url(base_url)
+        parts = urlsplit(self.base_url)
+        if parts.scheme != "http":
+            raise ValueError(f"非同期トランスポートはhttpのみ対応です: {self.base_url}")
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or 80
+        self.path_prefix = parts.path.rstrip("/")
+        self.pool_size = pool_size
+        self._loop = None
+        self._idle: List[_Connection] = []
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def _bind_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._idle = []
+            self._slots = asyncio.Semaphore(self.pool_size)
+
+    async def _acquire(self) -> _Connection:
+        self._bind_loop()
+        await self._slots.acquire()
+        while self._idle:
+            conn = self._idle.pop()
+            if conn.usable():
+                conn.reused = True
+                return conn
+            conn.close()
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        except BaseException:
+            self._slots.release()
+            raise
+        return _Connection(reader, writer)
+
+    def _release(self, conn: _Connection, reusable: bool) -> None:
+        if reusable and conn.usable():
+            self._idle.append(conn)
+        else:
+            conn.close()
+        self._slots.release()
+
+    def _encode_request(self, method: str, path: str, body: Optional[bytes]) -> bytes:
+        lines = [
+            f"{method} {self.path_prefix}{path} HTTP/1.1",
+            f"Host: {self.host}:{self.port}",
+            "Connection: keep-alive",
+            "Accept: application/json",
+        ]
+        if body is not None:
+            lines.append("Content-Type: application/json")
+            lines.append(f"Content-Length: {len(body)}")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("ascii") + (body or b"")
+
+    @staticmethod
+    async def _read_head(reader: asyncio.StreamReader) -> Tuple[int, Dict[str, str]]:
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("接続が閉じられました")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return status, headers
+
+    @staticmethod
+    async def _read_body(reader: asyncio.StreamReader, headers: Dict[str, str]) -> Tuple[bytes, bool]:
+        """レスポンスボディを読み込み、(body, 接続再利用可否) を返す"""
+        keep_alive = headers.get("connection", "").lower() != "close"
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            return b"".join(chunks), keep_alive
+        if "content-length" in headers:
+            return await reader.readexactly(int(headers["content-length"])), keep_alive
+        return await reader.read(), False
+
+    async def _request(self, method: str, path: str, body: Optional[bytes]) -> Tuple[int, bytes]:
+        request = self._encode_request(method, path, body)
+        for _ in range(2):
+            conn = await self._acquire()
+            reusable = False
+            try:
+                conn.writer.write(request)
+                await conn.writer.drain()
+                status, headers = await self._read_head(conn.reader)
+                data, reusable = await self._read_body(conn.reader, headers)
+                return status, data
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # サーバ側で閉じられたkeep-alive接続は新しい接続で1度だけ再送
+                if not conn.reused:
+                    raise
+            finally:
+                self._release(conn, reusable)
+        raise ConnectionResetError("接続が閉じられました")
+
+    async def request_json(self, method: str, path: str, payload: Optional[Dict] = None,
+                           timeout: float = 120.0) -> Dict:
+        """JSONリクエストを送信してJSONレスポンスを返す"""
+        body = json.dumps(payload).encode("utf-8") if payload is not None else None
+        status, data = await asyncio.wait_for(self._request(method, path, body), timeout)
+        if status != 200:
+            raise TransportError(f"ollama失敗: {status}", status)
+        return json.loads(data.decode("utf-8"))
+
+    async def generate(self, model: str, prompt: str, options: Dict, timeout: float = 120.0,
+                       system: Optional[str] = None, keep_alive: Optional[str] = None,
+                       usage: Optional[Dict] = None) -> str:
+        """テキスト生成（非ストリーミング）。usage を渡すとトークン数を書き込む"""
+        payload = build_generate_payload(model, prompt, options, system=system, keep_alive=keep_alive)
+        result = await self.request_json("POST", "/api/generate", payload, timeout)
+        _ollama_usage(result, usage)
+        return result["response"]
+
+    async def aclose(self) -> None:
+        """プール中の接続を閉じる"""
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+生成の負荷試験
+LLMSlideGenerator で N 件の生成を指定した同時実行数で行い、スループット・レイテンシのパーセンタイル・
+再試行率・LLM呼び出しの結果を集計する。--fake で疑似ollamaサーバー（fake_ollama.py）をプロセス内に
+起動すれば、GPUマシンなしで同時実行数やキャッシュの変更の効果を測れる
+
+  python load_test.py --fake --requests 40 --concurrency 8 --latency lognormal:0,0.5 --error-rate 0.05
+  python load_test.py --fake --requests 40 --invalid-rate 0.3 --no-auto-fix   # 再試行の挙動を測る
+  python load_test.py --url http://gpu-box:11434 --requests 20 --concurrency 4 --stream
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from fake_ollama import add_fake_arguments, fake_config_from_args, start_fake_server
+from job_store import used_demo
+from main import build_user_input
+from metrics import Trace, setup_logging
+
+# 生成するテーマ（--themes で使う種類の数を決める。同じテーマはキャッシュが効く）
+LOAD_THEMES = (
+    "フォークリフト安全", "5S基本", "KYT（危険予知訓練）", "指差呼称", "PPEの着用",
+    "LOTO（ロックアウト・タグアウト）", "SDSの読み方", "熱中症予防", "玉掛け作業", "脚立の安全な使い方",
+)
+LATENCY_PERCENTILES = (50, 90, 95, 99)
+DEFAULT_RESULT_FILE = os.path.join("output", "load_test.json")
+
+
+def percentile(samples: List[float], q: float) -> Optional[float]:
+    """q パーセンタイル（線形補間、サンプルがなければNone）"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return round(ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower), 4)
+
+
+def _latency_summary(samples: List[float]) -> Dict:
+    summary = {f"p{q}": percentile(samples, q) for q in LATENCY_PERCENTILES}
+    summary["mean"] = round(statistics.mean(samples), 4) if samples else None
+    summary["max"] = round(max(samples), 4) if samples else None
+    return summary
+
+
+def run_one(generator, index: int, themes: int, units: int, config) -> Dict:
+    """1件生成して結果（所要時間・統計・LLM呼び出し）を返す"""
+    theme = LOAD_THEMES[index % max(1, min(themes, len(LOAD_THEMES)))]
+    trace = Trace(f"load-{index}")
+    started = time.monotonic()
+    result = {"index": index, "theme": theme}
+    try:
+        with trace.activate():
+            _, _, stats = generator.generate_slides(build_user_input(theme, units), "", config=config)
+        result.update(passed=bool(stats.get("validation_passed")), attempts=stats.get("attempt", 0),
+                      retries=stats.get("retries", 0), cache_hit=bool(stats.get("cache_hit")),
+                      backend=stats.get("backend"), demo=used_demo(stats))
+    except Exception as e:
+        result.update(passed=False, attempts=0, retries=0, cache_hit=False, backend=None, demo=False,
+                      error=str(e))
+    result["seconds"] = round(time.monotonic() - started, 4)
+    trace_data = trace.to_dict()
+    result["llm_calls"] = trace_data["llm_calls"]
+    # LLMを呼ばずに自動修正で合格させた試行（--no-auto-fix では起きない）
+    result["auto_fixed"] = sum(1 for span in trace_data["spans"] if span.get("auto_fixed"))
+    return result
+
+
+def summarize(results: List[Dict], wall_sec: float, concurrency: int) -> Dict:
+    """負荷試験の結果を集計"""
+    calls = [call for result in results for call in result["llm_calls"]]
+    ok_calls = [call for call in calls if call["outcome"] == "ok"]
+    # 再試行率はLLMの応答をバリデートした生成（キャッシュヒット・例外・デモ応答以外）で数える
+    generated = [result for result in results
+                 if not result["cache_hit"] and not result.get("error") and not result["demo"]]
+    completion_tokens = sum(call.get("completion_tokens", 0) for call in ok_calls)
+    return {
+        "requests": len(results),
+        "concurrency": concurrency,
+        "wall_sec": round(wall_sec, 3),
+        "throughput_per_sec": round(len(results) / wall_sec, 4) if wall_sec else None,
+        "completion_tokens_per_sec": round(completion_tokens / wall_sec, 2) if wall_sec else None,
+        "latency_sec": _latency_summary([result["seconds"] for result in results]),
+        "first_token_sec": _latency_summary([call["first_token_sec"] for call in ok_calls
+                                             if "first_token_sec" in call]),
+        "llm_call_sec": _latency_summary([call["seconds"] for call in ok_calls]),
+        # 合格率はデモ応答を不合格として数える（デモ応答はLLMの出力ではないため）
+        "pass_rate": round(sum(result["passed"] and not result["demo"] for result in results) / len(results), 4)
+        if results else None,
+        "retry_rate": round(sum(1 for result in generated if result["retries"]) / len(generated), 4)
+        if generated else None,
+        "retries_per_request": round(sum(result["retries"] for result in generated) / len(generated), 4)
+        if generated else None,
+        "auto_fix_rate": round(sum(1 for result in generated if result["auto_fixed"]) / len(generated), 4)
+        if generated else None,
+        "cache_hit_rate": round(sum(result["cache_hit"] for result in results) / len(results), 4)
+        if results else None,
+        "errors": sum(1 for result in results if result.get("error")),
+        # バックエンドが遮断・失敗してデモ応答になった件数
+        "demo_fallbacks": sum(1 for result in results if result["demo"]),
+        "backends": dict(Counter(str(result["backend"]) for result in results)),
+        "llm_calls": dict(Counter(call["outcome"] for call in calls)),
+    }
+
+
+def run_load_test(requests: int, concurrency: int, themes: int = len(LOAD_THEMES), units: int = 1,
+                  stream: bool = False, use_cache: bool = False, model_name: str = "qwen2.5:32b",
+                  human_only: bool = False, auto_fix: bool = True) -> Dict:
+    """負荷試験を実行して集計を返す（接続先は環境変数 OLLAMA_HOST）"""
+    from llm_generator import GenerationConfig, LLMSlideGenerator
+    config = GenerationConfig(model_name=model_name, stream=stream, use_cache=use_cache,
+                              human_only=human_only, auto_fix=auto_fix)
+    # サーバーモードと同じく1つのジェネレータ（接続プール・キャッシュ）を全スレッドで共有する
+    generator = LLMSlideGenerator(config)
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        results = list(executor.map(
+            lambda index: run_one(generator, index, themes, units, config), range(requests)))
+    summary = summarize(results, time.monotonic() - started, concurrency)
+    summary["results"] = results
+    return summary
+
+
+def print_summary(summary: Dict) -> None:
+    def fmt(values: Dict) -> str:
+        return " / ".join(f"{key} {value}" for key, value in values.items() if value is not None) or "なし"
+
+    print("\n=== 負荷試験結果 ===")
+    print(f"件数: {summary['requests']}（同時実行数 {summary['concurrency']}）")
+    print(f"所要時間: {summary['wall_sec']}秒")
+    print(f"スループット: {summary['throughput_per_sec']}件/秒（{summary['completion_tokens_per_sec']}トークン/秒）")
+    print(f"レイテンシ(秒): {fmt(summary['latency_sec'])}")
+    print(f"最初のトークン(秒): {fmt(summary['first_token_sec'])}")
+    print(f"LLM呼び出し(秒): {fmt(summary['llm_call_sec'])}")
+    print(f"合格率（デモ応答を除く）: {summary['pass_rate']} / 再試行率: {summary['retry_rate']} "
+          f"（1件あたり{summary['retries_per_request']}回）/ 自動修正率: {summary['auto_fix_rate']} "
+          f"/ キャッシュヒット率: {summary['cache_hit_rate']}")
+    print(f"バックエンド: {summary['backends']}（デモ応答へのフォールバック {summary['demo_fallbacks']}件）")
+    print(f"LLM呼び出し: {summary['llm_calls']}")
+    if summary.get("fake_server"):
+        print(f"疑似サーバー: {summary['fake_server']}")
+    if summary["errors"]:
+        print(f"例外: {summary['errors']}件")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="生成の負荷試験（疑似ollamaサーバーでも実行可能）")
+    parser.add_argument("--requests", type=int, default=20, help="生成する件数（デフォルト: 20）")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時実行数（デフォルト: 4）")
+    parser.add_argument("--themes", type=int, default=len(LOAD_THEMES),
+                        help=f"使うテーマの種類（少ないほどキャッシュが効く、最大{len(LOAD_THEMES)}）")
+    parser.add_argument("--units", type=int, default=1, help="ユニット数（デフォルト: 1）")
+    parser.add_argument("--model", type=str, default="qwen2.5:32b", help="使用モデル")
+    parser.add_argument("--stream", action="store_true", help="ストリーミング生成")
+    parser.add_argument("--human-only", action="store_true", help="人間用のみ生成")
+    parser.add_argument("--no-auto-fix", action="store_true",
+                        help="ページ番号・Excel行のエラーを自動修正しない（不正な出力が再試行になる）")
+    parser.add_argument("--cache", action="store_true",
+                        help="応答キャッシュを使う（--fake では一時ディレクトリ、デフォルト: 使わない）")
+    parser.add_argument("--url", type=str, help="ollamaのURL（デフォルト: 環境変数 OLLAMA_HOST）")
+    parser.add_argument("--fake", action="store_true", help="疑似ollamaサーバーをプロセス内に起動して使う")
+    parser.add_argument("--output", type=str, default=DEFAULT_RESULT_FILE,
+                        help=f"結果JSONの出力先（デフォルト: {DEFAULT_RESULT_FILE}）")
+    parser.add_argument("--log-level", type=str.upper, choices=["DEBUG", "INFO", "WARNING"],
+                        help="ログレベル（デフォルト: 環境変数 SLIDEGEN_LOG_LEVEL または INFO）")
+    add_fake_arguments(parser)
+    args = parser.parse_args()
+    setup_logging(args.log_level)
+
+    server = None
+    if args.fake:
+        try:
+            server, url = start_fake_server(fake_config_from_args(args))
+        except ValueError as e:
+            parser.error(str(e))
+        os.environ["OLLAMA_HOST"] = url
+        # 疑似サーバーの応答を普段のキャッシュに混ぜない
+        os.environ["SLIDEGEN_CACHE_DIR"] = tempfile.mkdtemp(prefix="slidegen-load-cache-")
+        print(f"疑似ollamaサーバー: {url}（遅延 {args.latency}、{args.tokens_per_sec}トークン/秒、"
+              f"エラー率 {args.error_rate}、不正な出力 {args.invalid_rate}、同時処理 {args.parallel}）")
+    elif args.url:
+        os.environ["OLLAMA_HOST"] = args.url
+    print(f"{args.requests}件を同時実行数{args.concurrency}で生成します...")
+
+    summary = run_load_test(args.requests, args.concurrency, args.themes, args.units, args.stream,
+                            args.cache, args.model, args.human_only, not args.no_auto_fix)
+    if server is not None:
+        summary["fake_server"] = server.fake.stats.to_dict()
+        server.shutdown()
+    print_summary(summary)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    print(f"\n結果: {args.output}")
+    return 0 if not summary["errors"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,11 +5,29 @@
 """
 
 import argparse
+import glob
+import json
 import sys
 import os
-from typing import Optional
-from llm_generator import LLMSlideGenerator, GenerationConfig
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING, Dict, List, Optional
+from context_budget import DEFAULT_PROMPT_TOKEN_BUDGET
+from knowledge_index import KnowledgeIndex, DEFAULT_KNOWLEDGE_DIR
+from knowledge_ingest import extract_all
+from bulk_validate import expand_targets, load_slide_texts, run_bulk_validation
 from validator import SlideValidator
+from job_store import DONE, JobStore, file_digest, input_hash
+from metrics import TRACE_FILE, Trace, setup_logging
+from slide_server import (
+    DEFAULT_HOST, DEFAULT_PORT, DEFAULT_QUEUE_SIZE, DEFAULT_SERVER_WORKERS, run_server,
+)
+
+# llm_generator（requests・asyncio などを読み込む）は生成するときだけ読み込み、
+# --validate-only などの起動を速くする
+if TYPE_CHECKING:
+    from llm_generator import LLMSlideGenerator
 
 def main():
     """メイン実行関数"""
@@ -22,6 +40,10 @@ def main():
   python main.py --theme "5S基本" --units 1 --reference "参考資料.txt"
   python main.py --interactive
   python main.py --demo
+  python main.py --batch jobs.jsonl --workers 4
+  python main.py --ingest
+  python main.py --serve --port 8080 --workers 2
+  python main.py --validate-only output/ "archive/**/*.txt" > report.jsonl
         """
     )
     
@@ -38,14 +60,112 @@ def main():
                        help="対話モードで実行")
     parser.add_argument("--demo", action="store_true",
                        help="デモモードで実行（固定サンプル）")
-    parser.add_argument("--validate-only", type=str,
-                       help="指定したファイルをバリデートのみ実行")
+    parser.add_argument("--validate-only", type=str, nargs="+", metavar="PATH",
+                       help="バリデートのみ実行（ファイル1件は結果を表示、複数・ディレクトリ・globはNDJSONで一括出力）")
+    parser.add_argument("--stream", action="store_true",
+                       help="ストリーミング生成（逐次バリデートし、致命的エラーで即座に再試行）")
+    parser.add_argument("--no-auto-fix", action="store_true",
+                       help="ページ番号・Excel行のエラーを自動修正せずLLMで再生成する（--stream ではこれらのエラーでも中断する）")
+    parser.add_argument("--human-only", action="store_true",
+                       help="LLMには人間用のみを生成させ、Excel用は人間用から自動生成する（出力トークン削減）")
+    parser.add_argument("--token-budget", type=int, default=DEFAULT_PROMPT_TOKEN_BUDGET,
+                       help=f"プロンプトのトークン予算（辞書・参考資料抜粋を関連度順に収める、デフォルト: {DEFAULT_PROMPT_TOKEN_BUDGET}）")
+    parser.add_argument("--candidates", type=int, default=1, metavar="N",
+                       help="試行ごとに温度・シードを変えた候補をN件並列生成し、最良のものを採用（デフォルト: 1）")
+    parser.add_argument("--hedge", type=str, action="append", metavar="MODEL[@URL]",
+                       help="主経路が遅い場合に同じプロンプトを投げるヘッジ先（複数指定可。例: qwen2.5:14b@http://gpu2:11434）")
+    parser.add_argument("--no-cache", action="store_true",
+                       help="応答キャッシュを使用しない（読み込み・保存とも）")
+    parser.add_argument("--refresh", action="store_true",
+                       help="キャッシュを無視して再生成し、結果でキャッシュを更新")
+    parser.add_argument("--knowledge", type=str, default=DEFAULT_KNOWLEDGE_DIR,
+                       help=f"自動検索する知識ディレクトリ（デフォルト: {DEFAULT_KNOWLEDGE_DIR}）")
+    parser.add_argument("--no-knowledge", action="store_true",
+                       help="知識ディレクトリの自動検索を行わない")
+    parser.add_argument("--semantic", action="store_true",
+                       help="知識ディレクトリのベクトル検索（意味検索）も併用する（要numpy）")
+    parser.add_argument("--ingest", action="store_true",
+                       help="知識ディレクトリを取り込み（テキスト抽出・索引更新）のみ実行")
+    parser.add_argument("--batch", type=str,
+                       help="ジョブ定義ファイル（JSONL: 1行1ジョブ）を一括実行")
+    parser.add_argument("--workers", type=int,
+                       help="同時実行数（バッチ: デフォルト4 / 取り込み・一括バリデート: デフォルトCPU数）")
+    parser.add_argument("--job-store", type=str,
+                       help="バッチのジョブ状態DB（SQLite、デフォルト: <output>/jobs.sqlite3）")
+    parser.add_argument("--serve", action="store_true",
+                       help="常駐サーバーモード（ジョブ投入・状態・結果取得と /validate をHTTPで受け付ける）")
+    parser.add_argument("--host", type=str, default=DEFAULT_HOST,
+                       help=f"サーバーの待ち受けアドレス（デフォルト: {DEFAULT_HOST}）")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                       help=f"サーバーのポート（デフォルト: {DEFAULT_PORT}）")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                       help=f"サーバーのジョブキュー上限（超えると429、デフォルト: {DEFAULT_QUEUE_SIZE}）")
+    parser.add_argument("--summary", type=str,
+                       help="バッチ結果サマリー(NDJSON)の出力先（デフォルト: <output>/batch_summary.jsonl）")
+    parser.add_argument("--log-level", type=str.upper, choices=["DEBUG", "INFO", "WARNING"],
+                       help="ログレベル（DEBUGで詳細ログ、デフォルト: 環境変数 SLIDEGEN_LOG_LEVEL または INFO）")
     
     args = parser.parse_args()
+    setup_logging(args.log_level)
     
     # バリデートのみモード
     if args.validate_only:
-        validate_file(args.validate_only)
+        paths = args.validate_only
+        if len(paths) == 1 and not os.path.isdir(paths[0]) and not glob.has_magic(paths[0]):
+            ok = validate_file(paths[0])
+        else:
+            ok = run_bulk_validation(paths, workers=args.workers)
+        sys.exit(0 if ok else 1)
+    
+    # 知識取り込みモード
+    if args.ingest:
+        ok = run_ingest(args.knowledge, workers=args.workers, semantic=args.semantic)
+        sys.exit(0 if ok else 1)
+    
+    # バッチモード
+    if args.batch:
+        ok = run_batch(
+            batch_file=args.batch,
+            workers=args.workers or 4,
+            output_root=args.output,
+            summary_file=args.summary,
+            job_store=args.job_store,
+            model_name=args.model,
+            temperature=args.temperature,
+            stream=args.stream,
+            use_cache=not args.no_cache,
+            refresh_cache=args.refresh,
+            knowledge_dir=None if args.no_knowledge else args.knowledge,
+            semantic=args.semantic,
+            human_only=args.human_only,
+            prompt_token_budget=args.token_budget,
+            hedge_backends=args.hedge,
+            candidates=args.candidates,
+            auto_fix=not args.no_auto_fix
+        )
+        sys.exit(0 if ok else 1)
+    
+    # サーバーモード
+    if args.serve:
+        run_serve(
+            host=args.host,
+            port=args.port,
+            workers=args.workers or DEFAULT_SERVER_WORKERS,
+            queue_size=args.queue_size,
+            output_root=args.output,
+            model_name=args.model,
+            temperature=args.temperature,
+            stream=args.stream,
+            use_cache=not args.no_cache,
+            refresh_cache=args.refresh,
+            knowledge_dir=None if args.no_knowledge else args.knowledge,
+            semantic=args.semantic,
+            human_only=args.human_only,
+            prompt_token_budget=args.token_budget,
+            hedge_backends=args.hedge,
+            candidates=args.candidates,
+            auto_fix=not args.no_auto_fix
+        )
         return
     
     # デモモード
@@ -70,15 +190,21 @@ def main():
         reference_file=args.reference,
         model_name=args.model,
         temperature=args.temperature,
-        output_dir=args.output
+        output_dir=args.output,
+        stream=args.stream,
+        use_cache=not args.no_cache,
+        refresh_cache=args.refresh,
+        knowledge_dir=None if args.no_knowledge else args.knowledge,
+        semantic=args.semantic,
+        human_only=args.human_only,
+        prompt_token_budget=args.token_budget,
+        hedge_backends=args.hedge,
+        candidates=args.candidates,
+        auto_fix=not args.no_auto_fix
     )
 
-def run_generation(theme: str, units: int, reference_file: Optional[str] = None,
-                   model_name: str = "qwen2.5:32b", temperature: float = 0.3,
-                   output_dir: str = "output") -> None:
-    """スライド生成を実行"""
-    
-    # 参考資料の読み込み
+def load_reference(reference_file: Optional[str]) -> str:
+    """参考資料ファイルを読み込み（存在しない場合は空文字）"""
     reference_text = ""
     if reference_file and os.path.exists(reference_file):
         try:
@@ -87,22 +213,80 @@ def run_generation(theme: str, units: int, reference_file: Optional[str] = None,
             print(f"参考資料を読み込み: {reference_file}")
         except Exception as e:
             print(f"警告: 参考資料の読み込みに失敗: {e}")
-    
-    # 入力フォーマット構築
-    user_input = f"""【テーマ】{theme}
+    return reference_text
+
+def load_knowledge_index(knowledge_dir: Optional[str]) -> Optional[KnowledgeIndex]:
+    """知識ディレクトリの検索インデックスを準備（変更ファイルのみ再索引化）"""
+    if not knowledge_dir or not os.path.isdir(knowledge_dir):
+        return None
+    index = KnowledgeIndex(knowledge_dir)
+    counts = index.update()
+    if counts["added"] or counts["updated"] or counts["removed"]:
+        print(f"知識インデックスを更新: 追加{counts['added']} 更新{counts['updated']} 削除{counts['removed']}")
+    return index
+
+def load_vector_store(knowledge_dir: Optional[str]):
+    """知識ディレクトリのベクトルストアを準備（numpyがない場合は無効）"""
+    if not knowledge_dir or not os.path.isdir(knowledge_dir):
+        return None
+    try:
+        from vector_store import VectorStore
+    except ImportError as e:
+        print(f"警告: ベクトル検索を使用できません（{e}）")
+        return None
+    store = VectorStore(knowledge_dir)
+    counts = store.sync()
+    if counts["added"] or counts["updated"] or counts["removed"]:
+        print(f"ベクトルストアを更新: 追加{counts['added']} 更新{counts['updated']} 削除{counts['removed']}")
+    return store
+
+def build_user_input(theme: str, units: int, reference_text: str = "") -> str:
+    """ユーザー入力フォーマットを構築"""
+    return f"""【テーマ】{theme}
 【ユニット数】{units}
 【参考資料】{reference_text if reference_text else '指定なし'}
 【出力】人間用→Excel用の順。比較スライドは日本×自国。
 【注意】不足は『要確認』と明示。用語は内蔵辞書を優先。"""
+
+def run_generation(theme: str, units: int, reference_file: Optional[str] = None,
+                   model_name: str = "qwen2.5:32b", temperature: float = 0.3,
+                   output_dir: str = "output", stream: bool = False,
+                   use_cache: bool = True, refresh_cache: bool = False,
+                   knowledge_dir: Optional[str] = DEFAULT_KNOWLEDGE_DIR,
+                   semantic: bool = False, human_only: bool = False,
+                   prompt_token_budget: int = DEFAULT_PROMPT_TOKEN_BUDGET,
+                   hedge_backends: Optional[List[str]] = None, candidates: int = 1,
+                   auto_fix: bool = True) -> None:
+    """スライド生成を実行"""
+    from llm_generator import GenerationConfig, LLMSlideGenerator
+    
+    # 参考資料の読み込み
+    reference_text = load_reference(reference_file)
+    
+    # 入力フォーマット構築
+    user_input = build_user_input(theme, units, reference_text)
     
     # 設定とジェネレータ初期化
     config = GenerationConfig(
         model_name=model_name,
         temperature=temperature,
-        max_retries=3
+        max_retries=3,
+        stream=stream,
+        use_cache=use_cache,
+        refresh_cache=refresh_cache,
+        human_only=human_only,
+        prompt_token_budget=prompt_token_budget,
+        hedge=bool(hedge_backends),
+        hedge_backends=tuple(hedge_backends or ()),
+        candidates=candidates,
+        auto_fix=auto_fix
     )
     
-    generator = LLMSlideGenerator(config)
+    generator = LLMSlideGenerator(
+        config,
+        knowledge_index=load_knowledge_index(knowledge_dir),
+        vector_store=load_vector_store(knowledge_dir) if semantic else None
+    )
     
     print("=== スライド生成開始 ===")
     print(f"テーマ: {theme}")
@@ -111,20 +295,27 @@ def run_generation(theme: str, units: int, reference_file: Optional[str] = None,
     print(f"温度: {temperature}")
     print()
     
+    trace = Trace(theme)
     try:
         # 生成実行
-        human_output, excel_output, stats = generator.generate_slides(
-            user_input, reference_text
-        )
+        with trace.activate():
+            human_output, excel_output, stats = generator.generate_slides(
+                user_input, reference_text
+            )
+            file_paths = generator.save_output(human_output, excel_output, output_dir) \
+                if stats.get('validation_passed') else None
+        trace_file = trace.save(os.path.join(output_dir, TRACE_FILE))
         
         # 結果表示
         print("=== 生成完了 ===")
-        print(f"試行回数: {stats.get('attempt', 'N/A')}")
+        print(f"試行回数: {stats.get('attempt', 'N/A')}（再試行: {stats.get('retries', 0)}）")
+        print(f"バックエンド: {stats.get('backend') or 'なし'}")
+        if stats.get('cache_hit'):
+            print("キャッシュ: ヒット（LLM呼び出しなし）")
         print(f"バリデート: {'✅ 合格' if stats.get('validation_passed') else '❌ 不合格'}")
+        print(f"トレース: {trace_file}")
         
-        if stats.get('validation_passed'):
-            # ファイル保存
-            file_paths = generator.save_output(human_output, excel_output, output_dir)
+        if file_paths:
             print(f"\n📁 保存先:")
             print(f"  人間用: {file_paths['human_file']}")
             print(f"  Excel用: {file_paths['excel_file']}")
@@ -147,6 +338,293 @@ def run_generation(theme: str, units: int, reference_file: Optional[str] = None,
         print(f"❌ 生成エラー: {e}")
         sys.exit(1)
 
+def run_ingest(knowledge_dir: str, workers: Optional[int] = None, semantic: bool = False) -> bool:
+    """知識ディレクトリの取り込み（並列テキスト抽出 → 検索インデックス更新）"""
+    if not os.path.isdir(knowledge_dir):
+        print(f"❌ ディレクトリが見つかりません: {knowledge_dir}")
+        return False
+    
+    print("=== 知識取り込み開始 ===")
+    print(f"対象: {knowledge_dir}")
+    started = time.time()
+    
+    # 1. 新規・変更ファイルのみプロセスプールでテキスト抽出（内容ハッシュでキャッシュ）
+    counts = extract_all(knowledge_dir, workers=workers)
+    print(f"抽出: 新規{counts['extracted']} キャッシュ{counts['cached']} "
+          f"変更なし{counts['unchanged']} 削除{counts['removed']} 失敗{counts['failed']}")
+    
+    # 2. 抽出キャッシュからチャンク化して検索インデックスを更新
+    index = load_knowledge_index(knowledge_dir)
+    print(f"インデックス: 文書{len(index.files)} チャンク{index.chunk_count()}")
+    if semantic:
+        load_vector_store(knowledge_dir)
+    
+    print(f"\n✅ 取り込み完了 ({time.time() - started:.1f}秒)")
+    return counts["failed"] == 0
+
+def load_batch_jobs(batch_file: str) -> List[Dict]:
+    """バッチジョブ定義（JSONL）を読み込み"""
+    jobs = []
+    with open(batch_file, "r", encoding="utf-8") as f:
+        for line_num, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                job = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{batch_file} 行{line_num}: JSONの解析に失敗: {e}")
+            if not job.get("theme"):
+                raise ValueError(f"{batch_file} 行{line_num}: theme が必要です")
+            job.setdefault("job_id", f"job{len(jobs) + 1:04d}")
+            jobs.append(job)
+    return jobs
+
+def _job_dir_name(job_id: str) -> str:
+    """ジョブIDを出力ディレクトリ名として安全な形に変換"""
+    return re.sub(r'[\\/:*?"<>|\s]+', '_', str(job_id)).strip('_') or "job"
+
+def _job_flag(job: Dict, key: str, default: bool) -> bool:
+    """ジョブのtrue/falseの項目を読む（"false" のような文字列や数値は ValueError）"""
+    value = job.get(key, default)
+    if not isinstance(value, bool):
+        raise ValueError(f"{key} は true / false で指定してください: {value!r}")
+    return value
+
+def run_batch_job(generator: "LLMSlideGenerator", job: Dict, output_root: str,
+                  default_model: str, default_temperature: float,
+                  default_stream: bool = False, use_cache: bool = True,
+                  refresh_cache: bool = False, default_human_only: bool = False,
+                  default_token_budget: int = DEFAULT_PROMPT_TOKEN_BUDGET,
+                  default_hedge_backends: Optional[List[str]] = None,
+                  default_candidates: int = 1, default_auto_fix: bool = True) -> Dict:
+    """バッチジョブを1件実行し、サマリー行を返す"""
+    from llm_generator import GenerationConfig
+    job_id = str(job["job_id"])
+    output_dir = job.get("output") or os.path.join(output_root, _job_dir_name(job_id))
+    hedge_backends = job.get("hedge", default_hedge_backends) or []
+    if isinstance(hedge_backends, str):
+        hedge_backends = [hedge_backends]
+    summary = {
+        "job_id": job_id,
+        "theme": job["theme"],
+        "model": job.get("model") or default_model,
+        "output_dir": output_dir,
+    }
+    
+    started = time.time()
+    trace = Trace(job_id)
+    try:
+        # 数値・true/falseの変換に失敗したジョブ（JSONLの書き間違いなど）もこのジョブだけのエラーにする
+        config = GenerationConfig(
+            model_name=job.get("model") or default_model,
+            temperature=float(job.get("temperature", default_temperature)),
+            max_retries=int(job.get("max_retries", 3)),
+            stream=_job_flag(job, "stream", default_stream),
+            use_cache=_job_flag(job, "cache", use_cache),
+            refresh_cache=_job_flag(job, "refresh", refresh_cache),
+            human_only=_job_flag(job, "human_only", default_human_only),
+            prompt_token_budget=int(job.get("token_budget", default_token_budget)),
+            hedge=bool(hedge_backends),
+            hedge_backends=tuple(hedge_backends),
+            candidates=int(job.get("candidates", default_candidates)),
+            auto_fix=_job_flag(job, "auto_fix", default_auto_fix),
+            # バッチ・サーバーではLLMが使えないときにデモ応答を合格として返さず、ジョブを失敗させる
+            demo_fallback=False
+        )
+        summary["units"] = int(job.get("units", 1))
+        # サーバー経由のジョブは参考資料をテキストで受け取れる
+        reference_text = job.get("reference_text") or load_reference(job.get("reference"))
+        user_input = build_user_input(job["theme"], summary["units"], reference_text)
+        with trace.activate():
+            human_output, excel_output, stats = generator.generate_slides(
+                user_input, reference_text, config=config
+            )
+            summary["stats"] = stats
+            summary["validation_passed"] = bool(stats.get("validation_passed"))
+            if summary["validation_passed"]:
+                summary["files"] = generator.save_output(human_output, excel_output, output_dir)
+                summary["status"] = "ok"
+            else:
+                summary["status"] = "invalid"
+    except Exception as e:
+        summary["status"] = "error"
+        summary["validation_passed"] = False
+        summary["error"] = str(e)
+    summary["elapsed_sec"] = round(time.time() - started, 3)
+    try:
+        summary["trace_file"] = trace.save(os.path.join(output_dir, TRACE_FILE))
+    except OSError as e:
+        print(f"警告: トレースの保存に失敗: {e}")
+    return summary
+
+def _job_input_hash(job: Dict, output_root: str, defaults: Dict) -> str:
+    """ジョブの入力ハッシュ（ジョブ定義・参考資料の内容・出力先・既定設定）"""
+    return input_hash({
+        "job": job,
+        "reference": file_digest(job.get("reference")),
+        "output_dir": job.get("output") or os.path.join(output_root, _job_dir_name(str(job["job_id"]))),
+        "defaults": defaults,
+    })
+
+def _outputs_exist(record: Dict) -> bool:
+    """完了済みジョブの出力ファイルが残っているか"""
+    return all(os.path.exists(path) for path in (record.get("outputs") or {}).values())
+
+def _run_claimed_job(store: JobStore, generator: "LLMSlideGenerator", job: Dict,
+                     *args) -> Optional[Dict]:
+    """ジョブを取得できたら実行して結果をストアに記録（取得できなければNone）"""
+    job_id = str(job["job_id"])
+    if not store.claim(job_id):
+        return None
+    summary = run_batch_job(generator, job, *args)
+    summary["attempts"] = store.get(job_id)["attempts"]
+    # デモ応答の扱い（エラーとして記録し次回やり直す）はストアが決める
+    return store.complete(job_id, summary)
+
+def run_batch(batch_file: str, workers: int = 4, output_root: str = "output",
+              summary_file: Optional[str] = None, job_store: Optional[str] = None,
+              model_name: str = "qwen2.5:32b",
+              temperature: float = 0.3, stream: bool = False,
+              use_cache: bool = True, refresh_cache: bool = False,
+              knowledge_dir: Optional[str] = DEFAULT_KNOWLEDGE_DIR,
+              semantic: bool = False, human_only: bool = False,
+              prompt_token_budget: int = DEFAULT_PROMPT_TOKEN_BUDGET,
+              hedge_backends: Optional[List[str]] = None, candidates: int = 1,
+              auto_fix: bool = True) -> bool:
+    """バッチモードの実行（共有ジェネレータ + 上限付きワーカープール + ジョブ状態DB）
+
+    同じ入力で完了済みのジョブは省略し、中断されたジョブは再開する。
+    同じジョブ状態DBを指定すれば複数プロセスで同じバッチを分担できる。
+    """
+    from llm_generator import GenerationConfig, LLMSlideGenerator
+    try:
+        jobs = load_batch_jobs(batch_file)
+    except (OSError, ValueError) as e:
+        print(f"❌ バッチファイル読み込みエラー: {e}")
+        return False
+    
+    if not jobs:
+        print("警告: 実行するジョブがありません")
+        return True
+    
+    workers = max(1, workers)
+    summary_file = summary_file or os.path.join(output_root, "batch_summary.jsonl")
+    os.makedirs(os.path.dirname(summary_file) or ".", exist_ok=True)
+    
+    # ジョブを状態DBに登録（入力が変わったジョブ・失敗したジョブは再実行対象に戻る）
+    store = JobStore(job_store or os.path.join(output_root, "jobs.sqlite3"))
+    defaults = {
+        "model": model_name, "temperature": temperature, "human_only": human_only,
+        "token_budget": prompt_token_budget, "hedge": hedge_backends or [], "candidates": candidates,
+    }
+    if not auto_fix:
+        # 既定（自動修正あり）のときは含めず、以前の実行で完了したジョブの入力ハッシュを変えない
+        defaults["auto_fix"] = False
+    counts = store.register((str(job["job_id"]), _job_input_hash(job, output_root, defaults)) for job in jobs)
+    rerun = []
+    for job in jobs:
+        record = store.get(str(job["job_id"]))
+        if record["state"] == DONE and (refresh_cache or not _outputs_exist(record)):
+            rerun.append(record["job_id"])
+    store.reset(rerun)
+    
+    # 全ジョブで1つのジェネレータを共有（プロンプト資源の読み込みは1回のみ）
+    generator = LLMSlideGenerator(
+        GenerationConfig(model_name=model_name, temperature=temperature),
+        knowledge_index=load_knowledge_index(knowledge_dir),
+        vector_store=load_vector_store(knowledge_dir) if semantic else None
+    )
+    
+    print("=== バッチ生成開始 ===")
+    print(f"ジョブ数: {len(jobs)}")
+    print(f"同時実行数: {workers}")
+    print(f"サマリー: {summary_file}")
+    print(f"ジョブ状態DB: {store.path}")
+    print(f"完了済み: {counts['done'] - len(rerun)} / 再実行: {counts['retry'] + counts['changed'] + len(rerun)}"
+          f" / 他プロセス実行中: {counts['running']}")
+    print()
+    
+    started = time.time()
+    passed = failed = elsewhere = 0
+    heartbeat = store.start_heartbeat()
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        with open(summary_file, "w", encoding="utf-8") as summary_out:
+            futures = {
+                executor.submit(_run_claimed_job, store, generator, job, output_root, model_name, temperature,
+                                stream, use_cache, refresh_cache, human_only, prompt_token_budget,
+                                hedge_backends, candidates, auto_fix): str(job["job_id"])
+                for job in jobs
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                if result is None:
+                    # 完了済み（記録した結果を使う）か、他のプロセスが実行中
+                    record = store.get(futures[future])
+                    if record["state"] != DONE:
+                        elsewhere += 1
+                        print(f"[{done}/{len(jobs)}] ⏭ {record['job_id']} 他のプロセスが実行中")
+                        continue
+                    result = dict(record["summary"], skipped=True)
+                if result["validation_passed"]:
+                    passed += 1
+                else:
+                    failed += 1
+                # 結果は完了順にメインスレッドから1行ずつ追記
+                summary_out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                summary_out.flush()
+                mark = "✅" if result["validation_passed"] else "❌"
+                note = "完了済み" if result.get("skipped") else f"{result['elapsed_sec']}秒"
+                print(f"[{done}/{len(jobs)}] {mark} {result['job_id']} {result['theme']} ({note})")
+        executor.shutdown(wait=True)
+    except KeyboardInterrupt:
+        # 未着手のジョブを取り消し、実行中のジョブを未実行に戻して次回の実行で再開できるようにする
+        executor.shutdown(wait=False, cancel_futures=True)
+        print(f"\n中断しました（実行中のジョブ {store.release()}件は次回再開します）")
+        raise
+    finally:
+        heartbeat.set()
+    
+    print()
+    print("=== バッチ生成完了 ===")
+    print(f"合格: {passed}/{len(jobs)}")
+    if elsewhere:
+        print(f"他のプロセスが実行中: {elsewhere}")
+    print(f"ジョブ状態: {store.counts()}")
+    print(f"所要時間: {time.time() - started:.1f}秒")
+    return failed == 0
+
+def run_serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+              workers: int = DEFAULT_SERVER_WORKERS, queue_size: int = DEFAULT_QUEUE_SIZE,
+              output_root: str = "output", model_name: str = "qwen2.5:32b",
+              temperature: float = 0.3, stream: bool = False,
+              use_cache: bool = True, refresh_cache: bool = False,
+              knowledge_dir: Optional[str] = DEFAULT_KNOWLEDGE_DIR,
+              semantic: bool = False, human_only: bool = False,
+              prompt_token_budget: int = DEFAULT_PROMPT_TOKEN_BUDGET,
+              hedge_backends: Optional[List[str]] = None, candidates: int = 1,
+              auto_fix: bool = True) -> None:
+    """サーバーモードの実行（ジェネレータ・知識インデックスは起動時に1回だけ準備する）"""
+    from llm_generator import GenerationConfig, LLMSlideGenerator
+    generator = LLMSlideGenerator(
+        GenerationConfig(model_name=model_name, temperature=temperature),
+        knowledge_index=load_knowledge_index(knowledge_dir),
+        vector_store=load_vector_store(knowledge_dir) if semantic else None
+    )
+    
+    def run_job(job: Dict) -> Dict:
+        # 投入されたジョブはバッチのジョブ1件と同じ扱い（<output>/<job_id>/ に保存）
+        return run_batch_job(generator, job, output_root, model_name, temperature,
+                             stream, use_cache, refresh_cache, human_only, prompt_token_budget,
+                             hedge_backends, candidates, auto_fix)
+    
+    try:
+        run_server(run_job, host, port, workers, queue_size,
+                   health_info=lambda: {"backends": generator.health.snapshot()})
+    finally:
+        generator.close()
+
 def run_interactive():
     """対話モードの実行"""
     print("=== 対話モード ===")
@@ -240,27 +718,22 @@ def run_demo():
         output_dir="demo_output"
     )
 
-def validate_file(file_path: str):
-    """ファイルバリデートのみ実行"""
+def validate_file(file_path: str) -> bool:
+    """ファイルバリデートのみ実行（合格ならTrue）"""
     if not os.path.exists(file_path):
         print(f"❌ ファイルが見つかりません: {file_path}")
         sys.exit(1)
     
+    # 人間用とExcel用の分割を試行（slide_human.txt は同じ場所の slide_excel.txt と組にする）
+    # /dev/null やプロセス置換（<(...)）は通常のファイルでないので対象にならず、そのまま読む
+    targets, _ = expand_targets([file_path])
+    file_path, excel_path = targets[0] if targets else (file_path, None)
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read()
+        human_part, excel_part = load_slide_texts(file_path, excel_path)
     except Exception as e:
         print(f"❌ ファイル読み込みエラー: {e}")
         sys.exit(1)
-    
-    # 人間用とExcel用の分割を試行
-    if "Excel:" in content:
-        human_part, excel_part = content.split("Excel:", 1)
-        human_part = human_part.strip()
-        excel_part = excel_part.strip()
-    else:
-        human_part = content
-        excel_part = ""
+    if not excel_part:
         print("警告: Excel形式が見つかりません")
     
     # バリデート実行
@@ -269,6 +742,8 @@ def validate_file(file_path: str):
     
     print("=== バリデート結果 ===")
     print(f"ファイル: {file_path}")
+    if excel_path:
+        print(f"Excel用: {excel_path}")
     print(f"結果: {'✅ 合格' if report['is_valid'] else '❌ 不合格'}")
     
     if report['errors']:
@@ -284,6 +759,8 @@ def validate_file(file_path: str):
         print(f"\n💡 修正提案:")
         for suggestion in report['suggestions']:
             print(f"  - {suggestion}")
+    
+    return report['is_valid']
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
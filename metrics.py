@@ -0,0 +1,352 @@
+"""
+計測とログ
+段階ごとの所要時間・LLM呼び出し（最初のトークン・総時間・トークン数・トークン/秒）・採用バックエンド・
+再試行回数を記録する。プロセス全体の集計はPrometheusのテキスト形式で、実行ごとの記録はJSONトレースで出力する
+"""
+
+import bisect
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from context_budget import estimate_tokens
+
+DEFAULT_LOG_LEVEL = "INFO"
+LOG_FORMAT = "[%(levelname)s] %(message)s"
+# 実行ごとのトレースのファイル名（出力ディレクトリに保存）
+TRACE_FILE = "trace.json"
+
+# 段階の名前
+STAGE_RETRIEVAL = "retrieval"
+STAGE_PROMPT_BUILD = "prompt_build"
+STAGE_VALIDATION = "validation"
+STAGE_SAVE = "save"
+STAGE_GENERATE = "generate"
+
+# ヒストグラムのバケット（秒）。LLM呼び出しは数秒〜数分、それ以外はミリ秒単位
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+LLM_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 90.0, 120.0, 180.0, 300.0)
+TOKENS_PER_SEC_BUCKETS = (1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0, 160.0)
+ATTEMPT_BUCKETS = (1, 2, 3, 4, 5, 8)
+
+
+def setup_logging(level: Optional[str] = None) -> None:
+    """ログレベルを設定（引数 → 環境変数 SLIDEGEN_LOG_LEVEL → INFO）。[DEBUG] 行はDEBUGでのみ出る"""
+    level = (level or os.getenv("SLIDEGEN_LOG_LEVEL") or DEFAULT_LOG_LEVEL).upper()
+    logging.basicConfig(level=level, format=LOG_FORMAT, stream=sys.stdout, force=True)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    """ラベル付きの値を持つ指標の共通部分"""
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+        return tuple((name, str(labels.get(name, ""))) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """増加のみの累計"""
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(Counter):
+    """現在値（増減する）"""
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """バケットごとの件数と合計"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = STAGE_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # ラベル → (バケットごとの件数, 合計, 件数)
+        self._values: Dict[Tuple[Tuple[str, str], ...], Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(counts):
+                counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts + [count - sum(counts)]):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', _format_value(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(round(total, 6))}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """プロセス全体の指標（Prometheusのテキスト形式で出力）"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = STAGE_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    """プロセス全体で共有する指標を返す"""
+    return _registry
+
+
+STAGE_SECONDS = _registry.histogram(
+    "slidegen_stage_seconds", "段階ごとの所要時間（秒）", ("stage",), STAGE_BUCKETS)
+LLM_CALLS = _registry.counter(
+    "slidegen_llm_calls_total", "LLM呼び出し回数（outcome: ok / error / aborted / cancelled）",
+    ("backend", "model", "outcome"))
+LLM_SECONDS = _registry.histogram(
+    "slidegen_llm_seconds", "LLM呼び出しの総時間（秒）", ("backend", "model"), LLM_BUCKETS)
+LLM_FIRST_TOKEN_SECONDS = _registry.histogram(
+    "slidegen_llm_first_token_seconds", "最初のトークンまでの時間（秒、ストリーミング時のみ）",
+    ("backend", "model"), LLM_BUCKETS)
+LLM_PROMPT_TOKENS = _registry.counter(
+    "slidegen_llm_prompt_tokens_total", "プロンプトのトークン数（バックエンドの報告値、なければ概算）",
+    ("backend", "model"))
+LLM_COMPLETION_TOKENS = _registry.counter(
+    "slidegen_llm_completion_tokens_total", "生成されたトークン数（バックエンドの報告値、なければ概算）",
+    ("backend", "model"))
+LLM_TOKENS_PER_SECOND = _registry.histogram(
+    "slidegen_llm_tokens_per_second", "生成速度（トークン/秒）", ("backend", "model"), TOKENS_PER_SEC_BUCKETS)
+GENERATIONS = _registry.counter(
+    "slidegen_generations_total", "台本生成の件数（backend: 採用したバックエンド、result: passed / failed / cache）",
+    ("backend", "result"))
+GENERATION_ATTEMPTS = _registry.histogram(
+    "slidegen_generation_attempts", "台本1件あたりの試行回数", (), ATTEMPT_BUCKETS)
+RETRIES = _registry.counter("slidegen_retries_total", "再試行の回数")
+
+
+class Trace:
+    """1回の実行（ジョブ）の記録。段階・LLM呼び出し・結果を時刻順に持ち、JSONで保存できる"""
+
+    def __init__(self, name: str = ""):
+        self.name = name
+        self.started_at = time.time()
+        self._start = time.monotonic()
+        self.spans: List[Dict] = []
+        self.llm_calls: List[Dict] = []
+        self.generations: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def offset(self) -> float:
+        return round(time.monotonic() - self._start, 6)
+
+    def add_span(self, stage: str, started: float, seconds: float, attrs: Dict) -> None:
+        with self._lock:
+            self.spans.append(dict(attrs, stage=stage, start=round(started - self._start, 6),
+                                   seconds=round(seconds, 6)))
+
+    def add_llm_call(self, call: Dict) -> None:
+        with self._lock:
+            self.llm_calls.append(dict(call, at=self.offset()))
+
+    def add_generation(self, result: Dict) -> None:
+        with self._lock:
+            self.generations.append(dict(result, at=self.offset()))
+
+    @contextmanager
+    def activate(self) -> Iterator["Trace"]:
+        """このトレースを現在の実行の記録先にする（スレッドプール・asyncioタスクにはコンテキストごと引き継ぐ）"""
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            spans, calls, generations = list(self.spans), list(self.llm_calls), list(self.generations)
+        stages: Dict[str, Dict] = {}
+        for span in spans:
+            total = stages.setdefault(span["stage"], {"count": 0, "seconds": 0.0})
+            total["count"] += 1
+            total["seconds"] = round(total["seconds"] + span["seconds"], 6)
+        # 分割生成では単位ごとに記録されるので、バックエンドは連結・リトライは合計する
+        backends = sorted({generation["backend"] for generation in generations})
+        return {
+            "name": self.name,
+            "started_at": self.started_at,
+            "elapsed_sec": self.offset(),
+            "backend": "+".join(backends) or None,
+            "retries": sum(generation["retries"] for generation in generations),
+            "stages": stages,
+            "llm_calls": calls,
+            "generations": generations,
+            "spans": spans,
+        }
+
+    def save(self, path: str) -> str:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        return path
+
+
+_current: "contextvars.ContextVar[Optional[Trace]]" = contextvars.ContextVar("slidegen_trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    """現在の実行のトレース（なければNone）"""
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str, **attrs) -> Iterator[Dict]:
+    """段階の所要時間を計測（yieldした辞書に書き込んだ値はトレースに残る）"""
+    started = time.monotonic()
+    try:
+        yield attrs
+    finally:
+        seconds = time.monotonic() - started
+        STAGE_SECONDS.observe(seconds, stage=name)
+        trace = current_trace()
+        if trace is not None:
+            trace.add_span(name, started, seconds, attrs)
+
+
+def record_llm_call(backend: str, model: str, seconds: float, outcome: str = "ok",
+                    first_token_sec: Optional[float] = None, prompt: str = "", text: str = "",
+                    usage: Optional[Dict] = None, trace: Optional[Trace] = None) -> Dict:
+    """LLM呼び出し1回分を記録（トークン数はバックエンドの報告値、なければ文字数からの概算）
+
+    trace はスレッドで実行される経路など、呼び出し元のコンテキストを引き継げない場合に渡す。
+    """
+    usage = usage or {}
+    call = {"backend": backend, "model": model, "outcome": outcome, "seconds": round(seconds, 6)}
+    LLM_CALLS.inc(backend=backend, model=model, outcome=outcome)
+    if first_token_sec is not None:
+        call["first_token_sec"] = round(first_token_sec, 6)
+        LLM_FIRST_TOKEN_SECONDS.observe(first_token_sec, backend=backend, model=model)
+    if outcome == "ok":
+        LLM_SECONDS.observe(seconds, backend=backend, model=model)
+        prompt_tokens = usage.get("prompt_tokens", estimate_tokens(prompt))
+        completion_tokens = usage.get("completion_tokens", estimate_tokens(text))
+        # 生成時間はバックエンドの報告値 → 最初のトークン以降 → 総時間の順に使う
+        generation_sec = usage.get("generation_sec") or (
+            seconds - first_token_sec if first_token_sec is not None else seconds)
+        call.update(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        LLM_PROMPT_TOKENS.inc(prompt_tokens, backend=backend, model=model)
+        LLM_COMPLETION_TOKENS.inc(completion_tokens, backend=backend, model=model)
+        if generation_sec > 0 and completion_tokens:
+            call["tokens_per_sec"] = round(completion_tokens / generation_sec, 2)
+            LLM_TOKENS_PER_SECOND.observe(call["tokens_per_sec"], backend=backend, model=model)
+    trace = trace or current_trace()
+    if trace is not None:
+        trace.add_llm_call(call)
+    return call
+
+
+def record_generation(backend: str, attempts: int, passed: bool, cache_hit: bool = False) -> None:
+    """台本1件の結果（採用したバックエンド・試行回数）を記録"""
+    result = "cache" if cache_hit else ("passed" if passed else "failed")
+    GENERATIONS.inc(backend=backend, result=result)
+    if not cache_hit:
+        GENERATION_ATTEMPTS.observe(attempts)
+        RETRIES.inc(max(0, attempts - 1))
+    trace = current_trace()
+    if trace is not None:
+        trace.add_generation({"backend": backend, "attempts": attempts, "retries": max(0, attempts - 1),
+                              "result": result})
+
+
+# 使用例
+if __name__ == "__main__":
+    setup_logging("DEBUG")
+    run = Trace("demo")
+    with run.activate():
+        with stage(STAGE_PROMPT_BUILD, prompt_chars=1200):
+            time.sleep(0.01)
+        record_llm_call("ollama", "qwen2.5:32b", 12.5, first_token_sec=0.8, prompt="あ" * 1200, text="い" * 600,
+                        usage={"prompt_tokens": 900, "completion_tokens": 650})
+        record_generation("ollama", attempts=2, passed=True)
+    print(json.dumps(run.to_dict(), ensure_ascii=False, indent=2))
+    print(get_metrics_registry().render())
@@ -0,0 +1,134 @@
+"""
+複数ユニット講座の分割生成
+ユニット構成を決めて1ユニットずつ生成し、共通の表紙・総括を付けて1つの台本に連結する
+"""
+
+import re
+from typing import List, Optional
+
+from slide_repair import renumber_pages, split_pages
+
+# 分割生成時に同時に生成するユニット数の上限
+DEFAULT_UNIT_CONCURRENCY = 4
+# ユニット構成（タイトル一覧）を決める呼び出しの最大出力トークン数
+UNIT_PLAN_MAX_TOKENS = 400
+# ユニットタイトルの最大文字数（system_rules_ja.txt のタイトル制限）
+UNIT_TITLE_MAX_CHARS = 20
+
+_UNITS_RE = re.compile(r'^【ユニット数】\s*(\d+)', re.MULTILINE)
+_THEME_RE = re.compile(r'^【テーマ】\s*(.+)$', re.MULTILINE)
+_PLAN_LINE_RE = re.compile(r'第\s*(\d+)\s*ユニット\s*[：:]\s*(.+)')
+
+
+def parse_unit_count(user_input: str) -> int:
+    """ユーザー入力の【ユニット数】を読む（なければ1）"""
+    match = _UNITS_RE.search(user_input)
+    return max(1, int(match.group(1))) if match else 1
+
+
+def parse_theme(user_input: str) -> str:
+    """ユーザー入力の【テーマ】を読む（なければ先頭行）"""
+    match = _THEME_RE.search(user_input)
+    return match.group(1).strip() if match else user_input.strip().split('\n', 1)[0]
+
+
+def build_plan_prompt(user_input: str, units: int) -> str:
+    """ユニット構成（各ユニットのタイトル）だけを出力させるプロンプト"""
+    return f"""[ユニット構成]
+次の講座を{units}ユニットに分けます。各ユニットのタイトルを決めてください。
+ユニット同士で内容が重ならないようにし、基本から応用の順に並べてください。
+
+[ユーザー入力]
+{user_input}
+
+[出力要求]
+次の形式で{units}行のみ出力（タイトルは{UNIT_TITLE_MAX_CHARS}字以内）。
+第1ユニット：タイトル
+第2ユニット：タイトル"""
+
+
+def parse_unit_titles(text: str, units: int) -> Optional[List[str]]:
+    """ユニット構成の出力からタイトル一覧を取り出す（1〜unitsが揃わなければNone）"""
+    titles = {}
+    for line in text.split('\n'):
+        match = _PLAN_LINE_RE.search(line)
+        if match:
+            title = match.group(2).strip()[:UNIT_TITLE_MAX_CHARS]
+            titles.setdefault(int(match.group(1)), title)
+    if not all(titles.get(number) for number in range(1, units + 1)):
+        return None
+    return [titles[number] for number in range(1, units + 1)]
+
+
+def default_unit_titles(theme: str, units: int) -> List[str]:
+    """ユニット構成を決められなかった場合のタイトル"""
+    return [f"{theme[:UNIT_TITLE_MAX_CHARS - 6]}（{number}/{units}）" for number in range(1, units + 1)]
+
+
+def build_unit_input(user_input: str, number: int, titles: List[str]) -> str:
+    """1ユニット分の生成用ユーザー入力（【ユニット数】を1にし、担当ユニットを指定する）"""
+    units = len(titles)
+    outline = "\n".join(f"第{i}ユニット：{title}" for i, title in enumerate(titles, 1))
+    unit_input = _UNITS_RE.sub('【ユニット数】1', user_input, count=1)
+    return f"""{unit_input}
+【担当ユニット】第{number}ユニット：{titles[number - 1]}（全{units}ユニット中）
+【講座構成】
+{outline}
+【分割生成】担当ユニットの内容のみ。ユニット表紙は「第{number}ユニット：{titles[number - 1]}」とする。"""
+
+
+def _is_cover(heading: str) -> bool:
+    return '表紙' in heading and 'ユニット' not in heading
+
+
+def _is_summary(heading: str) -> bool:
+    return '総括' in heading
+
+
+def build_cover(theme: str, titles: List[str]) -> List[str]:
+    """講座全体の表紙ページ"""
+    return [
+        "1. 表紙",
+        theme[:45],
+        f"全{len(titles)}ユニットで学ぶ",
+        "小まとめ：今日の学びを1つ職場で実践",
+    ]
+
+
+def build_summary(titles: List[str]) -> List[str]:
+    """講座全体の総括ページ（番号は連結後に振り直す）"""
+    return (["1. 総括"]
+            + [f"第{number}ユニット：{title}" for number, title in enumerate(titles, 1)]
+            + ["問いかけ：明日から何を実践しますか？"])
+
+
+def stitch_units(theme: str, titles: List[str], unit_texts: List[str]) -> str:
+    """ユニットごとの人間用テキストを1つの台本に連結
+
+    各ユニットの表紙・総括ページは除き、講座全体の表紙を先頭・総括を末尾に置いて
+    ページ番号を1から振り直す。
+    """
+    pages = [build_cover(theme, titles)]
+    for text in unit_texts:
+        for page in split_pages(text)[1]:
+            if not (_is_cover(page[0]) or _is_summary(page[0])):
+                pages.append([line for line in page if line.strip()])
+    pages.append(build_summary(titles))
+    return renumber_pages("\n\n".join("\n".join(page) for page in pages))
+
+
+# 使用例
+if __name__ == "__main__":
+    unit_output = """1. 表紙
+フォークリフト安全
+小まとめ：今日の目標を決める
+
+2. ユニット表紙
+第1ユニット：作業前点検
+
+3. 導入
+点検していますか？"""
+    titles = ["作業前点検", "走行と荷役"]
+    print(build_unit_input("【テーマ】フォークリフト安全\n【ユニット数】2", 1, titles))
+    print()
+    print(stitch_units("フォークリフト安全", titles, [unit_output, unit_output.replace("第1", "第2")]))
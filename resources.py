@@ -0,0 +1,151 @@
+"""
+プロンプト資源のレジストリ（プロセス全体で共有）
+system_rules_ja.txt / fewshot_samples.txt / safety_dict.txt をパッケージの場所から1度だけ読み込み、
+解析済みの不変なスナップショットとして共有する。ファイルの更新時刻が変わった場合のみ読み直す
+"""
+
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from context_budget import DictEntry, format_dictionary, parse_dictionary
+from fewshot import FewshotIndex, parse_fewshot_samples
+
+logger = logging.getLogger(__name__)
+
+# 資源ファイルの既定の場所（このパッケージのディレクトリ、環境変数 SLIDEGEN_RESOURCE_DIR で変更可）
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+SYSTEM_RULES_FILE = "system_rules_ja.txt"
+FEWSHOT_FILE = "fewshot_samples.txt"
+SAFETY_DICT_FILE = "safety_dict.txt"
+# 更新時刻を確認する最短間隔（秒）。プロンプトごとに stat しないように間引く
+RESOURCE_CHECK_INTERVAL_SEC = 1.0
+
+MISSING_SYSTEM_PROMPT = "システムプロンプトファイルが見つかりません"
+
+# (更新時刻ns, サイズ)。ファイルがなければNone
+_Signature = Optional[Tuple[int, int]]
+
+
+def resource_path(name: str, resource_dir: Optional[str] = None) -> str:
+    """資源ファイルの絶対パス（絶対パスはそのまま、相対パスは資源ディレクトリ基準）"""
+    if os.path.isabs(name):
+        return name
+    return os.path.join(resource_dir or os.getenv("SLIDEGEN_RESOURCE_DIR") or PACKAGE_DIR, name)
+
+
+def _signature(path: str) -> _Signature:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+@dataclass(frozen=True)
+class PromptResources:
+    """解析済みのプロンプト資源（読み直すと別のインスタンスに置き換わり、既存のものは変わらない）"""
+    system_prompt: str
+    fewshot_examples: str
+    fewshot_index: FewshotIndex
+    safety_dict: str
+    dictionary_entries: Tuple[DictEntry, ...]
+    prompt_prefix: str  # 全ジョブ共通の固定プレフィックス（システムプロンプト + 辞書の表記ルール）
+    signatures: Tuple[_Signature, ...]
+
+
+def build_prompt_prefix(system_prompt: str, dictionary_entries: Tuple[DictEntry, ...]) -> str:
+    """ジョブによらず変わらない部分（システムプロンプト + 辞書の表記ルール）"""
+    rules = format_dictionary([entry for entry in dictionary_entries if not entry.term])
+    if not rules:
+        return system_prompt
+    return f"""{system_prompt}
+
+[表記ルール]
+{rules}"""
+
+
+def load_prompt_resources(paths: Tuple[str, str, str]) -> PromptResources:
+    """(システムプロンプト, Few-shot例, 辞書) のパスから資源を読み込んで解析"""
+    signatures = tuple(_signature(path) for path in paths)
+    system_path, fewshot_path, dict_path = paths
+    system_prompt = _read(system_path) or MISSING_SYSTEM_PROMPT
+    fewshot_examples = _read(fewshot_path) or ""
+    safety_dict = _read(dict_path) or ""
+    entries = tuple(parse_dictionary(safety_dict))
+    logger.debug(f"プロンプト資源を読み込み: {os.path.dirname(system_path)}")
+    return PromptResources(
+        system_prompt=system_prompt,
+        fewshot_examples=fewshot_examples,
+        # Few-shot例は例ごとに索引化しておき、ジョブごとにテーマに近いものだけを載せる
+        fewshot_index=FewshotIndex(parse_fewshot_samples(fewshot_examples)),
+        safety_dict=safety_dict,
+        # 辞書は項目単位に分割しておき、プロンプトごとに関連する用語だけを選ぶ
+        dictionary_entries=entries,
+        prompt_prefix=build_prompt_prefix(system_prompt, entries),
+        signatures=signatures,
+    )
+
+
+class ResourceRegistry:
+    """資源ディレクトリごとの PromptResources を保持し、更新されたときだけ読み直す"""
+
+    def __init__(self, check_interval: float = RESOURCE_CHECK_INTERVAL_SEC):
+        self.check_interval = check_interval
+        self._entries: Dict[Tuple[str, str, str], Tuple[PromptResources, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, resource_dir: Optional[str] = None) -> PromptResources:
+        paths = tuple(resource_path(name, resource_dir)
+                      for name in (SYSTEM_RULES_FILE, FEWSHOT_FILE, SAFETY_DICT_FILE))
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(paths)
+            if cached is not None:
+                resources, checked_at = cached
+                if now - checked_at < self.check_interval:
+                    return resources
+                if tuple(_signature(path) for path in paths) == resources.signatures:
+                    self._entries[paths] = (resources, now)
+                    return resources
+            resources = load_prompt_resources(paths)
+            self._entries[paths] = (resources, now)
+            return resources
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+_registry = ResourceRegistry()
+
+
+def get_resource_registry() -> ResourceRegistry:
+    """プロセス全体で共有する資源レジストリを返す"""
+    return _registry
+
+
+def get_prompt_resources(resource_dir: Optional[str] = None) -> PromptResources:
+    """現在のプロンプト資源（共有レジストリ経由）"""
+    return _registry.get(resource_dir)
+
+
+# 使用例
+if __name__ == "__main__":
+    resources = get_prompt_resources()
+    print(f"システムプロンプト: {len(resources.system_prompt)}文字")
+    print(f"Few-shot例: {len(resources.fewshot_index.examples)}例")
+    print(f"辞書項目: {len(resources.dictionary_entries)}")
+    print(f"固定プレフィックス: {len(resources.prompt_prefix)}文字")
+    print(f"2回目は同じインスタンス: {get_prompt_resources() is resources}")
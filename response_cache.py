@@ -0,0 +1,142 @@
+"""
+LLM応答のディスクキャッシュ
+最終プロンプト・モデル・生成パラメータのハッシュをキーに、バリデート合格済みの出力のみを保存する
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+DEFAULT_CACHE_DIR = ".llm_cache"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024  # 256MB
+DEFAULT_TTL_SEC = 30 * 24 * 3600  # 30日
+
+
+def make_cache_key(prompt: str, system_prompt: str, model_name: str,
+                   temperature: float, max_tokens: int) -> str:
+    """キャッシュキー（SHA-256）を生成"""
+    material = json.dumps({
+        "prompt": prompt,
+        "system": system_prompt,
+        "model": model_name,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    }, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """サイズ上限付きLRU + TTLのコンテンツアドレス型キャッシュ
+
+    1エントリ1ファイル（<dir>/<key先頭2桁>/<key>.json）で保存する。
+    最終アクセス時刻はファイルのmtimeで管理し、上限超過時は古い順に削除する。
+    書き込みは一時ファイル経由の置き換えのため、複数プロセスから共有できる。
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: int = DEFAULT_MAX_BYTES,
+                 ttl_sec: float = DEFAULT_TTL_SEC):
+        self.cache_dir = cache_dir or os.getenv("SLIDEGEN_CACHE_DIR") or DEFAULT_CACHE_DIR
+        self.max_bytes = max_bytes
+        self.ttl_sec = ttl_sec
+        self._lock = threading.Lock()
+        self._total_bytes: Optional[int] = None
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[str]:
+        """キャッシュ済みの出力を返す（未登録・期限切れはNone）"""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if self.ttl_sec and time.time() - entry.get("created", 0) > self.ttl_sec:
+            self._remove(path)
+            return None
+
+        try:
+            os.utime(path)  # LRU用に最終アクセス時刻を更新
+        except OSError:
+            pass
+        return entry.get("text")
+
+    def put(self, key: str, text: str, meta: Optional[Dict] = None) -> None:
+        """出力を保存（バリデート合格済みのもののみ渡すこと）"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {"key": key, "created": time.time(), "text": text, "meta": meta or {}}
+        data = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += len(data) - old_size
+        self._evict_if_needed()
+
+    def _remove(self, path: str) -> None:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes -= size
+
+    def _scan(self):
+        """全エントリの (mtime, size, path) を列挙"""
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _evict_if_needed(self) -> None:
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._scan())
+            if self._total_bytes <= self.max_bytes:
+                return
+            # 上限の9割まで古い順に削除（毎回の走査を避けるため余裕を持たせる）
+            target = int(self.max_bytes * 0.9)
+            entries = sorted(self._scan())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+            self._total_bytes = total
+
+    def clear(self) -> None:
+        """全エントリを削除"""
+        for _, _, path in self._scan():
+            self._remove(path)
+        with self._lock:
+            self._total_bytes = 0
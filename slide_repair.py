@@ -0,0 +1,297 @@
+"""
+スライド単位の部分修正と機械的な自動修正
+- バリデートエラーを該当ページに対応付け、そのページだけをLLMに書き直させて台本に差し戻す
+- 人間用からのExcel用の導出、ページ番号の振り直しなどLLMを呼ばずに直せる修正
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from validator import PAGE_NUMBER_PATTERN
+
+# ページ単位に対応付けられるエラー（それ以外は台本全体の問題として全体再生成に回す）
+_LONG_LINE_ERROR_RE = re.compile(r'^行(\d+): ')
+_PAGE_JUMP_ERROR_RE = re.compile(r'^ページ番号が飛んでいます: (\d+)を期待')
+_EXCEL_ERROR_RE = re.compile(r'^Excel行(\d+): ')
+# ページ見出し（"3. 導入"）。"." の直後が数字の行は "2.5トンまで" のような本文なので見出しにしない
+_PAGE_HEADING_RE = re.compile(r'(\d+)\s*\.(?!\d)')
+# バリデータがページ番号として数える行（本文の "2.5トン" なども含む）
+_PAGE_NUMBER_LINE_RE = re.compile(PAGE_NUMBER_PATTERN, re.M)
+_PAGE_JUMP_ERROR_PREFIX = "ページ番号が飛んでいます"
+_EXCEL_PAGE_RE = re.compile(r'\s*(\d+)\s*:')
+_PAGE_ERROR_PREFIXES = (_PAGE_JUMP_ERROR_PREFIX, "1ページから開始していない")
+
+# 修正対象がこの割合を超える場合は部分修正せず全体を再生成する
+REPAIR_MAX_PAGE_RATIO = 0.5
+# 部分修正の出力から対象ページを取り出せなかった場合のエラー（ページに対応付けられない）
+REPAIR_PARSE_ERROR = "部分修正の出力から対象ページを取り出せませんでした"
+
+
+@dataclass
+class RepairPlan:
+    """部分修正の計画（修正前の台本・ページ分割・ページごとのエラー）"""
+    human_text: str
+    excel_text: str
+    errors: List[str]
+    preamble: List[str]
+    pages: List[List[str]]
+    excel_rows: List[str]
+    page_errors: Dict[int, List[str]] = field(default_factory=dict)  # ページ番号 → エラー
+
+    @property
+    def output_text(self) -> str:
+        """修正前の台本（生成出力の形式）"""
+        return join_output(self.human_text, self.excel_text)
+
+
+def join_output(human_text: str, excel_text: str) -> str:
+    """人間用とExcel用を生成出力の形式（"Excel:" 区切り）に戻す"""
+    return f"{human_text}\n\nExcel:\n{excel_text}"
+
+
+def is_page_heading(line: str) -> bool:
+    """ページ見出し行か（"2.5トンまで積める" のように数字で始まる本文は見出しではない）"""
+    return line[:1].isdecimal() and bool(_PAGE_HEADING_RE.match(line))
+
+
+def has_non_heading_page_lines(human_text: str) -> bool:
+    """見出しではないのにバリデータがページ番号として数える行（"2.5トン" など）があるか
+
+    このときのページ番号飛びは番号の振り直しでは直らない（本文を書き換えてしまう）。
+    """
+    return len(_PAGE_NUMBER_LINE_RE.findall(human_text)) != len(split_pages(human_text)[1])
+
+
+def split_pages(human_text: str) -> Tuple[List[str], List[List[str]]]:
+    """人間用テキストを (見出し前の行, ページごとの行リスト) に分割（各ページの先頭は見出し行）"""
+    preamble, pages = [], []
+    for line in human_text.split('\n'):
+        if is_page_heading(line):
+            pages.append([line])
+        elif pages:
+            pages[-1].append(line)
+        else:
+            preamble.append(line)
+    return preamble, pages
+
+
+def _excel_page_numbers(rows: List[str]) -> List[Optional[int]]:
+    """Excel行ごとのページ番号（読めない行は直前の行のページとみなす）"""
+    numbers, current = [], None
+    for row in rows:
+        match = _EXCEL_PAGE_RE.match(row)
+        if match:
+            current = int(match.group(1))
+        numbers.append(current)
+    return numbers
+
+
+def plan_repair(human_text: str, excel_text: str, errors: List[str]) -> Optional[RepairPlan]:
+    """エラーを該当ページに対応付けた修正計画を返す（ページ単位で直せない場合はNone）"""
+    if not errors:
+        return None
+    preamble, pages = split_pages(human_text)
+    if not pages:
+        return None
+    excel_rows = [row for row in excel_text.split('\n') if row.strip()]
+    excel_pages = _excel_page_numbers(excel_rows)
+
+    # 人間用の行番号（1始まり）→ ページ番号
+    line_pages = [None] * len(preamble)
+    for number, page in enumerate(pages, 1):
+        line_pages.extend([number] * len(page))
+
+    page_errors: Dict[int, List[str]] = {}
+    for error in errors:
+        page = None
+        match = _LONG_LINE_ERROR_RE.match(error)
+        if match:
+            line_num = int(match.group(1))
+            if line_num <= len(line_pages):
+                page = line_pages[line_num - 1]
+        match = _PAGE_JUMP_ERROR_RE.match(error)
+        if match:
+            page = int(match.group(1))
+        match = _EXCEL_ERROR_RE.match(error)
+        if match:
+            row_num = int(match.group(1))
+            if row_num <= len(excel_pages):
+                page = excel_pages[row_num - 1]
+        if page is None or not 1 <= page <= len(pages):
+            return None
+        page_errors.setdefault(page, []).append(error)
+
+    if len(page_errors) > max(1, int(len(pages) * REPAIR_MAX_PAGE_RATIO)):
+        return None
+    return RepairPlan(human_text, excel_text, list(errors), preamble, pages, excel_rows,
+                      dict(sorted(page_errors.items())))
+
+
+def build_repair_prompt(plan: RepairPlan, human_only: bool = False) -> str:
+    """対象ページだけを書き直させるプロンプトを構築（台本全体は送らない）"""
+    numbers = list(plan.page_errors)
+    outline = "\n".join(page[0].strip() for page in plan.pages)
+    error_summary = "\n".join(
+        f"- {number}ページ: {error}" for number, errors in plan.page_errors.items() for error in errors
+    )
+    excel_pages = _excel_page_numbers(plan.excel_rows)
+    current_pages = "\n\n".join("\n".join(plan.pages[number - 1]).strip() for number in numbers)
+    current_rows = "\n".join(
+        row for row, page in zip(plan.excel_rows, excel_pages) if page in plan.page_errors
+    )
+    page_list = "・".join(str(number) for number in numbers)
+    if human_only:
+        current_excel = ""
+        output_request = f"""書き直した {page_list} ページのみを人間用の形式で出力（Excel用は出力しない）。
+ページ番号は {page_list} とすること。1行50字以内。"""
+    else:
+        current_excel = f"\n\nExcel:\n{current_rows}"
+        output_request = f"""書き直した {page_list} ページのみを 1) 人間用 → 2) Excel用 の順で出力。
+ページ番号は {page_list} とすること。1行50字以内。Excelは page : line : text_ja : の形式でtext_enは空欄。"""
+
+    return f"""[部分修正]
+スライド台本のうち {page_list} ページに問題があります。これらのページだけを書き直してください。
+他のページは出力しないでください。
+
+[全体構成]
+{outline}
+
+[問題]
+{error_summary}
+
+[書き直すページ（現在の内容）]
+{current_pages}{current_excel}
+
+[出力要求]
+{output_request}"""
+
+
+def apply_repair(plan: RepairPlan, human_text: str, excel_text: str,
+                 require_excel: bool = True) -> Optional[Tuple[str, str]]:
+    """部分修正の出力（人間用・Excel用に分割済み）を台本に差し戻す（対象ページが揃わなければNone）
+
+    require_excel=False の場合はExcel用の行がなくてもよい（Excel用は後で人間用から導出する）。
+    """
+    _, new_pages = split_pages(human_text)
+    replaced = {}
+    for page in new_pages:
+        number = int(_PAGE_HEADING_RE.match(page[0]).group(1))
+        if number in plan.page_errors and number not in replaced:
+            replaced[number] = page
+    new_rows = [row for row in excel_text.split('\n') if row.strip()]
+    new_excel: Dict[int, List[str]] = {}
+    for row, page in zip(new_rows, _excel_page_numbers(new_rows)):
+        if page in plan.page_errors:
+            new_excel.setdefault(page, []).append(row)
+    if set(replaced) != set(plan.page_errors):
+        return None
+    if require_excel and set(new_excel) != set(plan.page_errors):
+        return None
+
+    # 人間用：対象ページを置き換え、ページ間は空行1つで連結
+    preamble = "\n".join(plan.preamble).strip()
+    blocks = [preamble] if preamble else []
+    for number, page in enumerate(plan.pages, 1):
+        blocks.append("\n".join(replaced.get(number, page)).strip())
+
+    # Excel用：対象ページの行をまとめて置き換え（元の行がないページはページ順の位置に挿入）
+    rows, inserted = [], set()
+    for row, page in zip(plan.excel_rows, _excel_page_numbers(plan.excel_rows)):
+        for number in sorted(new_excel):
+            if number not in inserted and page is not None and number <= page:
+                rows.extend(new_excel[number])
+                inserted.add(number)
+        if page in new_excel:
+            continue
+        rows.append(row)
+    for number in sorted(new_excel):
+        if number not in inserted:
+            rows.extend(new_excel[number])
+
+    return "\n\n".join(blocks), "\n".join(rows)
+
+
+def derive_excel(human_text: str) -> str:
+    """人間用テキストからExcel用（page : line : text_ja : ）を決定的に導出
+
+    各ページの見出し行を除く非空行を順に line 1, 2, ... とする。
+    text_ja 内の半角 ":" は列区切りと紛れるため全角 "：" に置き換える。
+    """
+    rows = []
+    for page in split_pages(human_text)[1]:
+        number = _PAGE_HEADING_RE.match(page[0]).group(1)
+        line_num = 0
+        for line in page[1:]:
+            text = line.strip()
+            if text:
+                line_num += 1
+                rows.append(f"{int(number)} : {line_num} : {text.replace(':', '：')} : ")
+    return "\n".join(rows)
+
+
+def renumber_pages(human_text: str) -> str:
+    """ページ見出しの番号を1から順に振り直す"""
+    number = 0
+    lines = human_text.split('\n')
+    for i, line in enumerate(lines):
+        if is_page_heading(line):
+            number += 1
+            lines[i] = f"{number}{line[_PAGE_HEADING_RE.match(line).end(1):]}"
+    return "\n".join(lines)
+
+
+def clear_text_en(excel_text: str) -> str:
+    """text_en列に書かれた文字を消して空欄にする"""
+    rows = []
+    for row in excel_text.split('\n'):
+        stripped = row.strip()
+        if stripped.count(':') == 3 and stripped.rsplit(':', 1)[1].strip():
+            row = stripped.rsplit(':', 1)[0].rstrip() + " : "
+        rows.append(row)
+    return "\n".join(rows)
+
+
+def is_mechanical_error(error: str, line: Optional[str] = None) -> bool:
+    """fix_mechanical で直せる種類のエラーか（ページ番号・Excel行）
+
+    line（エラーが確定した行）を渡した場合、ページ番号飛びはその行がページ見出しのときだけ直せるとみなす。
+    """
+    if line is not None and error.startswith(_PAGE_JUMP_ERROR_PREFIX) and not is_page_heading(line):
+        return False
+    return error.startswith(_PAGE_ERROR_PREFIXES) or bool(_EXCEL_ERROR_RE.match(error))
+
+
+def fix_mechanical(human_text: str, excel_text: str,
+                   errors: List[str]) -> Optional[Tuple[str, str, List[str]]]:
+    """LLMを呼ばずに直せるエラーを修正し、(人間用, Excel用, 適用した修正) を返す（修正なしはNone）
+
+    - ページ番号飛び・1ページ開始：見出しの番号を振り直す（見出し以外の "2.5トン" のような行が原因の場合は
+      本文を書き換えてしまうので直さず、部分修正・再生成に任せる）
+    - text_en記入のみ：text_en列を空欄にする
+    - それ以外のExcel行の形式不正（またはページ番号を振り直した場合）：Excel用を人間用から導出し直す
+    """
+    fixes = []
+    if (any(error.startswith(_PAGE_ERROR_PREFIXES) for error in errors)
+            and not has_non_heading_page_lines(human_text)):
+        renumbered = renumber_pages(human_text)
+        if renumbered != human_text:
+            human_text = renumbered
+            fixes.append("ページ番号を振り直し")
+    # text_en が書かれた行は形式不正にもなるため、それ以外の形式不正があるときだけ導出し直す
+    format_rows, text_en_rows = set(), set()
+    for error in errors:
+        match = _EXCEL_ERROR_RE.match(error)
+        if match:
+            (text_en_rows if "text_en列" in error else format_rows).add(int(match.group(1)))
+    if fixes or not format_rows <= text_en_rows:
+        derived = derive_excel(human_text)
+        if derived and derived != excel_text:
+            excel_text = derived
+            fixes.append("Excel用を人間用から導出")
+    elif text_en_rows:
+        cleared = clear_text_en(excel_text)
+        if cleared != excel_text:
+            excel_text = cleared
+            fixes.append("text_en列を空欄化")
+    return (human_text, excel_text, fixes) if fixes else None
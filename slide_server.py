@@ -0,0 +1,318 @@
+"""
+常駐生成サーバー（標準ライブラリのHTTPサーバー）
+1つのジェネレータ・知識インデックスをメモリに保持したまま、ジョブの投入・状態確認・結果取得と
+バリデートをHTTPで受け付ける
+
+  POST /jobs              ジョブ投入（バッチのジョブ定義と同じJSON）→ 202 {"job_id", "state"}
+  GET  /jobs/<job_id>     状態（queued / running / done / failed）
+  GET  /jobs/<job_id>/result  結果（人間用・Excel用・統計）
+  POST /validate          {"human": ..., "excel": ...} または {"text": 生成出力} → バリデートレポート
+  GET  /health            キュー・ワーカー・バックエンドの状態
+  GET  /metrics           段階ごとの時間・LLM呼び出し・ジョブ件数（Prometheusのテキスト形式）
+"""
+
+import json
+import logging
+import queue
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional, Tuple
+
+from bulk_validate import error_type
+from metrics import get_metrics_registry
+from validator import SlideValidator
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+DEFAULT_SERVER_WORKERS = 2
+DEFAULT_QUEUE_SIZE = 100
+# 完了したジョブの状態をメモリに残す件数（超えたら古いものから忘れる）
+MAX_FINISHED_JOBS = 1000
+# リクエストボディの上限（参考資料テキストを含むため大きめ）
+MAX_BODY_BYTES = 16 * 1024 * 1024
+# HTTPで受け付けないジョブのキー（サーバーのファイルを読み書きするため。参考資料は reference_text で渡す）
+FORBIDDEN_JOB_KEYS = ("output", "reference")
+# job_id は出力ディレクトリ名になるので、英数字で始まる英数字・"_"・"-"・"." のみ受け付ける
+JOB_ID_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.-]{0,127}")
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_metrics = get_metrics_registry()
+SERVER_JOBS = _metrics.counter(
+    "slidegen_server_jobs_total", "サーバーで処理を終えたジョブ数（state: done / failed）", ("state",))
+SERVER_JOB_SECONDS = _metrics.histogram(
+    "slidegen_server_job_seconds", "ジョブの処理時間（秒、キュー待ちを含まない）")
+SERVER_QUEUE_WAIT_SECONDS = _metrics.histogram(
+    "slidegen_server_queue_wait_seconds", "ジョブのキュー待ち時間（秒）")
+SERVER_QUEUED = _metrics.gauge("slidegen_server_queued_jobs", "キューで待っているジョブ数")
+SERVER_RUNNING = _metrics.gauge("slidegen_server_running_jobs", "実行中のジョブ数")
+
+
+class QueueFull(Exception):
+    """ジョブキューが満杯"""
+
+
+class JobManager:
+    """上限付きジョブキューとワーカースレッド
+
+    run_job(job) はバッチのジョブ1件を実行してサマリー（main.run_batch_job の戻り値）を返す関数。
+    """
+
+    def __init__(self, run_job: Callable[[Dict], Dict], workers: int = DEFAULT_SERVER_WORKERS,
+                 queue_size: int = DEFAULT_QUEUE_SIZE, health_info: Optional[Callable[[], Dict]] = None):
+        self.run_job = run_job
+        self.health_info = health_info
+        self.workers = max(1, workers)
+        self.queue: "queue.Queue[str]" = queue.Queue(maxsize=max(1, queue_size))
+        self.jobs: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._worker, daemon=True, name=f"slide-worker-{i + 1}")
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, job: Dict) -> Dict:
+        """ジョブを投入して状態を返す（キューが満杯なら QueueFull、不正なジョブ・ID重複は ValueError）"""
+        if not job.get("theme"):
+            raise ValueError("theme が必要です")
+        forbidden = [key for key in FORBIDDEN_JOB_KEYS if key in job]
+        if forbidden:
+            raise ValueError(f"サーバーでは指定できないキーです: {', '.join(forbidden)}")
+        job_id = str(job.get("job_id") or uuid.uuid4().hex[:12])
+        if not JOB_ID_PATTERN.fullmatch(job_id):
+            raise ValueError(f"job_id に使えない文字が含まれています: {job_id!r}")
+        job = dict(job, job_id=job_id)
+        with self._lock:
+            if job_id in self.jobs:
+                raise ValueError(f"job_id が重複しています: {job_id}")
+            record = {"job_id": job_id, "state": QUEUED, "submitted_at": time.time(), "job": job}
+            self.jobs[job_id] = record
+            try:
+                self.queue.put_nowait(job_id)
+            except queue.Full:
+                del self.jobs[job_id]
+                raise QueueFull(f"ジョブキューが満杯です（{self.queue.maxsize}件）")
+            return self._status(record)
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            record = self.jobs.get(job_id)
+            return self._status(record) if record else None
+
+    def result(self, job_id: str) -> Optional[Dict]:
+        """完了したジョブの結果（未完了なら状態のみ）"""
+        with self._lock:
+            record = self.jobs.get(job_id)
+            if record is None:
+                return None
+            status = self._status(record)
+            summary = record.get("summary")
+        if status["state"] not in (DONE, FAILED):
+            return status
+        status["summary"] = summary
+        files = (summary or {}).get("files") or {}
+        for key, file_key in (("human", "human_file"), ("excel", "excel_file")):
+            try:
+                with open(files[file_key], "r", encoding="utf-8") as f:
+                    status[key] = f.read()
+            except (KeyError, OSError):
+                status[key] = None
+        return status
+
+    def health(self) -> Dict:
+        with self._lock:
+            states = {}
+            for record in self.jobs.values():
+                states[record["state"]] = states.get(record["state"], 0) + 1
+        health = {
+            "status": "ok",
+            "workers": self.workers,
+            "queue_size": self.queue.maxsize,
+            "queued": self.queue.qsize(),
+            "jobs": states,
+        }
+        if self.health_info:
+            health.update(self.health_info())
+        return health
+
+    @staticmethod
+    def _status(record: Dict) -> Dict:
+        status = {key: value for key, value in record.items() if key not in ("job", "summary")}
+        summary = record.get("summary")
+        if summary:
+            status["status"] = summary.get("status")
+            status["validation_passed"] = summary.get("validation_passed")
+            status["elapsed_sec"] = summary.get("elapsed_sec")
+        return status
+
+    def _worker(self) -> None:
+        while True:
+            job_id = self.queue.get()
+            with self._lock:
+                record = self.jobs.get(job_id)
+                if record is None:
+                    continue
+                record["state"] = RUNNING
+                record["started_at"] = time.time()
+                job = record["job"]
+            SERVER_QUEUE_WAIT_SECONDS.observe(record["started_at"] - record["submitted_at"])
+            SERVER_RUNNING.inc()
+            try:
+                summary = self.run_job(job)
+                state = DONE if summary.get("status") != "error" else FAILED
+            except Exception as e:
+                summary = {"job_id": job_id, "status": "error", "validation_passed": False, "error": str(e)}
+                state = FAILED
+            SERVER_RUNNING.inc(-1)
+            SERVER_JOBS.inc(state=state)
+            with self._lock:
+                record["state"] = state
+                record["finished_at"] = time.time()
+                SERVER_JOB_SECONDS.observe(record["finished_at"] - record["started_at"])
+                record["summary"] = summary
+                # 終わったジョブの定義（参考資料テキストを含む）はメモリに残さない
+                record.pop("job", None)
+                if summary.get("error"):
+                    record["error"] = summary["error"]
+                self._forget_old_jobs()
+
+    def _forget_old_jobs(self) -> None:
+        """完了済みジョブが MAX_FINISHED_JOBS を超えたら古いものから削除（ロック保持中に呼ぶ）"""
+        finished = [job_id for job_id, record in self.jobs.items() if record["state"] in (DONE, FAILED)]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+
+def validate_payload(payload: Dict) -> Dict:
+    """/validate のリクエストをバリデート（"text" は生成出力全体を "Excel:" で分割する）"""
+    if "text" in payload:
+        text = str(payload["text"])
+        human_text, _, excel_text = text.partition("Excel:")
+        lines = human_text.strip().split('\n')
+        if lines and '5重チェック' in lines[0]:
+            lines = lines[1:]
+        human_text, excel_text = '\n'.join(lines).strip(), excel_text.strip()
+    else:
+        human_text, excel_text = str(payload.get("human", "")), str(payload.get("excel", ""))
+    report = SlideValidator().get_validation_report(human_text, excel_text)
+    report["error_types"] = sorted({error_type(error) for error in report["errors"]})
+    return report
+
+
+class SlideRequestHandler(BaseHTTPRequestHandler):
+    """JSON API のリクエストハンドラ（server.manager に JobManager を持つ）"""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "SlideServer/1.0"
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def _send(self, status: int, data: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_json(self, status: int, body: Dict) -> None:
+        self._send(status, json.dumps(body, ensure_ascii=False).encode("utf-8"), "application/json; charset=utf-8")
+
+    def _read_json(self) -> Tuple[Optional[Dict], Optional[str]]:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            return None, "リクエストが大きすぎます"
+        try:
+            payload = json.loads(self.rfile.read(length).decode("utf-8") or "{}")
+        except (UnicodeDecodeError, ValueError) as e:
+            return None, f"JSONの解析に失敗: {e}"
+        if not isinstance(payload, dict):
+            return None, "JSONオブジェクトを送ってください"
+        return payload, None
+
+    def do_GET(self) -> None:
+        manager: JobManager = self.server.manager
+        parts = [part for part in self.path.split("?", 1)[0].split("/") if part]
+        if parts == ["health"]:
+            self._send_json(200, manager.health())
+        elif parts == ["metrics"]:
+            SERVER_QUEUED.set(manager.queue.qsize())
+            self._send(200, get_metrics_registry().render().encode("utf-8"), PROMETHEUS_CONTENT_TYPE)
+        elif len(parts) == 2 and parts[0] == "jobs":
+            status = manager.status(parts[1])
+            if status is None:
+                self._send_json(404, {"error": "ジョブが見つかりません"})
+            else:
+                self._send_json(200, status)
+        elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "result":
+            result = manager.result(parts[1])
+            if result is None:
+                self._send_json(404, {"error": "ジョブが見つかりません"})
+            elif result["state"] in (DONE, FAILED):
+                self._send_json(200, result)
+            else:
+                self._send_json(409, result)
+        else:
+            self._send_json(404, {"error": "不明なパスです"})
+
+    def do_POST(self) -> None:
+        manager: JobManager = self.server.manager
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path not in ("/jobs", "/validate"):
+            self._send_json(404, {"error": "不明なパスです"})
+            return
+        payload, error = self._read_json()
+        if error:
+            self._send_json(400, {"error": error})
+        elif path == "/validate":
+            self._send_json(200, validate_payload(payload))
+        else:
+            try:
+                self._send_json(202, manager.submit(payload))
+            except QueueFull as e:
+                self._send_json(429, {"error": str(e)})
+            except ValueError as e:
+                self._send_json(400, {"error": str(e)})
+
+
+def create_server(manager: JobManager, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+    """サーバーを作成（serve_forever は呼び出し側で行う）"""
+    server = ThreadingHTTPServer((host, port), SlideRequestHandler)
+    server.daemon_threads = True
+    server.manager = manager
+    return server
+
+
+def run_server(run_job: Callable[[Dict], Dict], host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+               workers: int = DEFAULT_SERVER_WORKERS, queue_size: int = DEFAULT_QUEUE_SIZE,
+               health_info: Optional[Callable[[], Dict]] = None) -> None:
+    """サーバーを起動し、Ctrl-Cまで待ち受ける"""
+    manager = JobManager(run_job, workers, queue_size, health_info)
+    server = create_server(manager, host, port)
+    print(f"=== 生成サーバー起動: http://{host}:{server.server_address[1]} ===")
+    print(f"ワーカー数: {manager.workers} / キュー上限: {queue_size}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nサーバーを停止します")
+    finally:
+        server.server_close()
+
+
+# 使用例
+if __name__ == "__main__":
+    # バリデートのみのサーバー（ジョブはエコーするだけ）
+    run_server(lambda job: {"job_id": job["job_id"], "status": "ok", "validation_passed": False})
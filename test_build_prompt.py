@@ -0,0 +1,38 @@
+"""
+プロンプト構築のテスト
+build_prompt に token_budget=0 / fewshot_token_budget=0 を明示した場合に既定値へ戻さず、
+削れるセクション（辞書・参考資料抜粋・Few-shot例）を載せないことを確認する
+
+  python -m pytest -q test_build_prompt.py
+"""
+
+import unittest
+
+from llm_generator import GenerationConfig, LLMSlideGenerator
+
+USER_INPUT = "フォークリフトの点検"
+CHUNKS = [{"title": "安全衛生テキスト", "page": 1, "snippet": "フォークリフトは始業前に点検する"}]
+
+
+class BuildPromptBudgetTest(unittest.TestCase):
+    def setUp(self):
+        self.generator = LLMSlideGenerator(GenerationConfig(use_cache=False))
+
+    def test_default_budget_keeps_optional_sections(self):
+        prompt = self.generator.build_prompt(USER_INPUT, CHUNKS)
+        self.assertIn(CHUNKS[0]["snippet"], prompt)
+
+    def test_zero_token_budget_is_honoured(self):
+        prompt = self.generator.build_prompt(USER_INPUT, CHUNKS, token_budget=0)
+        self.assertNotIn(CHUNKS[0]["snippet"], prompt)
+        self.assertIn(f"[ユーザー入力]\n{USER_INPUT}", prompt)
+
+    def test_zero_fewshot_budget_is_honoured(self):
+        prompt = self.generator.build_prompt(USER_INPUT, CHUNKS, fewshot_token_budget=0)
+        examples = prompt.split("[出力例]\n", 1)[1].split("[参考資料 抜粋]", 1)[0]
+        self.assertEqual(examples.strip(), "")
+        self.assertIn(CHUNKS[0]["snippet"], prompt)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+"""
+ユニットの連結のテスト
+stitch_units が各ユニットの本文にある "2.5トンまで積める" のような行を独立したページにせず、
+ページ番号の振り直しやExcel用の導出で書き換えないことを確認する
+
+  python -m pytest -q test_multi_unit.py
+"""
+
+import unittest
+
+from multi_unit import stitch_units
+from slide_repair import derive_excel, split_pages
+
+DECIMAL_LINE = "2.5トンまで積める"
+TITLES = ["作業前点検", "走行と荷役"]
+
+
+def unit_output(number: int) -> str:
+    """1ユニット分の人間用テキスト（導入ページに小数で始まる行を含む）"""
+    return f"""1. 表紙
+フォークリフト安全
+小まとめ：今日の目標を決める
+
+2. ユニット表紙
+第{number}ユニット：{TITLES[number - 1]}
+
+3. 導入
+{DECIMAL_LINE}
+点検していますか？
+
+4. 総括
+今日のまとめ"""
+
+
+class StitchUnitsTest(unittest.TestCase):
+    def setUp(self):
+        self.stitched = stitch_units("フォークリフト安全", TITLES, [unit_output(1), unit_output(2)])
+
+    def test_decimal_line_stays_in_its_page(self):
+        _, pages = split_pages(self.stitched)
+        self.assertEqual([page[0] for page in pages],
+                         ["1. 表紙", "2. ユニット表紙", "3. 導入", "4. ユニット表紙", "5. 導入", "6. 総括"])
+        self.assertEqual(pages[2][1], DECIMAL_LINE)
+        self.assertEqual(pages[4][1], DECIMAL_LINE)
+
+    def test_decimal_line_is_not_renumbered(self):
+        self.assertEqual(self.stitched.count(f"\n{DECIMAL_LINE}\n"), 2)
+        self.assertNotIn("5トンまで積める\n", self.stitched.replace(DECIMAL_LINE, ""))
+
+    def test_derived_excel_matches_content(self):
+        rows = derive_excel(self.stitched).split("\n")
+        self.assertIn(f"3 : 1 : {DECIMAL_LINE} : ", rows)
+        self.assertIn(f"5 : 1 : {DECIMAL_LINE} : ", rows)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+"""
+機械的な自動修正のテスト
+"2.5トンまで積める" のように数字と "." で始まる本文の行をページ見出しとして扱わず、
+その行が原因のページ番号飛びを番号の振り直しで「直して」本文を書き換えないことを確認する
+
+  python -m pytest -q test_slide_repair.py
+"""
+
+import unittest
+
+from benchmark import make_deck
+from slide_repair import (
+    derive_excel, fix_mechanical, is_mechanical_error, is_page_heading, renumber_pages, split_pages,
+)
+from validator import SlideValidator
+
+DECIMAL_LINE = "2.5トンまで積める"
+
+
+def deck_with_decimal_line(pages: int = 6) -> str:
+    """3ページ目の本文に小数で始まる行を入れた人間用テキスト"""
+    human = make_deck(pages)[1]
+    return human.replace("\n\n4. ", f"\n{DECIMAL_LINE}\n\n4. ", 1)
+
+
+class PageHeadingTest(unittest.TestCase):
+    def test_heading_detection(self):
+        self.assertTrue(is_page_heading("3. 導入"))
+        self.assertTrue(is_page_heading("12 . まとめ"))
+        self.assertTrue(is_page_heading("3. 5S活動とは"))
+        self.assertTrue(is_page_heading("3."))
+        self.assertFalse(is_page_heading(DECIMAL_LINE))
+        self.assertFalse(is_page_heading("1.5m以上離れる"))
+        self.assertFalse(is_page_heading("フォークリフト 3. 導入"))
+
+    def test_split_pages_keeps_decimal_line_in_page(self):
+        _, pages = split_pages(deck_with_decimal_line())
+        self.assertEqual(len(pages), 6)
+        self.assertIn(DECIMAL_LINE, pages[2])
+
+    def test_renumber_pages_keeps_decimal_line(self):
+        human = deck_with_decimal_line()
+        jumped = human.replace("\n\n5. ", "\n\n7. ", 1)
+        renumbered = renumber_pages(jumped)
+        self.assertEqual(renumbered, human)
+        self.assertIn(DECIMAL_LINE, renumbered)
+
+    def test_derive_excel_keeps_decimal_line_as_row(self):
+        excel = derive_excel(deck_with_decimal_line())
+        self.assertIn(f"3 : 4 : {DECIMAL_LINE} : ", excel.split("\n"))
+        self.assertNotIn("2 : 1 : 5トンまで積める : ", excel)
+
+
+class FixMechanicalTest(unittest.TestCase):
+    def test_refuses_page_fix_caused_by_decimal_line(self):
+        human = deck_with_decimal_line()
+        excel = derive_excel(human)
+        is_valid, errors = SlideValidator().validate_all(human, excel)
+        self.assertFalse(is_valid)
+        self.assertTrue(any(error.startswith("ページ番号が飛んでいます") for error in errors))
+        fixed = fix_mechanical(human, excel, errors)
+        if fixed is not None:
+            # Excel用の修正はあってもよいが、人間用（本文・ページ番号）は書き換えない
+            self.assertEqual(fixed[0], human)
+            self.assertFalse(SlideValidator().validate_all(fixed[0], fixed[1])[0])
+
+    def test_still_renumbers_real_page_jump(self):
+        human = make_deck(6)[1]
+        jumped = human.replace("\n\n4. ", "\n\n5. ", 1).replace("\n\n5. 理由", "\n\n6. 理由", 1)
+        excel = derive_excel(jumped)
+        _, errors = SlideValidator().validate_all(jumped, excel)
+        fixed = fix_mechanical(jumped, excel, errors)
+        self.assertIsNotNone(fixed)
+        self.assertEqual(fixed[0], human)
+        self.assertEqual(SlideValidator().validate_all(fixed[0], fixed[1]), (True, []))
+
+    def test_stream_abort_only_defers_heading_page_jumps(self):
+        error = "ページ番号が飛んでいます: 4を期待、2が検出"
+        self.assertTrue(is_mechanical_error(error))
+        self.assertTrue(is_mechanical_error(error, "2. 導入"))
+        self.assertFalse(is_mechanical_error(error, DECIMAL_LINE))
+        self.assertTrue(is_mechanical_error("Excel行3: text_en列は空欄である必要があります", DECIMAL_LINE))
+
+
+if __name__ == "__main__":
+    unittest.main()
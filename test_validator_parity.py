@@ -0,0 +1,175 @@
+"""
+バリデータの互換性テスト
+正規表現で書かれていた元の SlideValidator（1パス化する前の実装）を基準として固定し、
+SlideValidator.validate_all / get_validation_report と IncrementalSlideValidator.feed / finish が
+固定のコーパスで同じ結果を返すことを確認する
+
+  python -m pytest -q test_validator_parity.py
+  python test_validator_parity.py
+"""
+
+import re
+import unittest
+from typing import Dict, List, Tuple
+
+from benchmark import make_deck
+from llm_generator import LLMSlideGenerator
+from validator import IncrementalSlideValidator, SlideValidator
+
+
+class BaselineSlideValidator:
+    """1パス化する前の SlideValidator のバリデート部分（基準として変更しない）"""
+
+    def __init__(self):
+        self.errors = []
+
+    def validate_all(self, human_text: str, excel_text: str) -> Tuple[bool, List[str]]:
+        self.errors = []
+        self._validate_human_format(human_text)
+        self._validate_excel_format(excel_text)
+        return len(self.errors) == 0, self.errors
+
+    def _validate_human_format(self, text: str) -> None:
+        lines = text.split('\n')
+
+        if not re.search(r'^1\s*\.', text, re.M):
+            self.errors.append("1ページから開始していない")
+
+        for line_num, line in enumerate(lines, 1):
+            if line.strip() and len(line.strip()) > 50:
+                self.errors.append(f"行{line_num}: 50字を超える行があります ({len(line.strip())}字)")
+
+        required_slides = ['表紙', 'ユニット', '導入', 'NG', '理由', '正解']
+        for req in required_slides:
+            if req not in text:
+                self.errors.append(f"必須スライド '{req}' が見つかりません")
+
+        if not (re.search(r'問いかけ|小まとめ|どう思いますか？|いかがでしょうか？', text)):
+            self.errors.append("問いかけまたは小まとめが見つかりません")
+
+        page_numbers = re.findall(r'^(\d+)\s*\.', text, re.M)
+        if page_numbers:
+            for i, page_str in enumerate(page_numbers):
+                expected = i + 1
+                actual = int(page_str)
+                if actual != expected:
+                    self.errors.append(f"ページ番号が飛んでいます: {expected}を期待、{actual}が検出")
+
+    def _validate_excel_format(self, text: str) -> None:
+        lines = [line.strip() for line in text.split('\n') if line.strip()]
+
+        excel_pattern = r'^\d+\s*:\s*\d+\s*:\s*.+\s*:\s*$'
+
+        for line_num, line in enumerate(lines, 1):
+            if not re.match(excel_pattern, line):
+                self.errors.append(f"Excel行{line_num}: 不正な形式 (page:line:text_ja:text_en が必要)")
+
+        for line_num, line in enumerate(lines, 1):
+            parts = line.split(':')
+            if len(parts) == 4 and parts[3].strip():
+                self.errors.append(f"Excel行{line_num}: text_en列は空欄である必要があります")
+
+    def get_validation_report(self, human_text: str, excel_text: str) -> Dict:
+        is_valid, errors = self.validate_all(human_text, excel_text)
+        return {
+            'is_valid': is_valid,
+            'errors': errors,
+            'stats': {
+                'human_lines': len([line for line in human_text.split('\n') if line.strip()]),
+                'excel_lines': len([line for line in excel_text.split('\n') if line.strip()]),
+                'total_pages': len(re.findall(r'^\d+\s*\.', human_text, re.M)),
+            },
+        }
+
+
+def split_output(generated: str) -> Tuple[str, str]:
+    """生成出力を人間用とExcel用に分ける（LLMSlideGenerator._split_output と同じ）"""
+    return LLMSlideGenerator._split_output(None, generated)
+
+
+def _replace_page(generated: str, old: str, new: str) -> str:
+    assert old in generated
+    return generated.replace(old, new, 1)
+
+
+def build_corpus() -> Dict[str, str]:
+    """生成出力（5重チェック行・人間用・"Excel:"・Excel用）の固定コーパス"""
+    demo = LLMSlideGenerator._demo_response(None)
+    deck = make_deck(12)[0]
+    human, excel = split_output(deck)
+    corpus = {
+        "demo": demo,
+        "deck_1": make_deck(1)[0],
+        "deck_12": deck,
+        "deck_60": make_deck(60)[0],
+        "empty": "",
+        "no_excel": human,
+        "excel_only": f"Excel:\n{excel}",
+        "leading_blank_lines": f"\n\n  {deck}",
+        "check_line_only": "5重チェック：OK\n\nExcel:\n",
+        "page_jump": _replace_page(deck, "\n\n4. ", "\n\n5. "),
+        "start_at_2": _replace_page(deck, "1. ", "2. "),
+        "page_with_space": _replace_page(deck, "\n\n3. ", "\n\n3 . "),
+        "long_line": _replace_page(deck, "\n\n2. ", "\n" + "あ" * 51 + "\n\n2. "),
+        "exactly_50": _replace_page(deck, "\n\n2. ", "\n" + "い" * 50 + "\n\n2. "),
+        "missing_required": deck.replace("NG", "ダメ").replace("理由", "わけ"),
+        "no_question": re.sub(r"問いかけ|小まとめ|どう思いますか？|いかがでしょうか？", "", deck),
+        "text_en_filled": deck.replace(" : \n", " : english\n", 2),
+        "excel_bad_rows": deck + "\nこれは不正な行\n3 : x : 本文 : \n1 : 2 : : \n",
+        "excel_extra_colons": deck + "\n1 : 9 : 時刻 12:30 : \n1 : 10 : a : b : c\n",
+        "number_inside_line": _replace_page(deck, "\n\n2. ", "\n 1. 字下げした番号\n\n2. "),
+        "fullwidth_digits": _replace_page(deck, "\n\n2. ", "\n\n２. "),
+        "crlf": deck.replace("\n", "\r\n"),
+        "tabs_and_spaces": deck.replace("\n\n", "\n \t\n"),
+        "excel_marker_mid_line": deck.replace("\n\nExcel:\n", "\n最後の行 Excel:1 : 1 : 続き : \n"),
+    }
+    return corpus
+
+
+CORPUS = build_corpus()
+
+
+def feed_incremental(generated: str) -> Tuple[IncrementalSlideValidator, List[str]]:
+    """生成出力を1行ずつ IncrementalSlideValidator に入力し、(バリデータ, 逐次のエラー) を返す"""
+    validator = IncrementalSlideValidator()
+    streamed = []
+    for line in generated.split("\n"):
+        streamed.extend(validator.feed(line))
+    return validator, streamed
+
+
+class ValidatorParityTest(unittest.TestCase):
+    def test_validate_all_matches_baseline(self):
+        for name, generated in CORPUS.items():
+            human, excel = split_output(generated)
+            with self.subTest(name):
+                self.assertEqual(SlideValidator().validate_all(human, excel),
+                                 BaselineSlideValidator().validate_all(human, excel))
+
+    def test_validation_report_matches_baseline(self):
+        for name, generated in CORPUS.items():
+            human, excel = split_output(generated)
+            with self.subTest(name):
+                report = SlideValidator().get_validation_report(human, excel)
+                expected = BaselineSlideValidator().get_validation_report(human, excel)
+                self.assertEqual({key: report[key] for key in expected}, expected)
+
+    def test_incremental_finish_matches_baseline(self):
+        for name, generated in CORPUS.items():
+            human, excel = split_output(generated)
+            with self.subTest(name):
+                validator, _ = feed_incremental(generated)
+                self.assertEqual(validator.finish(), BaselineSlideValidator().validate_all(human, excel))
+
+    def test_incremental_feed_reports_each_error_once(self):
+        # feed() が途中で返すエラーは finish() のエラーに含まれ、重複しない
+        for name, generated in CORPUS.items():
+            with self.subTest(name):
+                validator, streamed = feed_incremental(generated)
+                _, errors = validator.finish()
+                self.assertEqual(len(streamed), len(set(streamed)))
+                self.assertLessEqual(set(streamed), set(errors))
+
+
+if __name__ == "__main__":
+    unittest.main()
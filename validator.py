@@ -1,6 +1,169 @@
 import re
 from typing import Tuple, List, Dict
 
+# 人間用1行あたりの最大文字数
+MAX_LINE_LENGTH = 50
+# Excel形式の行（page : line : text_ja : text_en）
+EXCEL_LINE_PATTERN = r'^\d+\s*:\s*\d+\s*:\s*.+\s*:\s*$'
+# ページ見出し行（ページ番号）
+PAGE_NUMBER_PATTERN = r'^(\d+)\s*\.'
+# 必須スライド構成
+REQUIRED_SLIDES = ('表紙', 'ユニット', '導入', 'NG', '理由', '正解')
+
+# 判定パターンはimport時に1度だけコンパイルする
+_EXCEL_LINE_RE = re.compile(EXCEL_LINE_PATTERN)
+_PAGE_LINE_RE = re.compile(r'(\d+)\s*\.')
+# 数字だけの行（PAGE_NUMBER_PATTERN の \s* は改行をまたぐため、次の "." 行と組で見出しになりうる）
+_PAGE_DIGITS_ONLY_RE = re.compile(r'(\d+)\s*')
+_PAGE_DOT_CONTINUATION_RE = re.compile(r'\s*\.')
+_QUESTION_MARKERS = ('問いかけ', '小まとめ', 'どう思いますか？', 'いかがでしょうか？')
+# 必須スライドと問いかけの目印を1回の走査で拾う（目印同士は重なり合わないため findall で全て検出できる）
+_MARKER_RE = re.compile('|'.join(REQUIRED_SLIDES + _QUESTION_MARKERS))
+
+
+class _HumanScan:
+    """人間用テキストを1行ずつ分類し、全チェックを1パスで集計する"""
+    
+    __slots__ = ('line_num', 'nonblank_lines', 'long_line_errors', 'found_slides',
+                 'has_question', 'pages', '_pending_page')
+    
+    def __init__(self):
+        self.line_num = 0
+        self.nonblank_lines = 0
+        self.long_line_errors = []
+        self.found_slides = set()
+        self.has_question = False
+        self.pages = []  # 検出したページ番号（文字列）
+        self._pending_page = None
+    
+    def feed(self, line: str) -> None:
+        self.feed_lines((line,))
+    
+    def feed_lines(self, lines) -> None:
+        """行を順に分類（ループ内は属性参照を避けてローカル変数で処理）"""
+        line_num = self.line_num
+        nonblank = self.nonblank_lines
+        long_line_errors = self.long_line_errors
+        found = self.found_slides
+        has_question = self.has_question
+        markers_left = len(found) < len(REQUIRED_SLIDES) or not has_question
+        find_markers = _MARKER_RE.findall
+        pages = self.pages
+        pending = self._pending_page
+        
+        for line in lines:
+            line_num += 1
+            stripped = line.strip()
+            if not stripped:
+                # 空白のみの行はページ番号の判定に影響しない（保留中の数字行も維持）
+                continue
+            nonblank += 1
+            if len(stripped) > MAX_LINE_LENGTH:
+                long_line_errors.append(f"行{line_num}: 50字を超える行があります ({len(stripped)}字)")
+            if markers_left:
+                for marker in find_markers(line):
+                    if marker in _QUESTION_MARKERS:
+                        has_question = True
+                    else:
+                        found.add(marker)
+                markers_left = len(found) < len(REQUIRED_SLIDES) or not has_question
+            
+            # ページ番号（複数行にまたがる "数字 / 空行 / ." も元の正規表現と同様に扱う）
+            if pending is not None:
+                if _PAGE_DOT_CONTINUATION_RE.match(line):
+                    pages.append(pending)
+                    pending = None
+                    continue
+                pending = None
+            if not line[0].isdecimal():
+                continue
+            match = _PAGE_LINE_RE.match(line)
+            if match:
+                pages.append(match.group(1))
+                continue
+            match = _PAGE_DIGITS_ONLY_RE.fullmatch(line)
+            if match:
+                pending = match.group(1)
+        
+        self.line_num = line_num
+        self.nonblank_lines = nonblank
+        self.has_question = has_question
+        self._pending_page = pending
+    
+    def page_errors(self) -> List[str]:
+        errors = []
+        for i, page_str in enumerate(self.pages):
+            expected = i + 1
+            actual = int(page_str)
+            if actual != expected:
+                errors.append(f"ページ番号が飛んでいます: {expected}を期待、{actual}が検出")
+        return errors
+    
+    def errors(self) -> List[str]:
+        """SlideValidator._validate_human_format と同じ順序でエラーを返す"""
+        errors = []
+        if "1" not in self.pages:
+            errors.append("1ページから開始していない")
+        errors.extend(self.long_line_errors)
+        for req in REQUIRED_SLIDES:
+            if req not in self.found_slides:
+                errors.append(f"必須スライド '{req}' が見つかりません")
+        if not self.has_question:
+            errors.append("問いかけまたは小まとめが見つかりません")
+        errors.extend(self.page_errors())
+        return errors
+
+
+class _ExcelScan:
+    """Excel用テキストを1行ずつ分類し、全チェックを1パスで集計する"""
+    
+    __slots__ = ('line_num', 'format_errors', 'text_en_errors')
+    
+    def __init__(self):
+        self.line_num = 0
+        self.format_errors = []
+        self.text_en_errors = []
+    
+    def feed(self, line: str) -> None:
+        self.feed_lines((line,))
+    
+    def feed_lines(self, lines) -> None:
+        """行を順に分類（空行は行番号に数えない）"""
+        line_num = self.line_num
+        format_errors = self.format_errors
+        text_en_errors = self.text_en_errors
+        match_excel = _EXCEL_LINE_RE.match
+        
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            line_num += 1
+            if not match_excel(line):
+                format_errors.append(f"Excel行{line_num}: 不正な形式 (page:line:text_ja:text_en が必要)")
+            # text_en列が空欄か（4列の行のみ対象）
+            if line.count(':') == 3 and line.rsplit(':', 1)[1].strip():
+                text_en_errors.append(f"Excel行{line_num}: text_en列は空欄である必要があります")
+        
+        self.line_num = line_num
+    
+    def errors(self) -> List[str]:
+        """SlideValidator._validate_excel_format と同じ順序でエラーを返す"""
+        return self.format_errors + self.text_en_errors
+
+
+def _scan_human(text: str) -> _HumanScan:
+    scan = _HumanScan()
+    scan.feed_lines(text.split('\n'))
+    return scan
+
+
+def _scan_excel(text: str) -> _ExcelScan:
+    scan = _ExcelScan()
+    scan.feed_lines(text.split('\n'))
+    return scan
+
+
 class SlideValidator:
     """スライド台本の構造と形式をバリデートするクラス"""
     
@@ -20,53 +183,12 @@ class SlideValidator:
         return len(self.errors) == 0, self.errors
     
     def _validate_human_format(self, text: str) -> None:
-        """人間用テキストの形式をチェック"""
-        lines = text.split('\n')
-        
-        # ページ番号の開始チェック
-        if not re.search(r'^1\s*\.', text, re.M):
-            self.errors.append("1ページから開始していない")
-        
-        # 文字数制限チェック（50字以下）
-        for line_num, line in enumerate(lines, 1):
-            if line.strip() and len(line.strip()) > 50:
-                self.errors.append(f"行{line_num}: 50字を超える行があります ({len(line.strip())}字)")
-        
-        # 必須スライド構成チェック
-        required_slides = ['表紙', 'ユニット', '導入', 'NG', '理由', '正解']
-        for req in required_slides:
-            if req not in text:
-                self.errors.append(f"必須スライド '{req}' が見つかりません")
-        
-        # 問いかけ・小まとめの存在チェック
-        if not (re.search(r'問いかけ|小まとめ|どう思いますか？|いかがでしょうか？', text)):
-            self.errors.append("問いかけまたは小まとめが見つかりません")
-        
-        # ページ番号の連続性チェック
-        page_numbers = re.findall(r'^(\d+)\s*\.', text, re.M)
-        if page_numbers:
-            for i, page_str in enumerate(page_numbers):
-                expected = i + 1
-                actual = int(page_str)
-                if actual != expected:
-                    self.errors.append(f"ページ番号が飛んでいます: {expected}を期待、{actual}が検出")
+        """人間用テキストの形式をチェック（開始頁・文字数・必須スライド・問いかけ・頁番号の連続性）"""
+        self.errors.extend(_scan_human(text).errors())
     
     def _validate_excel_format(self, text: str) -> None:
-        """Excel用テキストの形式をチェック"""
-        lines = [line.strip() for line in text.split('\n') if line.strip()]
-        
-        # Excel形式の行チェック（page : line : text_ja : text_en）
-        excel_pattern = r'^\d+\s*:\s*\d+\s*:\s*.+\s*:\s*$'
-        
-        for line_num, line in enumerate(lines, 1):
-            if not re.match(excel_pattern, line):
-                self.errors.append(f"Excel行{line_num}: 不正な形式 (page:line:text_ja:text_en が必要)")
-        
-        # text_en列が空欄かチェック
-        for line_num, line in enumerate(lines, 1):
-            parts = line.split(':')
-            if len(parts) == 4 and parts[3].strip():
-                self.errors.append(f"Excel行{line_num}: text_en列は空欄である必要があります")
+        """Excel用テキストの形式をチェック（page : line : text_ja : text_en、text_enは空欄）"""
+        self.errors.extend(_scan_excel(text).errors())
     
     def validate_content_quality(self, text: str) -> None:
         """コンテンツ品質のチェック"""
@@ -90,13 +212,17 @@ class SlideValidator:
     
     def get_validation_report(self, human_text: str, excel_text: str) -> Dict[str, any]:
         """バリデート結果の詳細レポートを生成"""
-        is_valid, errors = self.validate_all(human_text, excel_text)
+        # バリデートと統計を同じ1パスの走査結果から求める
+        human_scan = _scan_human(human_text)
+        excel_scan = _scan_excel(excel_text)
+        self.errors = human_scan.errors() + excel_scan.errors()
+        is_valid, errors = len(self.errors) == 0, self.errors
         
         # 統計情報
-        human_lines = len([line for line in human_text.split('\n') if line.strip()])
-        excel_lines = len([line for line in excel_text.split('\n') if line.strip()])
+        human_lines = human_scan.nonblank_lines
+        excel_lines = excel_scan.line_num
         
-        pages = len(re.findall(r'^\d+\s*\.', human_text, re.M))
+        pages = len(human_scan.pages)
         
         return {
             'is_valid': is_valid,
@@ -127,6 +253,107 @@ class SlideValidator:
         
         return suggestions
 
+class IncrementalSlideValidator:
+    """生成出力を1行ずつ受け取り、validate_all と同じルールで逐次バリデートするクラス
+
+    入力は "Excel:" で人間用とExcel用に分かれた生成出力全体（LLMSlideGenerator._split_output と
+    同じ区切り方をする）。feed() は途中で確定したエラーをその場で返し、finish() は
+    validate_all(human_text, excel_text) と同じ結果を返す。
+    - 行ごとに確定：50字超・ページ番号飛び・Excel行の形式・text_en記入
+    - "Excel:" 到達時に確定：1ページ開始・必須スライド・問いかけ
+    """
+    
+    def __init__(self):
+        self.human = _HumanScan()
+        self.excel = _ExcelScan()
+        self.in_excel = False
+        self.page_line_counts = []  # ページごとの行数（見出し行を含む非空行）
+        self._human_started = False
+        self._skipped_check_line = False
+        self._pages_seen = 0
+        self._finished = None
+    
+    def feed(self, line: str) -> List[str]:
+        """完結した1行（改行なし）を入力し、新たに確定したエラーを返す"""
+        if self.in_excel:
+            return self._feed_excel(line)
+        if "Excel:" in line:
+            head, tail = line.split("Excel:", 1)
+            errors = self._feed_human(head)
+            self.in_excel = True
+            # 人間用テキストはここで終わるため、末尾まで見ないと決まらないエラーも確定する
+            errors.extend(self._human_final_errors())
+            return errors + self._feed_excel(tail)
+        return self._feed_human(line)
+    
+    def _feed_human(self, line: str) -> List[str]:
+        if not self._human_started:
+            # 先頭の空行は分割時の strip で除去され、行番号にも数えない
+            if not line.strip():
+                return []
+            if not self._skipped_check_line and '5重チェック' in line:
+                # 冒頭の5重チェック行は人間用から除去される（続く空行も strip で除去）
+                self._skipped_check_line = True
+                return []
+            self._human_started = True
+            self._skipped_check_line = True
+            line = line.lstrip()
+        
+        human = self.human
+        long_before = len(human.long_line_errors)
+        human.feed(line)
+        errors = human.long_line_errors[long_before:]
+        
+        if len(human.pages) > self._pages_seen:
+            self.page_line_counts.append(1)
+            self._pages_seen = len(human.pages)
+            actual = int(human.pages[-1])
+            if actual != self._pages_seen:
+                errors.append(f"ページ番号が飛んでいます: {self._pages_seen}を期待、{actual}が検出")
+        elif self.page_line_counts and line.strip():
+            self.page_line_counts[-1] += 1
+        return errors
+    
+    def _human_final_errors(self) -> List[str]:
+        """人間用テキスト終了時点で確定するエラー（1ページ開始・必須スライド・問いかけ）"""
+        errors = []
+        if "1" not in self.human.pages:
+            errors.append("1ページから開始していない")
+        for req in REQUIRED_SLIDES:
+            if req not in self.human.found_slides:
+                errors.append(f"必須スライド '{req}' が見つかりません")
+        if not self.human.has_question:
+            errors.append("問いかけまたは小まとめが見つかりません")
+        return errors
+    
+    def _feed_excel(self, line: str) -> List[str]:
+        excel = self.excel
+        format_before = len(excel.format_errors)
+        text_en_before = len(excel.text_en_errors)
+        excel.feed(line)
+        return excel.format_errors[format_before:] + excel.text_en_errors[text_en_before:]
+    
+    def finish(self) -> Tuple[bool, List[str]]:
+        """入力終了。validate_all と同じ (合否, エラー一覧) を返す"""
+        if self._finished is None:
+            errors = self.human.errors() + self.excel.errors()
+            self._finished = (len(errors) == 0, errors)
+        return self._finished
+    
+    def report(self) -> Dict[str, any]:
+        """入力終了後の詳細レポート（SlideValidator.get_validation_report と同じ形式）"""
+        is_valid, errors = self.finish()
+        return {
+            'is_valid': is_valid,
+            'errors': errors,
+            'stats': {
+                'human_lines': self.human.nonblank_lines,
+                'excel_lines': self.excel.line_num,
+                'total_pages': len(self.human.pages),
+            },
+            'suggestions': SlideValidator()._generate_suggestions(errors)
+        }
+
 # 使用例とテスト
 if __name__ == "__main__":
     validator = SlideValidator()
@@ -0,0 +1,239 @@
+"""
+知識チャンクのベクトルストア（メモリマップ）
+埋め込みをfloat32行列としてファイルに保存し、np.memmap で読み込んで類似検索する
+複数のワーカープロセスがOSのページキャッシュ上の同じ行列を共有できる
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from knowledge_index import (
+    DEFAULT_KNOWLEDGE_DIR, INDEX_FORMAT_VERSION, iter_knowledge_files, load_document_chunks, make_snippet,
+)
+from knowledge_ingest import ExtractionError, file_signature, index_dir
+
+DEFAULT_DIM = 512
+SEARCH_BATCH_ROWS = 65536
+
+
+class HashedNgramEmbedder:
+    """依存なしの既定埋め込み（文字n-gramの符号付きハッシュをdim次元に集約）"""
+
+    def __init__(self, dim: int = DEFAULT_DIM, ngram_sizes: Sequence[int] = (1, 2, 3)):
+        self.dim = dim
+        self.ngram_sizes = tuple(ngram_sizes)
+        self.name = f"hashed-ngram-{dim}-{'-'.join(map(str, self.ngram_sizes))}"
+
+    def _bucket(self, gram: str):
+        digest = hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        return value % self.dim, 1.0 if value >> 63 else -1.0
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """テキスト群をL2正規化済みの (len(texts), dim) 行列に変換"""
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            text = "".join(unicodedata.normalize("NFKC", text).lower().split())
+            for n in self.ngram_sizes:
+                for i in range(len(text) - n + 1):
+                    index, sign = self._bucket(text[i:i + n])
+                    matrix[row, index] += sign
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+
+class SentenceTransformerEmbedder:
+    """sentence-transformers による埋め込み（オプション依存）"""
+
+    def __init__(self, model_name: str = "intfloat/multilingual-e5-small"):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = f"sentence-transformers:{model_name}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = self.model.encode(texts, normalize_embeddings=True, convert_to_numpy=True)
+        return vectors.astype(np.float32, copy=False)
+
+
+class VectorStore:
+    """knowledge/ のチャンク埋め込みを保持するメモリマップ型ストア
+
+    - vectors-<世代>.f32: 行=チャンクのfloat32行列（ヘッダなし）
+    - meta.json: 次元・埋め込み名・行列ファイル名・チャンク情報・ファイルごとの署名と行範囲
+    更新時は変更のないファイルの行をコピーし、変更ファイルのみ再埋め込みする。
+    """
+
+    def __init__(self, root: str = DEFAULT_KNOWLEDGE_DIR, store_dir: Optional[str] = None,
+                 embedder=None):
+        self.root = root
+        self.store_dir = store_dir or os.path.join(index_dir(root), "vectors")
+        self.embedder = embedder or HashedNgramEmbedder()
+        self.meta_path = os.path.join(self.store_dir, "meta.json")
+        self.meta: Dict = {}
+        self.matrix: Optional[np.ndarray] = None
+        self._meta_mtime = None
+        self._lock = threading.RLock()
+        self._open()
+
+    def _open(self) -> None:
+        """保存済みの行列を読み取り専用でメモリマップ"""
+        try:
+            mtime = os.stat(self.meta_path).st_mtime_ns
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            self.meta, self.matrix, self._meta_mtime = {}, None, None
+            return
+        if meta.get("embedder") != self.embedder.name or meta.get("version") != INDEX_FORMAT_VERSION:
+            # 埋め込み方式・チャンク形式が異なるストアは使わない（次回 sync で作り直す）
+            self.meta, self.matrix, self._meta_mtime = {}, None, mtime
+            return
+        count = len(meta["chunks"])
+        self.meta = meta
+        self.matrix = (
+            np.memmap(os.path.join(self.store_dir, meta["vectors_file"]), dtype=np.float32,
+                      mode="r", shape=(count, meta["dim"]))
+            if count else np.zeros((0, meta["dim"]), dtype=np.float32)
+        )
+        self._meta_mtime = mtime
+
+    def _reopen_if_changed(self) -> None:
+        """他プロセスが更新した場合は開き直す"""
+        try:
+            mtime = os.stat(self.meta_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime != self._meta_mtime:
+            self._open()
+
+    def sync(self, batch_size: int = 256) -> Dict[str, int]:
+        """知識ディレクトリと同期（変更ファイルのみ再埋め込み）"""
+        with self._lock:
+            self._reopen_if_changed()
+            counts = {"added": 0, "updated": 0, "removed": 0}
+            old_files = self.meta.get("files", {})
+            new_files, chunks, pending = {}, [], []
+            # ファイル走査とチャンク分割はBM25インデックスと共通
+            for path in iter_knowledge_files(self.root):
+                rel_path = os.path.relpath(path, self.root)
+                try:
+                    signature = file_signature(path)
+                except OSError:
+                    # 走査後に削除・移動されたファイルは対象外（前回の埋め込みは削除扱い）
+                    continue
+                old = old_files.get(rel_path)
+                start = len(chunks)
+                if old and old["signature"] == signature and self.matrix is not None:
+                    chunks.extend(self.meta["chunks"][old["start"]:old["end"]])
+                    pending.append(("copy", old["start"], old["end"]))
+                else:
+                    try:
+                        doc_chunks = [dict(c, source=rel_path) for c in load_document_chunks(path, self.root)]
+                    except ExtractionError as e:
+                        print(f"警告: {e}")
+                        doc_chunks = []
+                    chunks.extend(doc_chunks)
+                    pending.append(("embed", start, start + len(doc_chunks)))
+                    counts["updated" if old else "added"] += 1
+                new_files[rel_path] = {"signature": signature, "start": start, "end": len(chunks)}
+            counts["removed"] = len(set(old_files) - set(new_files))
+
+            if not any(counts.values()) and self.matrix is not None:
+                return counts
+
+            os.makedirs(self.store_dir, exist_ok=True)
+            dim = self.embedder.dim
+            # 行列は世代ごとに別ファイルへ書き出す（既存の読み手のマップを壊さない）
+            vectors_file = f"vectors-{time.time_ns()}-{os.getpid()}.f32"
+            vectors_path = os.path.join(self.store_dir, vectors_file)
+            if chunks:
+                out = np.memmap(vectors_path, dtype=np.float32, mode="w+", shape=(len(chunks), dim))
+                row = 0
+                for kind, start, end in pending:
+                    if kind == "copy":
+                        out[row:row + end - start] = self.matrix[start:end]
+                        row += end - start
+                        continue
+                    for offset in range(start, end, batch_size):
+                        texts = [c["text"] for c in chunks[offset:min(end, offset + batch_size)]]
+                        out[row:row + len(texts)] = self.embedder.embed(texts)
+                        row += len(texts)
+                out.flush()
+                del out
+            else:
+                open(vectors_path, "wb").close()
+
+            meta = {"version": INDEX_FORMAT_VERSION, "embedder": self.embedder.name, "dim": dim,
+                    "vectors_file": vectors_file,
+                    "files": new_files, "chunks": chunks}
+            tmp_meta = f"{self.meta_path}.{os.getpid()}.tmp"
+            with open(tmp_meta, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            # メタの置き換えで新しい世代に切り替える（読み手はmtime変化で開き直す）
+            old_vectors = self.meta.get("vectors_file")
+            os.replace(tmp_meta, self.meta_path)
+            self._open()
+            if old_vectors and old_vectors != vectors_file:
+                try:
+                    os.remove(os.path.join(self.store_dir, old_vectors))
+                except OSError:
+                    pass
+            return counts
+
+    def search(self, query: str, top_k: int = 5) -> List[Dict]:
+        """クエリとのコサイン類似度上位チャンクを context_chunks 形式で返す"""
+        with self._lock:
+            self._reopen_if_changed()
+            matrix = self.matrix
+            chunks = self.meta.get("chunks", [])
+        if matrix is None or not len(chunks) or top_k <= 0:
+            return []
+
+        query_vec = self.embedder.embed([query])[0]
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        # 行列をバッチ単位で内積計算し、各バッチの上位候補だけを残す
+        for start in range(0, len(chunks), SEARCH_BATCH_ROWS):
+            scores = matrix[start:start + SEARCH_BATCH_ROWS] @ query_vec
+            k = min(top_k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            best_rows = np.concatenate([best_rows, top + start])
+            best_scores = np.concatenate([best_scores, scores[top]])
+
+        order = np.argsort(-best_scores)[:top_k]
+        results = []
+        for i in order:
+            if best_scores[i] <= 0:
+                break
+            chunk = chunks[int(best_rows[i])]
+            results.append({
+                'title': chunk.get('title', '不明'),
+                'page': chunk.get('page', '不明'),
+                'snippet': make_snippet(chunk['text']),
+                'source': chunk.get('source', ''),
+                'score': round(float(best_scores[i]), 4),
+            })
+        return results
+
+
+# 使用例
+if __name__ == "__main__":
+    import sys
+
+    store = VectorStore()
+    print(f"同期: {store.sync()}")
+    print(f"チャンク数: {len(store.meta.get('chunks', []))}")
+
+    query = sys.argv[1] if len(sys.argv) > 1 else "荷物の積載と荷崩れ"
+    print(f"\n検索: {query}")
+    for hit in store.search(query, top_k=5):
+        print(f"  [{hit['score']}] {hit['title']} p.{hit['page']}: {hit['snippet'][:60]}")